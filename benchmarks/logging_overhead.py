@@ -0,0 +1,60 @@
+"""
+Накладные расходы логирования на одно входящее сообщение
+
+Сравнивает прежнюю схему (синхронный sink, f-строки для всех уровней) с
+текущей (фоновый sink, ленивое форматирование debug, сэмплирование info).
+Sink имитирует медленный stdout: каждая запись занимает SINK_DELAY секунд.
+
+Запуск: python benchmarks/logging_overhead.py
+"""
+import random
+import time
+from loguru import logger
+
+MESSAGES = 2000
+SINK_DELAY = 0.0002
+SAMPLE_RATE = 0.1
+
+
+class SlowSink:
+    def write(self, message):
+        time.sleep(SINK_DELAY)
+
+
+def simulate_before(user_id: int, text: str):
+    logger.info(f"📨 Message from Test User (@test) (ID: {user_id}): {text[:100]}")
+    logger.info(f"Processing message from user {user_id}: {text[:50]}...")
+    logger.debug(f"Retrieved {len(text)} messages for user {user_id}")
+    logger.debug(f"✅ Request processed in {0.123:.3f}s for user {user_id}")
+
+
+def simulate_after(user_id: int, text: str):
+    with logger.contextualize(request_id=str(user_id)):
+        if SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE:
+            logger.info("📨 Message from {} (ID: {}): {}", "Test User (@test)", user_id, text[:100])
+        if SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE:
+            logger.info("Processing message from user {}: {}...", user_id, text[:50])
+        logger.debug("Retrieved {} messages for user {}", len(text), user_id)
+        logger.debug("✅ Request processed in {:.3f}s for user {}", 0.123, user_id)
+
+
+def run(simulate, enqueue: bool) -> float:
+    logger.remove()
+    logger.configure(extra={"request_id": "-"})
+    logger.add(SlowSink(), level="INFO", enqueue=enqueue, format="{extra[request_id]} {message}")
+    text = "Привет! " * 40
+
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        simulate(i, text)
+    elapsed = time.perf_counter() - start
+
+    logger.remove()  # дожидается выгрузки очереди, в замер не входит
+    return elapsed / MESSAGES * 1e6
+
+
+if __name__ == "__main__":
+    before = run(simulate_before, enqueue=False)
+    after = run(simulate_after, enqueue=True)
+    print(f"before: {before:8.1f} us/message (sync sink, f-strings)")
+    print(f"after:  {after:8.1f} us/message (enqueued sink, lazy debug, info sampled at {SAMPLE_RATE})")
@@ -0,0 +1,73 @@
+import os
+from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
+from loguru import logger
+
+from .config import settings
+
+# Очередь генерации определяется режимом общения: у RAG и hybrid другой
+# профиль нагрузки, и их пул масштабируется отдельно от OpenRouter
+GENERATION_QUEUES = {
+    "openrouter": "llm.openrouter",
+    "rag": "llm.rag",
+    "hybrid": "llm.hybrid",
+}
+
+celery_app = Celery(
+    "bot",
+    broker=settings.celery_broker_url or settings.redis_url,
+)
+
+
+def route_generation(name, args, kwargs, options, task=None, **kw):
+    """Направляет задачу генерации в очередь ее режима общения"""
+    if name == "bot.generate_reply":
+        return {"queue": GENERATION_QUEUES.get(kwargs.get("chat_mode"), GENERATION_QUEUES["openrouter"])}
+    return None
+
+
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    task_routes=(route_generation,),
+    task_default_queue=GENERATION_QUEUES["openrouter"],
+    # Задачи долгие: worker берет следующую, только освободившись.
+    # Задача подтверждается при получении и после падения worker не
+    # повторяется: генерация могла быть уже оплачена, а ответ - отправлен
+    worker_prefetch_multiplier=1,
+    task_acks_late=False,
+    task_time_limit=settings.celery_task_time_limit,
+    # Задачи с задержкой (ожидание очереди хода) брокер выдает повторно,
+    # если они не выполнены за visibility_timeout
+    broker_transport_options={"visibility_timeout": settings.celery_task_time_limit * 2},
+    # Результаты не читаются: ответ отправляет сама задача
+    task_ignore_result=True,
+    worker_hijack_root_logger=False,
+)
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """
+    Сервер метрик в главном процессе worker
+
+    Дочерние процессы prefork пишут метрики в PROMETHEUS_MULTIPROC_DIR,
+    главный процесс отдает их суммой.
+    """
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        logger.warning("PROMETHEUS_MULTIPROC_DIR is not set, generation metrics are not exported")
+        return
+
+    from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(settings.celery_metrics_port, registry=registry)
+    logger.info(f"Celery metrics server started on port {settings.celery_metrics_port}")
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -1,8 +1,16 @@
+import json
 import os
 from typing import List, Optional
-from pydantic import SecretStr, field_validator
+from pydantic import SecretStr, ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
 
+# Параметры сервиса в EXTERNAL_SERVICES (поля ServiceConfig, кроме name)
+EXTERNAL_SERVICE_PARAMS = frozenset({
+    "base_url", "api_key", "timeout", "connect_timeout", "limit", "limit_per_host",
+    "keepalive_timeout", "retries", "backoff", "compress_min_bytes",
+})
+
+
 class Settings(BaseSettings):
     """Конфигурация приложения с валидацией"""
     
@@ -10,6 +18,42 @@ class Settings(BaseSettings):
     telegram_bot_token: SecretStr
     telegram_webhook_url: Optional[str] = None
     telegram_webhook_secret: Optional[str] = None
+    bot_mode: str = "polling"  # polling или webhook
+    # standalone - все в одном процессе; ingress - прием обновлений в Redis Streams;
+    # worker - обработка обновлений из Redis Streams
+    bot_role: str = "standalone"
+    # Лимиты отправки Telegram (сообщений в секунду)
+    telegram_global_rate: float = 25.0
+    telegram_chat_rate: float = 1.0
+    telegram_chat_burst: int = 3
+    telegram_send_max_retries: int = 3
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_path: str = "/webhook"
+    webhook_max_in_flight: int = 100
+    # Остановка: сколько ждать начатые ходы и досылку очереди сообщений (секунды)
+    shutdown_drain_timeout: float = 25.0
+    shutdown_flush_timeout: float = 5.0
+    # Полосы обработки: одновременно обрабатываемые команды/кнопки и ходы LLM.
+    # Медленная полоса должна быть меньше пула соединений БД (15 по умолчанию)
+    lane_fast_concurrency: int = 50
+    lane_slow_concurrency: int = 10
+    # Очередь обновлений (Redis Streams) для ролей ingress/worker
+    update_stream_prefix: str = "updates"
+    update_stream_partitions: int = 16
+    update_stream_maxlen: int = 100000
+    # Отметки update_id (seen/done) живут только в окне повторной доставки: ретраи
+    # webhook и повтор getUpdates приходят в течение минут, а ключ на каждое
+    # обновление при TTL в сутки занял бы заметную часть памяти Redis.
+    # Должно с запасом превышать update_processing_timeout + update_partition_lease
+    # (перехват записей упавшего worker)
+    update_dedupe_ttl: int = 600
+    update_partition_lease: int = 15
+    # Предел обработки одного обновления worker: запись, не подтвержденная
+    # дольше этого, считается брошенной и перехватывается владельцем партиции
+    update_processing_timeout: int = 300
+    update_worker_max_in_flight: int = 100
+    update_polling_timeout: int = 30
     
     # OpenRouter API
     openrouter_api_key: SecretStr
@@ -18,25 +62,146 @@ class Settings(BaseSettings):
     max_tokens: int = 1000
     temperature: float = 0.7
     
+    # Объединение серий сообщений (0 - выключено)
+    message_coalesce_window: float = 1.0
+    message_coalesce_max_wait: float = 4.0
+    
+    # Token budgets (0 - без ограничений)
+    token_budget_daily: int = 0
+    token_budget_monthly: int = 0
+    token_budget_downgrade_model: Optional[str] = None  # дешевая модель для запросов сверх бюджета
+    # Цена токена дешевой модели относительно основной: ее запросы списываются
+    # с этим весом из отдельного бюджета того же размера
+    token_budget_downgrade_weight: float = 0.1
+    token_estimate_chars_per_token: float = 3.0
+    
     # Database
     database_url: str
     redis_url: str = "redis://localhost:6379/0"
     
+    # Выполнение генерации: local - в процессе бота, celery - в пуле worker
+    generation_mode: str = "local"
+    celery_broker_url: Optional[str] = None  # по умолчанию redis_url
+    celery_task_time_limit: int = 180
+    # Сколько ход ждет в очереди завершения предыдущего хода пользователя
+    generation_order_timeout: int = 600
+    celery_metrics_port: int = 9100
+    
+    # User preferences cache
+    preferences_cache_size: int = 10000
+    preferences_cache_ttl: int = 300
+    preferences_redis_ttl: int = 86400
+    
+    # Inline mode
+    inline_debounce: float = 0.7
+    inline_timeout: float = 8.0
+    inline_min_query_length: int = 3
+    inline_cache_ttl: int = 3600
+    inline_cache_time: int = 300  # cache_time для клиентов Telegram
+    
+    # History
+    history_page_size: int = 5
+    history_preview_length: int = 300
+    
+    # Archive
+    archive_database_url: Optional[str] = None  # реплика для выгрузки, по умолчанию database_url
+    archive_dir: str = "data/archive"
+    archive_chunk_size: int = 5000
+    archive_retain_days: int = 30
+    # Выгружаются только строки старше этого (секунды): created_at - время начала
+    # транзакции, поэтому лаг должен превышать самую долгую транзакцию и отставание реплики
+    archive_safety_lag: int = 3600
+    
     # Security
     secret_key: SecretStr
     allowed_user_ids: str = ""
-    rate_limit_messages: int = 10
+    # Бот открыт для всех. Если не задан, бот открыт, только когда пуст
+    # ALLOWED_USER_IDS (прежнее поведение, с предупреждением при запуске)
+    open_access: Optional[bool] = None
+    admin_user_ids: str = ""
+    access_denied_cache_ttl: int = 3600  # как часто повторно отвечать заблокированному пользователю
+    rate_limit_messages: int = 10  # 0 - без ограничений
     rate_limit_window: int = 60
+    rate_limit_tiers: str = ""  # "premium:60/60,unlimited:0/60" - тариф:сообщений/окно
+    rate_limit_user_tiers: str = ""  # "123456789:premium" - пользователь:тариф
+    rate_limit_local_prefilter: bool = True
     
     # Monitoring
     log_level: str = "INFO"
+    log_json: bool = False
+    log_sample_rates: str = ""  # "message:0.1,callback:0.5" - доля логируемых событий
     sentry_dsn: Optional[str] = None
-    metrics_port: int = 8000
+    metrics_port: int = 8000  # метрики, /health и /ready
+    # Пробы зависимостей для /ready выполняются в фоне раз в health_probe_interval секунд
+    health_probe_interval: float = 15.0
+    health_probe_timeout: float = 3.0
+    # /health отвечает 503, если цикл событий отстает больше чем на столько секунд
+    health_max_loop_lag: float = 5.0
+    # Сторож цикла событий пишет в лог стек кода, блокирующего цикл дольше loop_stall_threshold.
+    # blocking_call_detection (отладка) - предупреждать о time.sleep, requests, getaddrinfo и
+    # json.loads тел от blocking_json_min_bytes в потоке цикла
+    loop_stall_threshold: float = 0.5
+    blocking_call_detection: bool = False
+    blocking_json_min_bytes: int = 262144
+    # Трассировка: "" - выключена, jsonl - в файл tracing_jsonl_path, otlp - в коллектор.
+    # Сохраняется доля tracing_sample_rate трасс и все медленные и с ошибками
+    tracing_exporter: str = ""
+    tracing_jsonl_path: str = "logs/traces.jsonl"
+    tracing_otlp_endpoint: str = "http://localhost:4318"
+    tracing_service_name: str = "telegram-bot"
+    tracing_sample_rate: float = 0.01
+    tracing_slow_threshold: float = 5.0
+    # Профилирование по запросу (/profile администратора, /debug/* на порту метрик).
+    # HTTP маршруты включаются только при заданном profile_token
+    profile_token: Optional[SecretStr] = None
+    profile_default_seconds: float = 10.0
+    profile_max_seconds: float = 60.0
+    profile_interval: float = 0.01
     
     # External Services
     rag_service_url: Optional[str] = None
     rag_service_api_key: Optional[SecretStr] = None
     external_services_timeout: int = 30
+    # Пулы соединений и повторы запросов к внешним сервисам (значения по умолчанию,
+    # переопределяются для отдельного сервиса в EXTERNAL_SERVICES)
+    external_connect_timeout: float = 5.0
+    external_pool_limit: int = 100
+    external_pool_limit_per_host: int = 20
+    external_keepalive_timeout: float = 30.0
+    external_retries: int = 2
+    external_retry_backoff: float = 0.2
+    external_compress_min_bytes: int = 0  # сжимать gzip тела от N байт (0 - выключено)
+    # '{"billing": {"base_url": "http://billing:8000", "timeout": 5, "retries": 3}}'
+    external_services: str = ""
+    # Максимальный размер строки NDJSON / события SSE в потоковом ответе (байт)
+    external_stream_max_line: int = 1048576
+    # Circuit breaker внешних сервисов: доли ошибок и медленных ответов
+    # в окне последних вызовов, после которых запросы отклоняются сразу
+    breaker_failure_rate: float = 0.5
+    breaker_slow_call_seconds: float = 5.0
+    breaker_slow_call_rate: float = 0.8
+    breaker_window: int = 20
+    breaker_min_calls: int = 5
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_calls: int = 3
+    # Кеш ответов RAG (по нормализованному запросу и контексту)
+    rag_cache_size: int = 1000
+    rag_cache_ttl: int = 600
+    # Пакетные запросы к RAG: окно сбора (секунды) и максимальный размер пакета
+    rag_batch_enabled: bool = False
+    rag_batch_window: float = 0.005
+    rag_batch_max_size: int = 16
+    rag_batch_path: str = "/query/batch"
+    # Потоковые ответы RAG (NDJSON/SSE): ответ показывается по мере получения,
+    # сообщение правится не чаще stream_edit_interval секунд
+    rag_stream_enabled: bool = False
+    rag_stream_path: str = "/query/stream"
+    rag_health_path: str = "/health"
+    stream_edit_interval: float = 1.5
+    # Гибридный режим: генерация без RAG параллельно с запросом к RAG
+    hybrid_speculative: bool = True
+    hybrid_rag_timeout: float = 3.0
+    hybrid_confidence_threshold: float = 0.3
     
     # Development
     environment: str = "development"
@@ -46,13 +211,80 @@ class Settings(BaseSettings):
         env_file = ".env"
         case_sensitive = False
     
-    @field_validator('allowed_user_ids')
+    @field_validator('allowed_user_ids', 'admin_user_ids')
     @classmethod
     def parse_allowed_users(cls, v):
         if not v:
             return []
         return [int(user_id.strip()) for user_id in v.split(',')]
     
+    @field_validator('open_access', mode='before')
+    @classmethod
+    def parse_open_access(cls, v):
+        # Пустое значение (OPEN_ACCESS=) - флаг не задан
+        if v == "":
+            return None
+        return v
+    
+    @field_validator('rate_limit_tiers')
+    @classmethod
+    def parse_rate_limit_tiers(cls, v):
+        if not v:
+            return {}
+        tiers = {}
+        for item in v.split(','):
+            name, limit = item.strip().split(':')
+            messages, window = limit.split('/')
+            if int(window) <= 0:
+                raise ValueError(f'rate limit tier "{name.strip()}" window must be positive')
+            tiers[name.strip()] = (int(messages), int(window))
+        return tiers
+    
+    @field_validator('rate_limit_window')
+    @classmethod
+    def validate_rate_limit_window(cls, v):
+        if v <= 0:
+            raise ValueError('rate_limit_window must be positive')
+        return v
+    
+    @field_validator('rate_limit_user_tiers')
+    @classmethod
+    def parse_rate_limit_user_tiers(cls, v):
+        if not v:
+            return {}
+        return {
+            int(user_id.strip()): tier.strip()
+            for user_id, tier in (item.split(':') for item in v.split(','))
+        }
+    
+    @field_validator('log_sample_rates')
+    @classmethod
+    def parse_log_sample_rates(cls, v):
+        if not v:
+            return {}
+        return {
+            event.strip(): float(rate)
+            for event, rate in (item.split(':') for item in v.split(','))
+        }
+    
+    @field_validator('external_services')
+    @classmethod
+    def parse_external_services(cls, v):
+        if not v:
+            return {}
+        services = json.loads(v)
+        if not isinstance(services, dict):
+            raise ValueError('external_services must be a JSON object')
+        for name, params in services.items():
+            if not isinstance(params, dict) or ("base_url" not in params and name != "rag_system"):
+                raise ValueError(f'external service "{name}" must define base_url')
+            unknown = set(params) - EXTERNAL_SERVICE_PARAMS
+            if unknown:
+                raise ValueError(
+                    f'external service "{name}" has unknown parameters: {", ".join(sorted(unknown))}'
+                )
+        return services
+    
     @field_validator('telegram_bot_token', 'openrouter_api_key', 'secret_key')
     @classmethod
     def validate_secrets(cls, v):
@@ -60,6 +292,41 @@ class Settings(BaseSettings):
             raise ValueError('Secret is too short or empty')
         return v
     
+    @field_validator('bot_mode')
+    @classmethod
+    def validate_bot_mode(cls, v, info: ValidationInfo):
+        v = v.lower()
+        if v not in ("polling", "webhook"):
+            raise ValueError('bot_mode must be "polling" or "webhook"')
+        # Без секрета любой, кто узнал URL, может подсовывать обновления
+        if v == "webhook" and not info.data.get("telegram_webhook_secret"):
+            raise ValueError('TELEGRAM_WEBHOOK_SECRET is required when bot_mode is "webhook"')
+        return v
+    
+    @field_validator('bot_role')
+    @classmethod
+    def validate_bot_role(cls, v):
+        v = v.lower()
+        if v not in ("standalone", "ingress", "worker"):
+            raise ValueError('bot_role must be "standalone", "ingress" or "worker"')
+        return v
+    
+    @field_validator('tracing_exporter')
+    @classmethod
+    def validate_tracing_exporter(cls, v):
+        v = v.lower()
+        if v not in ("", "jsonl", "otlp"):
+            raise ValueError('tracing_exporter must be empty, "jsonl" or "otlp"')
+        return v
+    
+    @field_validator('generation_mode')
+    @classmethod
+    def validate_generation_mode(cls, v):
+        v = v.lower()
+        if v not in ("local", "celery"):
+            raise ValueError('generation_mode must be "local" or "celery"')
+        return v
+    
     @property
     def is_development(self) -> bool:
         return self.environment.lower() == "development"
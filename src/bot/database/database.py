@@ -1,7 +1,8 @@
 import asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import Column, Integer, String, DateTime, Text, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Text, BigInteger, Index, inspect
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.sql import func
 from loguru import logger
 
@@ -33,11 +34,59 @@ class Dialog(Base):
     model_used = Column(String(100), nullable=True)
     tokens_used = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        # Составной индекс под keyset-пагинацию истории: "последние N диалогов пользователя".
+        # Добавлен к существующей таблице - строится CONCURRENTLY (см. _create_missing_indexes)
+        Index(
+            "ix_dialogs_telegram_id_created_at_id",
+            "telegram_id",
+            created_at.desc(),
+            id.desc(),
+            postgresql_concurrently=True
+        ),
+        # Окна выгрузки архива и пачки очистки выбираются по created_at
+        Index("ix_dialogs_created_at_id", created_at, id, postgresql_concurrently=True),
+    )
+
+class AllowedUser(Base):
+    """Модель пользователя с доступом к боту"""
+    __tablename__ = "allowed_users"
+    
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(BigInteger, unique=True, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserPreference(Base):
+    """Модель настроек пользователя"""
+    __tablename__ = "user_preferences"
+    
+    telegram_id = Column(BigInteger, primary_key=True)
+    model = Column(String(100), nullable=True)
+    chat_mode = Column(String(20), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 # Глобальные переменные для подключения к БД
 engine = None
 async_session = None
 
+def _create_missing_indexes(connection):
+    """
+    Создает индексы, отсутствующие в ранее созданных таблицах
+
+    Выполняется вне транзакции: в PostgreSQL новые индексы объявлены с
+    postgresql_concurrently и строятся без блокировки записи в таблицу.
+    IF NOT EXISTS - реплики, запущенные одновременно, не мешают друг другу.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info(f"Creating index {index.name} on {table.name}")
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
 async def init_database():
     """Инициализация базы данных"""
     global engine, async_session
@@ -58,9 +107,13 @@ async def init_database():
             expire_on_commit=False
         )
         
-        # Создаем таблицы
-        async with engine.begin() as conn:
+        # Создаем таблицы. AUTOCOMMIT: CREATE INDEX CONCURRENTLY нельзя
+        # выполнять в транзакции
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
             await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет индексы в уже существующие таблицы
+            await conn.run_sync(_create_missing_indexes)
         
         logger.info("Database initialized successfully")
         
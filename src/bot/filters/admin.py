@@ -0,0 +1,11 @@
+from aiogram.filters import BaseFilter
+from aiogram.types import Message, CallbackQuery
+
+from ..services.access import access_service
+
+
+class AdminFilter(BaseFilter):
+    """Пропускает только администраторов бота"""
+    
+    async def __call__(self, event: Message | CallbackQuery) -> bool:
+        return access_service.is_admin(event.from_user.id)
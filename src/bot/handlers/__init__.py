@@ -1,11 +1,17 @@
 from .commands import router as commands_router
 from .messages import router as messages_router
 from .callbacks import router as callbacks_router
+from .history import router as history_router
+from .admin import router as admin_router
+from .inline_mode import router as inline_mode_router
 
 def setup_routers():
     """Setup all routers"""
     return [
         commands_router,
+        admin_router,
+        history_router,
         messages_router, 
-        callbacks_router
+        callbacks_router,
+        inline_mode_router
     ]
\ No newline at end of file
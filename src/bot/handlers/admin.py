@@ -0,0 +1,95 @@
+import asyncio
+from aiogram import Router
+from aiogram.types import BufferedInputFile, Message
+from aiogram.filters import Command, CommandObject
+from loguru import logger
+
+from monitoring.profiler import ProfilerBusy, task_snapshot
+
+from ..config import settings
+from ..filters import AdminFilter
+from ..lifecycle import lifecycle
+from ..services.access import AccessListError, access_service
+from ..services.profiling import profiler
+
+router = Router(name="admin")
+router.message.filter(AdminFilter())
+
+
+def _parse_user_id(command: CommandObject):
+    """Извлекает ID пользователя из аргументов команды"""
+    try:
+        return int((command.args or "").strip())
+    except ValueError:
+        return None
+
+
+@router.message(Command("allow"))
+async def cmd_allow(message: Message, command: CommandObject):
+    """Обработчик команды /allow <user_id>"""
+    user_id = _parse_user_id(command)
+    if user_id is None:
+        await message.answer("Использование: /allow <code>user_id</code>")
+        return
+    
+    try:
+        await access_service.grant(user_id)
+        await message.answer(f"✅ Доступ открыт для <code>{user_id}</code>")
+    except Exception as e:
+        logger.error(f"Failed to grant access to user {user_id}: {e}")
+        await message.answer("❌ Не удалось изменить список доступа.")
+
+
+@router.message(Command("revoke"))
+async def cmd_revoke(message: Message, command: CommandObject):
+    """Обработчик команды /revoke <user_id>"""
+    user_id = _parse_user_id(command)
+    if user_id is None:
+        await message.answer("Использование: /revoke <code>user_id</code>")
+        return
+    
+    try:
+        await access_service.revoke(user_id)
+        await message.answer(f"🚫 Доступ закрыт для <code>{user_id}</code>")
+    except AccessListError as e:
+        logger.warning(f"Revoke rejected: {e}")
+        await message.answer("❌ Пользователь задан в ALLOWED_USER_IDS: удалите его из настроек.")
+    except Exception as e:
+        logger.error(f"Failed to revoke access from user {user_id}: {e}")
+        await message.answer("❌ Не удалось изменить список доступа.")
+
+
+async def _send_profile(message: Message, seconds: float):
+    """Снимает профиль и отправляет его файлами вместе со снимком задач"""
+    try:
+        result = await profiler.profile(seconds, settings.profile_interval)
+    except ProfilerBusy:
+        await message.answer("⏳ Профилирование уже выполняется, попробуйте позже.")
+        return
+    
+    try:
+        await message.answer_document(
+            BufferedInputFile(result.collapsed.encode("utf-8"), filename="profile.collapsed"),
+            caption=f"📈 {result.samples} выборок за {result.duration:.1f} с (collapsed stacks для flamegraph)"
+        )
+        await message.answer_document(
+            BufferedInputFile(task_snapshot().encode("utf-8"), filename="tasks.txt"),
+            caption="🧵 Задачи asyncio по месту ожидания"
+        )
+    except Exception as e:
+        logger.error(f"Failed to send profile: {e}")
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """Обработчик команды /profile [секунды]"""
+    try:
+        seconds = float((command.args or "").strip() or settings.profile_default_seconds)
+    except ValueError:
+        await message.answer("Использование: /profile <code>[секунды]</code>")
+        return
+    
+    seconds = max(1.0, min(seconds, settings.profile_max_seconds))
+    await message.answer(f"⏱ Профилирую {seconds:.0f} с...")
+    # Профиль снимается в фоне, чтобы не держать место в полосе обработки
+    lifecycle.track(asyncio.create_task(_send_profile(message, seconds)))
@@ -4,9 +4,11 @@ from loguru import logger
 
 from ..keyboards.inline import (
     get_main_menu, get_settings_menu, get_model_selection_menu, 
-    get_confirm_clear_menu, get_chat_mode_menu, get_generation_mode_menu
+    get_confirm_clear_menu, get_chat_mode_menu, get_generation_mode_menu,
+    AVAILABLE_MODELS
 )
 from ..services.context import ConversationManager
+from ..services.preferences import preferences_service, CHAT_MODES
 
 router = Router(name="callbacks")
 
@@ -84,9 +86,20 @@ async def callback_select_model(callback: CallbackQuery):
 async def callback_model_selected(callback: CallbackQuery):
     """Обработчик выбора конкретной модели"""
     model_id = callback.data.split(":", 1)[1]
-    await callback.answer(f"Модель {model_id} выбрана!")
     
-    # Здесь можно сохранить выбор модели в базе данных или Redis
+    if model_id not in {model for _, model in AVAILABLE_MODELS}:
+        await callback.answer("Неизвестная модель")
+        return
+    
+    user_id = callback.from_user.id
+    try:
+        await preferences_service.update(user_id, model=model_id)
+    except Exception as e:
+        logger.error(f"Failed to save model for user {user_id}: {e}")
+        await callback.answer("❌ Не удалось сохранить выбор модели")
+        return
+    
+    await callback.answer(f"Модель {model_id} выбрана!")
     
     await callback.message.edit_text(
         f"✅ Выбрана модель: <code>{model_id}</code>\n\n"
@@ -189,6 +202,7 @@ async def callback_help(callback: CallbackQuery):
 • /start - перезапуск бота
 • /help - показать справку
 • /settings - открыть настройки
+• /history - история диалогов
 • /clear - очистить контекст диалога
 
 <b>Советы:</b>
@@ -244,13 +258,22 @@ async def callback_chat_mode_selected(callback: CallbackQuery):
         "hybrid": "Комбинация базы знаний и AI моделей"
     }
     
+    if mode not in CHAT_MODES:
+        await callback.answer("Неизвестный режим")
+        return
+    
     selected_name = mode_names.get(mode, mode)
     description = mode_descriptions.get(mode, "")
     
-    await callback.answer(f"Выбран {selected_name}")
-    
-    # TODO: Сохранить режим в базе данных/Redis для пользователя
     user_id = callback.from_user.id
+    try:
+        await preferences_service.update(user_id, chat_mode=mode)
+    except Exception as e:
+        logger.error(f"Failed to save chat mode for user {user_id}: {e}")
+        await callback.answer("❌ Не удалось сохранить режим")
+        return
+    
+    await callback.answer(f"Выбран {selected_name}")
     logger.info(f"User {user_id} selected chat mode: {mode}")
     
     await callback.message.edit_text(
@@ -44,6 +44,7 @@ async def cmd_help(message: Message):
 /help - Показать эту справку
 /settings - Настройки бота
 /stats - Статистика использования
+/history - История диалогов
 /clear - Очистить контекст диалога
 
 <b>Дополнительно:</b>
@@ -0,0 +1,87 @@
+import html
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command
+from loguru import logger
+
+from ..keyboards.inline import get_history_menu
+from ..services.history import history_service, HistoryCursor, HistoryPage
+
+router = Router(name="history")
+
+
+def format_history_page(page: HistoryPage) -> str:
+    """Форматирует страницу истории для отправки пользователю"""
+    if not page.entries:
+        return "📜 <b>История диалогов</b>\n\n<i>Здесь пока пусто.</i>"
+
+    lines = ["📜 <b>История диалогов</b>\n"]
+    for entry in page.entries:
+        timestamp = entry.created_at.strftime("%d.%m.%Y %H:%M") if entry.created_at else ""
+        lines.append(f"🕐 <b>{timestamp}</b> <code>{html.escape(entry.model_used or '')}</code>")
+        lines.append(f"👤 {html.escape(entry.user_message or '')}")
+        if entry.bot_response:
+            lines.append(f"🤖 {html.escape(entry.bot_response)}")
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def get_page_keyboard(page: HistoryPage):
+    """Клавиатура навигации для страницы истории"""
+    return get_history_menu(
+        newer_cursor=page.newer_cursor.encode() if page.has_newer else None,
+        older_cursor=page.older_cursor.encode() if page.has_older else None
+    )
+
+
+@router.message(Command("history"))
+async def cmd_history(message: Message):
+    """Обработчик команды /history"""
+    user_id = message.from_user.id
+
+    try:
+        page = await history_service.get_page(user_id)
+    except Exception as e:
+        logger.error(f"Failed to load history for user {user_id}: {e}")
+        await message.answer("❌ Не удалось загрузить историю диалогов.")
+        return
+
+    await message.answer(
+        format_history_page(page),
+        reply_markup=get_page_keyboard(page)
+    )
+
+
+@router.callback_query(F.data.startswith("history:"))
+async def callback_history_page(callback: CallbackQuery):
+    """Обработчик навигации по истории диалогов"""
+    user_id = callback.from_user.id
+
+    try:
+        _, direction, raw_cursor = callback.data.split(":", 2)
+        cursor = HistoryCursor.decode(raw_cursor)
+    except ValueError:
+        await callback.answer("Некорректная страница истории")
+        return
+
+    try:
+        page = await history_service.get_page(
+            user_id,
+            cursor=cursor,
+            older=direction == "old"
+        )
+    except Exception as e:
+        logger.error(f"Failed to load history page for user {user_id}: {e}")
+        await callback.answer("❌ Не удалось загрузить историю")
+        return
+
+    await callback.answer()
+
+    if not page.entries:
+        return
+
+    await callback.message.edit_text(
+        format_history_page(page),
+        reply_markup=get_page_keyboard(page)
+    )
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import html
+import re
+from typing import Dict, List
+from aiogram import Router
+from aiogram.types import (
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+)
+from loguru import logger
+
+from ..config import settings
+from ..lifecycle import lifecycle
+from ..services import llm as llm_module
+from ..services.inline_cache import inline_cache, normalize_query
+from ..services.rate_limiter import rate_limiter
+
+router = Router(name="inline_mode")
+
+# Последний inline-запрос каждого пользователя (для debounce по нажатиям клавиш)
+_latest_queries: Dict[int, str] = {}
+
+# Генерации в процессе: одинаковые запросы разных пользователей ждут одну генерацию
+_generations: Dict[str, asyncio.Task] = {}
+
+MAX_MESSAGE_LENGTH = 4096
+_HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+
+
+def _truncate_html(text: str, limit: int) -> str:
+    """
+    Обрезает HTML до limit символов, не разрезая теги и сущности
+
+    Теги, оставшиеся открытыми после обрезки, закрываются (с учетом limit).
+    """
+    if len(text) <= limit:
+        return text
+
+    cut = limit - 1
+    while cut > 0:
+        head = text[:cut]
+        # Обрезанный тег или сущность отбрасываем целиком
+        if head.rfind("<") > head.rfind(">"):
+            head = head[:head.rfind("<")]
+        if head.rfind("&") > head.rfind(";"):
+            head = head[:head.rfind("&")]
+
+        open_tags: List[str] = []
+        for match in _HTML_TAG.finditer(head):
+            closing, name = match.group(1), match.group(2).lower()
+            if not closing:
+                open_tags.append(name)
+            elif name in open_tags:
+                del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name)]
+
+        result = head + "…" + "".join(f"</{name}>" for name in reversed(open_tags))
+        if len(result) <= limit:
+            return result
+        cut -= len(result) - limit
+    return ""
+
+
+def _build_result(query: str, normalized: str, answer: str) -> InlineQueryResultArticle:
+    """Формирует карточку ответа"""
+    header = f"❓ <b>{html.escape(query[:200])}</b>\n\n"
+    return InlineQueryResultArticle(
+        id=hashlib.md5(normalized.encode("utf-8")).hexdigest(),
+        title=query[:100],
+        description=answer[:200],
+        input_message_content=InputTextMessageContent(
+            message_text=header + _truncate_html(answer, MAX_MESSAGE_LENGTH - len(header))
+        )
+    )
+
+
+async def _generate(normalized: str, inline_query: InlineQuery) -> str:
+    """Генерирует ответ через LLMService и кладет его в кеш"""
+    try:
+        result = await llm_module.llm_service.generate_response(
+            user_id=inline_query.from_user.id,
+            user_message=inline_query.query,
+            telegram_user=inline_query.from_user,
+            model=settings.default_model,
+            use_context=False,
+            chat_mode="openrouter",
+            save_context=False
+        )
+        if not result["success"]:
+            raise RuntimeError(result.get("error", "generation failed"))
+
+        await inline_cache.set(normalized, result["response"])
+        return result["response"]
+    finally:
+        _generations.pop(normalized, None)
+
+
+@router.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """Обработчик inline-запросов @bot query"""
+    user_id = inline_query.from_user.id
+    query = inline_query.query.strip()
+    normalized = normalize_query(query)
+
+    if len(normalized) < settings.inline_min_query_length or llm_module.llm_service is None:
+        await inline_query.answer([], cache_time=settings.inline_cache_time)
+        return
+
+    # Повторный запрос - отвечаем из кеша сразу, без задержки
+    cached = await inline_cache.get(normalized)
+    if cached:
+        await inline_query.answer(
+            [_build_result(query, normalized, cached)],
+            cache_time=settings.inline_cache_time
+        )
+        return
+
+    # Ждем паузы в наборе: если пришел более новый запрос, этот не обслуживаем
+    _latest_queries[user_id] = inline_query.id
+    await asyncio.sleep(settings.inline_debounce)
+    if _latest_queries.get(user_id) != inline_query.id:
+        return
+    del _latest_queries[user_id]
+
+    # Пока ждали, ответ на тот же запрос мог появиться в кеше
+    cached = await inline_cache.get(normalized)
+    if cached:
+        await inline_query.answer(
+            [_build_result(query, normalized, cached)],
+            cache_time=settings.inline_cache_time
+        )
+        return
+
+    task = _generations.get(normalized)
+    if task is None:
+        limit = await rate_limiter.check(user_id, "inline")
+        if not limit.allowed:
+            await inline_query.answer([], cache_time=0, is_personal=True)
+            return
+        task = _generations[normalized] = asyncio.create_task(_generate(normalized, inline_query))
+        # Ошибку забирает ожидающий обработчик, а после таймаута - этот callback
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        # Токены за генерацию уже оплачены - при остановке дожидаемся ее
+        lifecycle.track(task)
+
+    try:
+        # shield: по таймауту генерация продолжается и наполнит кеш для повторного запроса
+        answer = await asyncio.wait_for(asyncio.shield(task), timeout=settings.inline_timeout)
+    except asyncio.TimeoutError:
+        await inline_query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="⏳ Ответ готовится, повторите запрос", start_parameter="inline")
+        )
+        return
+    except Exception as e:
+        logger.error(f"Inline generation failed for user {user_id}: {e}")
+        await inline_query.answer([], cache_time=0, is_personal=True)
+        return
+
+    await inline_query.answer(
+        [_build_result(query, normalized, answer)],
+        cache_time=settings.inline_cache_time
+    )
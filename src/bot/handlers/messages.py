@@ -1,53 +1,75 @@
-import asyncio
+from typing import List
 from aiogram import Router, F
 from aiogram.types import Message
 from loguru import logger
 
+from ..config import settings
 from ..services import llm as llm_module
+from ..services.coalescer import message_coalescer
+from ..services.progressive import ProgressiveReply
+from ..tasks import enqueue_generation
+from ..utils.logging import log_sampler
 
 router = Router(name="messages")
 
 @router.message(F.text & ~F.text.startswith('/'))
 async def handle_text_message(message: Message):
     """Обработчик текстовых сообщений"""
+    if not message_coalescer.enabled:
+        await process_turn([message])
+        return
+    
+    # Серия быстрых сообщений пользователя обрабатывается одним ходом
+    await message_coalescer.submit(message.from_user.id, message, process_turn)
+
+async def process_turn(messages: List[Message]):
+    """Генерирует один ответ на одно или несколько подряд идущих сообщений"""
+    message = messages[-1]
     user_id = message.from_user.id
-    user_text = message.text
+    user_text = "\n".join(m.text for m in messages)
     
-    logger.info(f"Processing message from user {user_id}: {user_text[:50]}...")
+    if log_sampler.should_log("message"):
+        logger.info("Processing message from user {}: {}...", user_id, user_text[:50])
     
     # Отправляем typing action
     await message.bot.send_chat_action(message.chat.id, "typing")
     
     try:
+        if settings.generation_mode == "celery":
+            # Генерация и отправка ответа выполняются в пуле Celery
+            await enqueue_generation(message, user_text)
+            return
+        
         # Проверяем, что LLM сервис инициализирован
         if llm_module.llm_service is None:
             await message.answer("Сервис AI временно недоступен. Попробуйте позже.")
             return
         
+        # Ответ RAG в потоковом режиме показывается по мере получения
+        reply = ProgressiveReply(
+            message.bot,
+            message.chat.id,
+            message_thread_id=message.message_thread_id if message.is_topic_message else None
+        )
+        
         # Генерируем ответ через LLM сервис
         result = await llm_module.llm_service.generate_response(
             user_id=user_id,
             user_message=user_text,
-            telegram_user=message.from_user
+            telegram_user=message.from_user,
+            on_partial=reply.update
         )
         
         if not result["success"]:
-            await message.answer("Извините, произошла ошибка при обработке вашего сообщения.")
+            await reply.finish(
+                result.get("response") or "Извините, произошла ошибка при обработке вашего сообщения."
+            )
             logger.error(f"Failed to generate response: {result.get('error')}")
             return
         
-        ai_response = result["response"]
-        
-        # Отправляем ответ (разбивая если необходимо)
-        if len(ai_response) <= 4096:
-            await message.answer(ai_response)
-        else:
-            # Разбиваем длинное сообщение
-            parts = [ai_response[i:i+4000] for i in range(0, len(ai_response), 4000)]
-            for i, part in enumerate(parts):
-                await message.answer(part)
-                if i < len(parts) - 1:
-                    await asyncio.sleep(0.5)
+        # Отправляем ответ (разбивая если необходимо); темп отправки частей
+        # задает планировщик, обработчик не ждет их доставки
+        await reply.finish(result["response"])
             
     except Exception as e:
         logger.error(f"Error processing message from user {user_id}: {e}")
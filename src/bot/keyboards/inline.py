@@ -1,6 +1,16 @@
+from typing import Optional
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+# Популярные модели
+AVAILABLE_MODELS = [
+    ("GPT-4o", "openai/gpt-4o"),
+    ("GPT-4o Mini", "openai/gpt-4o-mini"),
+    ("Claude 3.5 Sonnet", "anthropic/claude-3.5-sonnet"),
+    ("Gemini Pro", "google/gemini-pro"),
+    ("Llama 3.1 70B", "meta-llama/llama-3.1-70b-instruct")
+]
+
 def get_main_menu() -> InlineKeyboardMarkup:
     """Главное меню бота"""
     builder = InlineKeyboardBuilder()
@@ -36,16 +46,7 @@ def get_model_selection_menu() -> InlineKeyboardMarkup:
     """Меню выбора модели"""
     builder = InlineKeyboardBuilder()
     
-    # Популярные модели
-    models = [
-        ("GPT-4o", "openai/gpt-4o"),
-        ("GPT-4o Mini", "openai/gpt-4o-mini"),
-        ("Claude 3.5 Sonnet", "anthropic/claude-3.5-sonnet"),
-        ("Gemini Pro", "google/gemini-pro"),
-        ("Llama 3.1 70B", "meta-llama/llama-3.1-70b-instruct")
-    ]
-    
-    for name, model_id in models:
+    for name, model_id in AVAILABLE_MODELS:
         builder.row(
             InlineKeyboardButton(
                 text=name, 
@@ -111,4 +112,30 @@ def get_confirm_clear_menu() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="❌ Отмена", callback_data="main_menu")
     )
     
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
+
+
+def get_history_menu(
+    newer_cursor: Optional[str] = None,
+    older_cursor: Optional[str] = None
+) -> InlineKeyboardMarkup:
+    """Меню навигации по истории диалогов"""
+    builder = InlineKeyboardBuilder()
+    
+    navigation = []
+    if newer_cursor:
+        navigation.append(
+            InlineKeyboardButton(text="⬅️ Новее", callback_data=f"history:new:{newer_cursor}")
+        )
+    if older_cursor:
+        navigation.append(
+            InlineKeyboardButton(text="Старее ➡️", callback_data=f"history:old:{older_cursor}")
+        )
+    if navigation:
+        builder.row(*navigation)
+    
+    builder.row(
+        InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")
+    )
+    
+    return builder.as_markup()
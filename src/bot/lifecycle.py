@@ -0,0 +1,121 @@
+import asyncio
+import signal
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from loguru import logger
+
+from .config import settings
+
+Closer = Callable[[], Awaitable[None]]
+
+
+@dataclass
+class DrainReport:
+    """Итог остановки"""
+    drained: int = 0
+    aborted: int = 0
+    failed_closers: int = 0
+
+
+class LifecycleManager:
+    """
+    Плавная остановка процесса
+
+    Учитывает обрабатываемые обновления и фоновые генерации. При остановке
+    прием новых обновлений уже прекращен (polling или webhook остановлен),
+    менеджер ждет завершения начатых ходов не дольше shutdown_drain_timeout,
+    остальные отменяет, после чего закрывает ресурсы в порядке, обратном
+    регистрации: сначала досылаются буферизованные отправки и записи,
+    затем закрываются соединения.
+    """
+
+    def __init__(self, drain_timeout: Optional[float] = None):
+        self.drain_timeout = settings.shutdown_drain_timeout if drain_timeout is None else drain_timeout
+        self._tasks: Set[asyncio.Task] = set()
+        self._closers: List[Tuple[str, Closer]] = []
+        self._stop_event: Optional[asyncio.Event] = None
+        self.draining = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def track(self, task: asyncio.Task):
+        """Учитывает задачу, которую нужно дождаться при остановке"""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def on_shutdown(self, name: str, closer: Closer):
+        """
+        Регистрирует закрытие ресурса
+
+        Закрытия выполняются в обратном порядке: ресурс, открытый позже
+        (и, возможно, зависящий от более ранних), закрывается раньше.
+        """
+        self._closers.append((name, closer))
+
+    def install_signal_handlers(self) -> asyncio.Event:
+        """Событие, которое устанавливается по SIGTERM/SIGINT"""
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            # На Windows обработчики сигналов в цикле не поддерживаются
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self._on_signal, sig)
+        return self._stop_event
+
+    def _on_signal(self, sig: signal.Signals):
+        logger.warning(f"Received {sig.name}, shutting down")
+        if self._stop_event:
+            self._stop_event.set()
+
+    async def _drain(self, report: DrainReport):
+        """Ждет начатые ходы до дедлайна, остальные отменяет"""
+        pending = self._tasks - {asyncio.current_task()}
+        if not pending:
+            return
+
+        logger.info(f"Draining {len(pending)} in-flight updates (up to {self.drain_timeout}s)")
+        deadline = time.monotonic() + self.drain_timeout
+        # Завершающиеся ходы порождают отправки ответов - ждем и их
+        while pending and time.monotonic() < deadline:
+            done, _ = await asyncio.wait(
+                pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+            )
+            report.drained += len(done)
+            pending = self._tasks - {asyncio.current_task()}
+        report.aborted = len(pending)
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1.0)
+
+    async def shutdown(self) -> DrainReport:
+        """Дожидается начатых ходов и закрывает ресурсы"""
+        self.draining = True
+        report = DrainReport()
+        started = time.monotonic()
+
+        await self._drain(report)
+
+        while self._closers:
+            name, closer = self._closers.pop()
+            try:
+                await closer()
+            except Exception as e:
+                report.failed_closers += 1
+                logger.error(f"Failed to close {name}: {e}")
+
+        logger.info(
+            f"Shutdown complete in {time.monotonic() - started:.1f}s: "
+            f"{report.drained} drained, {report.aborted} aborted, "
+            f"{report.failed_closers} resources failed to close"
+        )
+        return report
+
+
+# Глобальный экземпляр (используется в main.py и middleware)
+lifecycle = LifecycleManager()
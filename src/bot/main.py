@@ -11,18 +11,34 @@ from .handlers import setup_routers
 from .middlewares import setup_middlewares
 from .services.context import ConversationManager
 from .services.llm import LLMService
-from .database.database import init_database
+from .services.rate_limiter import rate_limiter
+from .services.token_budget import token_budget
+from .services.access import access_service
+from .services.preferences import preferences_service
+from .services.inline_cache import inline_cache
+from .services.outbound import outbound_scheduler, OutboundSchedulerMiddleware
+from .services.external_apis import cleanup_external_services
+from .services.health import create_health_server
+from .database.database import init_database, close_database
+from .lifecycle import lifecycle
+from .utils.logging import setup_logging
+from .utils.tracing import setup_tracing
+from .webhook import run_webhook
+from .streams import run_ingress, run_worker
 from .handlers import callbacks
 
 async def create_bot() -> Bot:
     """Создание экземпляра бота"""
-    return Bot(
+    bot = Bot(
         token=settings.telegram_bot_token.get_secret_value(),
         default=DefaultBotProperties(
             parse_mode=ParseMode.HTML,
             link_preview_is_disabled=True
         )
     )
+    # Все отправки и редактирования идут через планировщик с учетом лимитов Telegram
+    bot.session.middleware(OutboundSchedulerMiddleware(outbound_scheduler))
+    return bot
 
 async def create_dispatcher() -> Dispatcher:
     """Создание диспетчера"""
@@ -38,44 +54,101 @@ async def create_dispatcher() -> Dispatcher:
     
     return dp
 
+async def init_services():
+    """Инициализация сервисов обработки обновлений"""
+    # Инициализация базы данных
+    await init_database()
+    lifecycle.on_shutdown("database", close_database)
+    
+    # Загрузка списка доступа
+    await access_service.initialize()
+    lifecycle.on_shutdown("access service", access_service.close)
+    
+    # Инициализация менеджера контекста
+    conversation_manager = ConversationManager()
+    await conversation_manager.initialize()
+    lifecycle.on_shutdown("conversation manager", conversation_manager.close)
+    
+    # Инициализация распределенного rate limiter
+    await rate_limiter.initialize()
+    lifecycle.on_shutdown("rate limiter", rate_limiter.close)
+    
+    # Глобальный лимит отправки в Telegram, общий для всех процессов
+    # (закрывается вместе с планировщиком после досылки очереди)
+    await outbound_scheduler.initialize()
+    
+    # Инициализация бюджетов токенов
+    await token_budget.initialize()
+    # Дожидается фоновых корректировок резервов
+    lifecycle.on_shutdown("token budget", token_budget.close)
+    
+    # Инициализация кеша настроек пользователей
+    await preferences_service.initialize()
+    lifecycle.on_shutdown("preferences service", preferences_service.close)
+    
+    # Инициализация кеша inline-ответов
+    await inline_cache.initialize()
+    lifecycle.on_shutdown("inline cache", inline_cache.close)
+    
+    # Инициализация LLM сервиса
+    llm_service = LLMService(conversation_manager)
+    lifecycle.on_shutdown("external services", cleanup_external_services)
+    
+    # Инициализируем глобальные переменные в модулях
+    from .services import llm as llm_module
+    from .handlers import callbacks as callbacks_module
+    
+    llm_module.llm_service = llm_service
+    callbacks_module.conversation_manager = conversation_manager
+
 async def main():
     """Главная функция запуска бота"""
     # Настройка логирования
-    logger.remove()
-    logger.add(
-        sys.stdout,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        level=settings.log_level
-    )
+    setup_logging()
+    setup_tracing()
     
     try:
-        # Инициализация базы данных
-        await init_database()
+        # Ingress только принимает обновления и не обрабатывает их
+        if settings.bot_role != "ingress":
+            await init_services()
         
-        # Инициализация менеджера контекста
-        conversation_manager = ConversationManager()
-        await conversation_manager.initialize()
-        
-        # Инициализация LLM сервиса
-        llm_service = LLMService(conversation_manager)
-        
-        # Инициализируем глобальные переменные в модулях
-        from .services import llm as llm_module
-        from .handlers import callbacks as callbacks_module
-        
-        llm_module.llm_service = llm_service
-        callbacks_module.conversation_manager = conversation_manager
+        # Метрики Prometheus, /health и /ready (для всех ролей; пробы начинаются
+        # после инициализации, чтобы первая же проверка отражала готовность)
+        health_server = create_health_server()
+        await health_server.start("0.0.0.0", settings.metrics_port)
+        lifecycle.on_shutdown("health server", health_server.stop)
         
         # Создание бота и диспетчера
         bot = await create_bot()
         dp = await create_dispatcher()
+        lifecycle.on_shutdown("bot session", bot.session.close)
+        lifecycle.on_shutdown("FSM storage", dp.storage.close)
+        # Закрывается первым: досылает очередь, пока сессия бота открыта
+        lifecycle.on_shutdown(
+            "outbound scheduler",
+            lambda: outbound_scheduler.close(timeout=settings.shutdown_flush_timeout)
+        )
         
-        logger.info("Starting polling mode...")
-        await dp.start_polling(bot)
+        if settings.bot_role == "ingress":
+            logger.info(f"Starting ingress ({settings.bot_mode})...")
+            await run_ingress(bot, dp)
+        elif settings.bot_role == "worker":
+            logger.info("Starting update stream worker...")
+            await run_worker(bot, dp)
+        elif settings.bot_mode == "webhook":
+            logger.info("Starting webhook mode...")
+            await run_webhook(bot, dp)
+        else:
+            logger.info("Starting polling mode...")
+            # Сессию закрывает lifecycle после того, как начатые ходы ответят
+            await dp.start_polling(bot, close_bot_session=False)
         
     except Exception as e:
         logger.error(f"Bot failed to start: {e}")
         sys.exit(1)
+    finally:
+        # Прием обновлений остановлен: дожидаемся начатых ходов и закрываем ресурсы
+        await lifecycle.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
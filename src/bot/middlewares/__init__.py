@@ -1,9 +1,23 @@
 from .auth import AuthMiddleware
+from .lanes import LaneMiddleware
+from .lifecycle import LifecycleMiddleware
 from .logging import LoggingMiddleware
+from .metrics import MetricsMiddleware, MiddlewareStageMiddleware
 from .throttling import ThrottlingMiddleware
+from .tracing import TracingMiddleware
 
 def setup_middlewares(dp):
     """Setup all middlewares"""
+    dp.update.outer_middleware(LifecycleMiddleware())
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.update.outer_middleware(LaneMiddleware())
+    dp.update.outer_middleware(MetricsMiddleware())
     dp.message.middleware(LoggingMiddleware())
     dp.message.middleware(AuthMiddleware())
-    dp.message.middleware(ThrottlingMiddleware())
\ No newline at end of file
+    dp.message.middleware(ThrottlingMiddleware())
+    dp.message.middleware(MiddlewareStageMiddleware())
+    dp.inline_query.middleware(AuthMiddleware())
+    dp.inline_query.middleware(MiddlewareStageMiddleware())
+    dp.callback_query.middleware(LoggingMiddleware())
+    dp.callback_query.middleware(ThrottlingMiddleware())
+    dp.callback_query.middleware(MiddlewareStageMiddleware())
\ No newline at end of file
@@ -1,41 +1,36 @@
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import Message, InlineQuery
 from loguru import logger
 
-from ..config import settings
+from ..services.access import access_service
 
 
 class AuthMiddleware(BaseMiddleware):
     """Middleware для авторизации пользователей"""
     
-    def __init__(self):
-        super().__init__()
-        self.allowed_users = settings.allowed_user_ids
-    
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
-        event: Message,
+        event: Message | InlineQuery,
         data: Dict[str, Any]
     ) -> Any:
         """Проверяет авторизацию пользователя"""
         
         user_id = event.from_user.id
         
-        # Если список разрешенных пользователей пуст, разрешаем всем
-        if not self.allowed_users:
-            logger.warning("No allowed users configured - allowing all users")
+        if access_service.is_allowed(user_id):
             return await handler(event, data)
         
-        # Проверяем, есть ли пользователь в списке разрешенных
-        if user_id not in self.allowed_users:
+        if isinstance(event, InlineQuery):
+            await event.answer([], cache_time=300, is_personal=True)
+            return
+        
+        # Повторные сообщения от заблокированного пользователя отбрасываем молча
+        if access_service.should_notify_denied(user_id):
             logger.warning(f"Unauthorized access attempt from user {user_id}")
             await event.answer(
                 "❌ У вас нет доступа к этому боту.\n"
                 "Обратитесь к администратору для получения разрешения."
             )
-            return
-        
-        logger.debug(f"User {user_id} authorized")
-        return await handler(event, data)
\ No newline at end of file
+        return
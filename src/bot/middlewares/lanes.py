@@ -0,0 +1,24 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from monitoring.tracing import tracer
+
+from ..services.lanes import lane_scheduler
+
+
+class LaneMiddleware(BaseMiddleware):
+    """Пропускает обновление через его полосу (быстрая - команды и кнопки, медленная - LLM)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        lane = lane_scheduler.lane_for(event)
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attribute("lane", lane.name)
+        async with lane.slot():
+            return await handler(event, data)
@@ -0,0 +1,21 @@
+import asyncio
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from ..lifecycle import lifecycle
+
+
+class LifecycleMiddleware(BaseMiddleware):
+    """Учитывает обрабатываемые обновления, чтобы дождаться их при остановке"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        if task is not None:
+            lifecycle.track(task)
+        return await handler(event, data)
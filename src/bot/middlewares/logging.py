@@ -1,13 +1,20 @@
 import time
+import uuid
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from loguru import logger
 
+from ..utils.logging import log_sampler
+
+
+def _user_info(user) -> str:
+    return f"{user.full_name} (@{user.username})" if user.username else user.full_name
+
 
 class LoggingMiddleware(BaseMiddleware):
     """Middleware для логирования входящих сообщений и запросов"""
-    
+
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
@@ -15,41 +22,42 @@ class LoggingMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         """Логирует входящие события и время обработки"""
-        
-        start_time = time.time()
-        
-        # Получаем информацию о пользователе
+
+        start_time = time.perf_counter()
+
+        # Идентификатор запроса для сквозной корреляции логов
+        update = data.get("event_update")
+        request_id = str(update.update_id) if update else uuid.uuid4().hex[:12]
+
         user = event.from_user
-        user_info = f"{user.full_name} (@{user.username})" if user.username else user.full_name
-        
-        # Логируем в зависимости от типа события
-        if isinstance(event, Message):
-            content = event.text[:100] + "..." if event.text and len(event.text) > 100 else event.text
-            logger.info(
-                f"📨 Message from {user_info} (ID: {user.id}): {content}"
-            )
-        elif isinstance(event, CallbackQuery):
-            logger.info(
-                f"🔘 Callback from {user_info} (ID: {user.id}): {event.data}"
-            )
-        
-        try:
-            # Выполняем обработчик
-            result = await handler(event, data)
-            
-            # Логируем время выполнения
-            execution_time = time.time() - start_time
-            logger.debug(
-                f"✅ Request processed in {execution_time:.3f}s for user {user.id}"
-            )
-            
-            return result
-            
-        except Exception as e:
-            # Логируем ошибки
-            execution_time = time.time() - start_time
-            logger.error(
-                f"❌ Error processing request from user {user.id} "
-                f"after {execution_time:.3f}s: {str(e)}"
-            )
-            raise
\ No newline at end of file
+
+        with logger.contextualize(request_id=request_id, user_id=user.id):
+            # Логируем в зависимости от типа события (с сэмплированием)
+            if isinstance(event, Message):
+                if log_sampler.should_log("message"):
+                    content = event.text[:100] + "..." if event.text and len(event.text) > 100 else event.text
+                    logger.info("📨 Message from {} (ID: {}): {}", _user_info(user), user.id, content)
+            elif isinstance(event, CallbackQuery):
+                if log_sampler.should_log("callback"):
+                    logger.info("🔘 Callback from {} (ID: {}): {}", _user_info(user), user.id, event.data)
+
+            try:
+                # Выполняем обработчик
+                result = await handler(event, data)
+
+                # Логируем время выполнения
+                logger.debug(
+                    "✅ Request processed in {:.3f}s for user {}",
+                    time.perf_counter() - start_time, user.id
+                )
+
+                return result
+
+            except Exception as e:
+                # Логируем ошибки
+                execution_time = time.perf_counter() - start_time
+                logger.error(
+                    f"❌ Error processing request from user {user.id} "
+                    f"after {execution_time:.3f}s: {str(e)}"
+                )
+                raise
@@ -0,0 +1,45 @@
+import time
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from monitoring.metrics import messages_total, update_seconds, updates_in_flight, errors_total, stage_seconds
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки обновлений, число обрабатываемых и ошибки по типу"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        message_type = event.event_type
+        messages_total.labels(message_type).inc()
+        in_flight = updates_in_flight.labels(message_type)
+        in_flight.inc()
+        started = data["update_started_at"] = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            errors_total.labels(type(e).__name__).inc()
+            raise
+        finally:
+            update_seconds.labels(message_type).observe(time.perf_counter() - started)
+            in_flight.dec()
+
+
+class MiddlewareStageMiddleware(BaseMiddleware):
+    """Подключается последним: время от MetricsMiddleware до обработчика (этап middleware)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = data.get("update_started_at")
+        if started is not None:
+            stage_seconds.labels("middleware").observe(time.perf_counter() - started)
+        return await handler(event, data)
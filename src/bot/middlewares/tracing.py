@@ -0,0 +1,18 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from monitoring.tracing import tracer
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает трассу на каждое обновление; спаны сервисов становятся ее потомками"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        with tracer.start_trace("update", update_id=event.update_id, update_type=event.event_type):
+            return await handler(event, data)
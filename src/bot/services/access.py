@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Optional
+from loguru import logger
+import redis.asyncio as redis
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..config import settings
+from ..database.database import AllowedUser, get_session
+
+UPDATES_CHANNEL = "access:updates"
+
+
+class AccessListError(Exception):
+    """Изменение списка доступа отклонено"""
+    pass
+
+
+class AccessControlService:
+    """
+    Список доступа к боту с локальным кешем
+
+    Источник истины - таблица allowed_users (плюс ALLOWED_USER_IDS из настроек).
+    Открытый доступ задается OPEN_ACCESS; если флаг не задан, бот, как и
+    раньше, открыт при пустом ALLOWED_USER_IDS.
+    Каждая реплика держит неизменяемое множество в памяти: проверка - один
+    поиск в хеш-таблице без аллокаций. Изменения рассылаются всем репликам
+    через Redis pub/sub.
+    """
+
+    def __init__(self, max_denied_entries: int = 10000):
+        self.redis_client: Optional[redis.Redis] = None
+        self.seeded: FrozenSet[int] = frozenset(settings.allowed_user_ids)
+        self.allowed: FrozenSet[int] = self.seeded
+        self.admins: FrozenSet[int] = frozenset(settings.admin_user_ids)
+        self.denied_ttl = settings.access_denied_cache_ttl
+        self.max_denied_entries = max_denied_entries
+        # Негативный кеш: пользователь -> время, до которого ему не отвечаем повторно
+        self._denied: "OrderedDict[int, float]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def open_access(self) -> bool:
+        if settings.open_access is None:
+            return not self.seeded
+        return settings.open_access
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+    def is_allowed(self, user_id: int) -> bool:
+        """Проверяет доступ пользователя (O(1))"""
+        return self.open_access or user_id in self.allowed or user_id in self.admins
+
+    def should_notify_denied(self, user_id: int) -> bool:
+        """
+        Нужно ли отвечать заблокированному пользователю
+
+        Ответ отправляется не чаще раза в access_denied_cache_ttl, остальные
+        сообщения отбрасываются молча.
+        """
+        now = time.monotonic()
+        expires_at = self._denied.get(user_id)
+        if expires_at is not None and expires_at > now:
+            return False
+
+        self._denied[user_id] = now + self.denied_ttl
+        self._denied.move_to_end(user_id)
+        if len(self._denied) > self.max_denied_entries:
+            self._denied.popitem(last=False)
+        return True
+
+    async def initialize(self):
+        """Загружает список доступа и подписывается на обновления"""
+        try:
+            await self.reload()
+            self.redis_client = redis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            await self.redis_client.ping()
+            self._listener = asyncio.create_task(self._listen())
+            logger.info("AccessControlService initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize AccessControlService: {e}")
+            raise
+
+        if settings.open_access is None and self.open_access:
+            logger.warning(
+                "ALLOWED_USER_IDS is empty and OPEN_ACCESS is not set - allowing all users. "
+                "Set OPEN_ACCESS=true to keep this, or OPEN_ACCESS=false to allow only listed users"
+            )
+        elif self.open_access:
+            logger.warning("OPEN_ACCESS is enabled - allowing all users")
+        elif not self.allowed:
+            logger.warning("Access list is empty - only admins can use the bot")
+
+    async def reload(self):
+        """Перечитывает список доступа из БД"""
+        async for session in get_session():
+            result = await session.execute(select(AllowedUser.telegram_id))
+            stored = result.scalars().all()
+
+        self.allowed = self.seeded.union(stored)
+        logger.info(f"Loaded access list: {len(self.allowed)} users")
+
+    def _apply(self, payload: str):
+        """Применяет обновление, полученное через pub/sub"""
+        action, _, raw_user_id = payload.partition(":")
+
+        if action == "grant":
+            user_id = int(raw_user_id)
+            self.allowed = self.allowed | {user_id}
+            self._denied.pop(user_id, None)
+        elif action == "revoke":
+            self.allowed = self.allowed - {int(raw_user_id)}
+        else:
+            raise ValueError(f"Unknown access update: {payload}")
+
+    async def _listen(self):
+        """Слушает обновления списка доступа от других реплик"""
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(UPDATES_CHANNEL)
+                # После (пере)подключения могли пропустить обновления
+                await self.reload()
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        self._apply(message["data"])
+                    except ValueError as e:
+                        logger.warning(str(e))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Access updates listener failed, reconnecting: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    async def grant(self, user_id: int):
+        """Открывает доступ пользователю на всех репликах"""
+        async for session in get_session():
+            await session.execute(
+                pg_insert(AllowedUser)
+                .values(telegram_id=user_id)
+                .on_conflict_do_nothing(index_elements=[AllowedUser.telegram_id])
+            )
+
+        self._apply(f"grant:{user_id}")
+        await self.redis_client.publish(UPDATES_CHANNEL, f"grant:{user_id}")
+        logger.info(f"Access granted to user {user_id}")
+
+    async def revoke(self, user_id: int):
+        """
+        Закрывает доступ пользователю на всех репликах
+
+        :raises AccessListError: пользователь задан в ALLOWED_USER_IDS (вернулся
+            бы при следующей перезагрузке списка)
+        """
+        if user_id in self.seeded:
+            raise AccessListError(f"User {user_id} is listed in ALLOWED_USER_IDS")
+
+        async for session in get_session():
+            await session.execute(delete(AllowedUser).where(AllowedUser.telegram_id == user_id))
+
+        self._apply(f"revoke:{user_id}")
+        await self.redis_client.publish(UPDATES_CHANNEL, f"revoke:{user_id}")
+        logger.info(f"Access revoked from user {user_id}")
+
+    async def close(self):
+        """Останавливает подписку и закрывает соединение с Redis"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("AccessControlService connection closed")
+
+
+# Глобальный экземпляр (инициализируется в main.py)
+access_service = AccessControlService()
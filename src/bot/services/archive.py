@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from ..config import settings
+from ..database.database import Dialog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - опциональная зависимость
+    pa = None
+    pq = None
+
+STATE_FILE = "_state.json"
+
+COLUMNS = (
+    Dialog.id,
+    Dialog.user_id,
+    Dialog.telegram_id,
+    Dialog.user_message,
+    Dialog.bot_response,
+    Dialog.model_used,
+    Dialog.tokens_used,
+    Dialog.created_at,
+)
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("telegram_id", pa.int64()),
+        ("user_message", pa.string()),
+        ("bot_response", pa.string()),
+        ("model_used", pa.string()),
+        ("tokens_used", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+class ArchiveError(Exception):
+    """Исключение для ошибок выгрузки архива"""
+    pass
+
+
+@dataclass
+class ArchiveState:
+    """
+    High-water mark последней подтвержденной выгрузки
+
+    Граница - момент времени, а не id: id выдается до коммита, и строка с
+    меньшим id может стать видимой позже строк с большими. Все строки с
+    created_at не новее exported_until выгружены.
+    """
+    exported_until: Optional[str] = None
+    rows: int = 0
+
+    @property
+    def until(self) -> Optional[datetime]:
+        return datetime.fromisoformat(self.exported_until) if self.exported_until else None
+
+    @classmethod
+    def load(cls, path: str) -> "ArchiveState":
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp_path, path)
+
+
+class _DayPartWriter:
+    """Part-файл одного дневного раздела; пишется во временный файл до закрытия"""
+
+    def __init__(self, output_dir: str, day: str, first_id: int, schema):
+        self.directory = os.path.join(output_dir, f"date={day}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.first_id = first_id
+        self.last_id = first_id
+        self.rows = 0
+        self.tmp_path = os.path.join(self.directory, f".part-{first_id}.parquet.tmp")
+        self.writer = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+
+    def write(self, table):
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+        self.last_id = table.column("id")[-1].as_py()
+
+    def close(self) -> str:
+        """Закрывает файл, проверяет число строк и публикует его под итоговым именем"""
+        self.writer.close()
+        written = pq.ParquetFile(self.tmp_path).metadata.num_rows
+        if written != self.rows:
+            os.remove(self.tmp_path)
+            raise ArchiveError(
+                f"Verification failed for {self.tmp_path}: expected {self.rows} rows, got {written}"
+            )
+        final_path = os.path.join(
+            self.directory, f"part-{self.first_id:012d}-{self.last_id:012d}.parquet"
+        )
+        os.replace(self.tmp_path, final_path)
+        return final_path
+
+
+class DialogArchiveExporter:
+    """Инкрементальная выгрузка диалогов в Parquet с разбиением по дням"""
+
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        source_url: Optional[str] = None,
+        primary_url: Optional[str] = None,
+        safety_lag: Optional[float] = None
+    ):
+        if pa is None:
+            raise ArchiveError("pyarrow is required for archive export: pip install pyarrow")
+
+        self.output_dir = output_dir or settings.archive_dir
+        self.chunk_size = chunk_size or settings.archive_chunk_size
+        # Читаем с реплики, если она настроена, чтобы не нагружать primary
+        self.source_url = source_url or settings.archive_database_url or settings.database_url
+        # Удаление всегда выполняется на primary
+        self.primary_url = primary_url or settings.database_url
+        self.safety_lag = timedelta(seconds=settings.archive_safety_lag if safety_lag is None else safety_lag)
+        self.state_path = os.path.join(self.output_dir, STATE_FILE)
+        self.schema = _arrow_schema()
+
+    def _chunk_to_tables(self, rows) -> List[Tuple[str, "pa.Table"]]:
+        """Раскладывает пачку строк по дням в колоночные таблицы"""
+        by_day: Dict[str, List[list]] = {}
+        for row in rows:
+            created_at = row[7]
+            day = created_at.astimezone(timezone.utc).strftime("%Y-%m-%d") if created_at else "unknown"
+            columns = by_day.get(day)
+            if columns is None:
+                columns = by_day[day] = [[] for _ in COLUMNS]
+            for i, value in enumerate(row):
+                columns[i].append(value)
+
+        return [
+            (day, pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+                schema=self.schema
+            ))
+            for day, columns in by_day.items()
+        ]
+
+    async def export(self) -> ArchiveState:
+        """
+        Выгружает все диалоги между high-water mark и now() - safety_lag
+
+        Окно закрывается по времени с запасом: к этому моменту все
+        транзакции с таким created_at завершены и доехали до реплики, поэтому
+        строки не пропускаются, даже если их id выдан раньше уже выгруженных.
+        Строки читаются серверным курсором пачками по chunk_size в порядке
+        (created_at, id), каждая пачка пишется отдельной row group, поэтому
+        память не зависит от размера таблицы. High-water mark сдвигается только
+        после проверки всех записанных файлов.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        state = ArchiveState.load(self.state_path)
+        until = datetime.now(timezone.utc) - self.safety_lag
+        engine = create_async_engine(self.source_url)
+
+        writers: Dict[str, _DayPartWriter] = {}
+        files: List[str] = []
+        exported = 0
+
+        query = select(*COLUMNS).where(Dialog.created_at <= until)
+        if state.until is not None:
+            query = query.where(Dialog.created_at > state.until)
+
+        try:
+            async with engine.connect() as conn:
+                result = await conn.stream(
+                    query
+                    .order_by(Dialog.created_at, Dialog.id)
+                    .execution_options(yield_per=self.chunk_size)
+                )
+
+                async for rows in result.partitions(self.chunk_size):
+                    chunk_days = set()
+                    for day, table in self._chunk_to_tables(rows):
+                        chunk_days.add(day)
+                        writer = writers.get(day)
+                        if writer is None:
+                            writer = writers[day] = _DayPartWriter(
+                                self.output_dir, day, table.column("id")[0].as_py(), self.schema
+                            )
+                        writer.write(table)
+
+                    # Строки идут по created_at, поэтому дни, которых нет
+                    # в текущей пачке, уже закончились - закрываем их файлы
+                    for day in [d for d in writers if d not in chunk_days]:
+                        files.append(writers.pop(day).close())
+
+                    exported += len(rows)
+                    logger.debug("Archived {} dialogs so far", exported)
+
+            for writer in writers.values():
+                files.append(writer.close())
+            writers.clear()
+
+        except Exception:
+            # Незавершенные файлы не публикуются, high-water mark не двигается
+            for writer in writers.values():
+                writer.writer.close()
+                os.remove(writer.tmp_path)
+            raise
+
+        finally:
+            await engine.dispose()
+
+        # Окно сдвигается и без новых строк: пустой интервал тоже выгружен
+        state = ArchiveState(exported_until=until.isoformat(), rows=state.rows + exported)
+        state.save(self.state_path)
+
+        logger.info(f"Archived {exported} dialogs into {len(files)} files, high-water mark {state.exported_until}")
+        return state
+
+    async def purge(self, state: ArchiveState, retain_days: int, batch_size: Optional[int] = None) -> int:
+        """
+        Удаляет из горячей таблицы выгруженные диалоги старше retain_days
+
+        Удаляются только строки не новее подтвержденного high-water mark,
+        небольшими пачками, чтобы не держать длинные блокировки. Пачка
+        выбирается по индексу ix_dialogs_created_at_id, без чтения всей таблицы.
+        """
+        if state.until is None:
+            return 0
+        batch_size = batch_size or self.chunk_size
+        cutoff = min(datetime.now(timezone.utc) - timedelta(days=retain_days), state.until)
+        engine = create_async_engine(self.primary_url)
+        deleted = 0
+
+        try:
+            while True:
+                batch = (
+                    select(Dialog.id)
+                    .where(Dialog.created_at <= cutoff)
+                    .limit(batch_size)
+                    .scalar_subquery()
+                )
+                async with engine.begin() as conn:
+                    result = await conn.execute(delete(Dialog).where(Dialog.id.in_(batch)))
+                if not result.rowcount:
+                    break
+                deleted += result.rowcount
+        finally:
+            await engine.dispose()
+
+        logger.info(f"Purged {deleted} archived dialogs older than {retain_days} days")
+        return deleted
+
+
+async def main(argv: Optional[List[str]] = None):
+    """Точка входа: python -m bot.services.archive [--purge] [--retain-days N]"""
+    parser = argparse.ArgumentParser(description="Export dialogs to a Parquet archive")
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--purge", action="store_true", help="delete exported rows from the hot table")
+    parser.add_argument("--retain-days", type=int, default=settings.archive_retain_days)
+    args = parser.parse_args(argv)
+
+    exporter = DialogArchiveExporter(output_dir=args.output_dir, chunk_size=args.chunk_size)
+    state = await exporter.export()
+
+    if args.purge:
+        await exporter.purge(state, retain_days=args.retain_days)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except ArchiveError as e:
+        logger.error(f"Archive export failed: {e}")
+        sys.exit(1)
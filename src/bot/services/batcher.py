@@ -0,0 +1,114 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, List, Optional, Set, TypeVar
+from loguru import logger
+
+from monitoring.metrics import batch_size, batch_queue_seconds
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class BatchNotSupported(Exception):
+    """Сервер не поддерживает пакетные запросы"""
+    pass
+
+
+@dataclass
+class _Pending(Generic[T, R]):
+    item: T
+    future: "asyncio.Future[R]"
+    queued_at: float
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Объединение одновременных запросов в пакеты
+
+    Запросы, пришедшие в течение window секунд после первого (или до
+    набора max_size), отправляются одним пакетом, результаты раздаются
+    ожидающим по порядку. Если сервер отвечает BatchNotSupported, пакетный
+    режим отключается и запросы идут по одному.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        send_batch: Callable[[List[T]], Awaitable[List[R]]],
+        send_one: Callable[[T], Awaitable[R]],
+        window: float,
+        max_size: int
+    ):
+        self.name = name
+        self.send_batch = send_batch
+        self.send_one = send_one
+        self.window = window
+        self.max_size = max_size
+        self.supported = True
+        self._pending: List[_Pending[T, R]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item: T) -> R:
+        """Добавляет запрос в текущий пакет и ждет его результат"""
+        if not self.supported:
+            return await self.send_one(item)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Pending(item, future, time.monotonic()))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[_Pending[T, R]]):
+        now = time.monotonic()
+        batch_size.labels(self.name).observe(len(batch))
+        for pending in batch:
+            batch_queue_seconds.labels(self.name).observe(now - pending.queued_at)
+
+        try:
+            if len(batch) == 1:
+                results = [await self.send_one(batch[0].item)]
+            else:
+                results = await self.send_batch([pending.item for pending in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"Batch returned {len(results)} results for {len(batch)} queries")
+        except BatchNotSupported:
+            logger.warning("Batch endpoint is not supported, falling back to single requests")
+            self.supported = False
+            await asyncio.gather(*(self._send_single(pending) for pending in batch))
+            return
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        for pending, result in zip(batch, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    async def _send_single(self, pending: _Pending[T, R]):
+        try:
+            result = await self.send_one(pending.item)
+        except Exception as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+        else:
+            if not pending.future.done():
+                pending.future.set_result(result)
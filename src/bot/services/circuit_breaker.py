@@ -0,0 +1,134 @@
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Generic, Hashable, Optional, Tuple, TypeVar
+from loguru import logger
+
+from monitoring.metrics import circuit_breaker_state
+
+from ..config import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Значения gauge состояния
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для внешнего сервиса
+
+    closed - запросы идут, по последним window вызовам считается доля ошибок
+    и медленных ответов; при превышении порога - open.
+    open - запросы сразу отклоняются open_seconds секунд.
+    half_open - пропускается не больше half_open_calls пробных запросов:
+    все успешны - closed, любая ошибка - снова open.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: Optional[float] = None,
+        slow_call_seconds: Optional[float] = None,
+        slow_call_rate: Optional[float] = None,
+        window: Optional[int] = None,
+        min_calls: Optional[int] = None,
+        open_seconds: Optional[float] = None,
+        half_open_calls: Optional[int] = None
+    ):
+        self.name = name
+        self.failure_rate = failure_rate or settings.breaker_failure_rate
+        self.slow_call_seconds = slow_call_seconds or settings.breaker_slow_call_seconds
+        self.slow_call_rate = slow_call_rate or settings.breaker_slow_call_rate
+        self.min_calls = min_calls or settings.breaker_min_calls
+        self.open_seconds = open_seconds or settings.breaker_open_seconds
+        self.half_open_calls = half_open_calls or settings.breaker_half_open_calls
+        # Последние вызовы: (ошибка, медленный)
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window or settings.breaker_window)
+        self.state = CLOSED
+        self._changed_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        circuit_breaker_state.labels(name).set(_STATE_VALUES[CLOSED])
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        self._changed_at = time.monotonic()
+        circuit_breaker_state.labels(self.name).set(_STATE_VALUES[state])
+        if state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        if state == CLOSED:
+            self._calls.clear()
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос (в half_open занимает место пробного)"""
+        if self.state == OPEN:
+            if time.monotonic() - self._changed_at < self.open_seconds:
+                return False
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                # Пробные запросы могли быть отменены, не сообщив результат
+                if time.monotonic() - self._changed_at < self.open_seconds:
+                    return False
+                self._changed_at = time.monotonic()
+                self._probes = 0
+                self._probe_successes = 0
+            self._probes += 1
+
+        return True
+
+    def record(self, success: bool, duration: float):
+        """Учитывает результат запроса, разрешенного allow_request"""
+        slow = duration >= self.slow_call_seconds
+
+        if self.state == HALF_OPEN:
+            if not success or slow:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CLOSED)
+            return
+
+        self._calls.append((not success, slow))
+        if len(self._calls) < self.min_calls:
+            return
+
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow_calls = sum(1 for _, is_slow in self._calls if is_slow)
+        if failures / len(self._calls) >= self.failure_rate or slow_calls / len(self._calls) >= self.slow_call_rate:
+            self._transition(OPEN)
+
+
+class TTLCache(Generic[T]):
+    """LRU кеш с временем жизни записей"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[T, float]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: Hashable, value: T):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+from loguru import logger
+
+from ..config import settings
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Burst(Generic[T]):
+    """Накопленные сообщения пользователя"""
+    items: List[T] = field(default_factory=list)
+    first_at: float = 0.0
+    last_at: float = 0.0
+
+
+class MessageCoalescer(Generic[T]):
+    """
+    Объединение серии быстрых сообщений пользователя в один ход
+
+    Первое сообщение серии становится ведущим: его обработчик ждет, пока
+    пользователь не замолчит на window секунд (но не дольше max_wait), и
+    обрабатывает все накопленное разом. Сообщения, пришедшие позже или во
+    время генерации, только добавляются в буфер - ведущий обработает их
+    следующим ходом. Так на пользователя всегда не больше одного хода и
+    порядок сообщений сохраняется.
+    """
+
+    def __init__(self, window: Optional[float] = None, max_wait: Optional[float] = None):
+        self.window = settings.message_coalesce_window if window is None else window
+        self.max_wait = settings.message_coalesce_max_wait if max_wait is None else max_wait
+        self._bursts: Dict[Hashable, _Burst[T]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def _wait_for_quiet(self, burst: _Burst[T]):
+        """Ждет паузы в сообщениях длиной window, но не дольше max_wait от начала серии"""
+        while True:
+            deadline = min(burst.last_at + self.window, burst.first_at + self.max_wait)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    async def submit(
+        self,
+        key: Hashable,
+        item: T,
+        process: Callable[[List[T]], Awaitable[Any]]
+    ):
+        """
+        Добавляет сообщение в серию пользователя
+
+        :param key: ключ серии (ID пользователя)
+        :param item: сообщение
+        :param process: обработчик накопленных сообщений одного хода
+        """
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+
+        if burst is not None:
+            # Ведущий уже есть - просто дописываем в буфер
+            if not burst.items:
+                burst.first_at = now
+            burst.items.append(item)
+            burst.last_at = now
+            return
+
+        burst = self._bursts[key] = _Burst(items=[item], first_at=now, last_at=now)
+
+        try:
+            while burst.items:
+                await self._wait_for_quiet(burst)
+
+                items, burst.items = burst.items, []
+                if len(items) > 1:
+                    logger.debug("Coalesced {} messages for {}", len(items), key)
+
+                try:
+                    await process(items)
+                except Exception as e:
+                    logger.error(f"Failed to process coalesced messages for {key}: {e}")
+        finally:
+            del self._bursts[key]
+
+
+# Глобальный экземпляр для текстовых сообщений
+message_coalescer: MessageCoalescer = MessageCoalescer()
@@ -6,6 +6,9 @@ import json
 from loguru import logger
 import redis.asyncio as redis
 
+from monitoring.metrics import timed_stage
+from monitoring.tracing import traced
+
 from ..config import settings
 
 @dataclass
@@ -76,13 +79,15 @@ class ConversationManager:
             cutoff_time = datetime.now() - timedelta(seconds=self.context_ttl)
             recent_messages = [msg for msg in messages if msg.timestamp > cutoff_time]
             
-            logger.debug(f"Retrieved {len(recent_messages)} messages for user {user_id}")
+            logger.debug("Retrieved {} messages for user {}", len(recent_messages), user_id)
             return recent_messages
             
         except Exception as e:
             logger.error(f"Error getting context for user {user_id}: {e}")
             return []
     
+    @timed_stage("context_write")
+    @traced("context.write")
     async def add_message(self, user_id: int, role: str, content: str):
         """Добавляет сообщение в контекст пользователя"""
         if not self.redis_client:
@@ -115,7 +120,7 @@ class ConversationManager:
                 json.dumps(messages_data, ensure_ascii=False)
             )
             
-            logger.debug(f"Added {role} message for user {user_id}")
+            logger.debug("Added {} message for user {}", role, user_id)
             
         except Exception as e:
             logger.error(f"Error adding message for user {user_id}: {e}")
@@ -135,6 +140,8 @@ class ConversationManager:
             logger.error(f"Error clearing context for user {user_id}: {e}")
             raise
     
+    @timed_stage("context_read")
+    @traced("context.read")
     async def get_context_for_llm(self, user_id: int) -> List[Dict[str, str]]:
         """Получает контекст в формате для отправки в LLM"""
         messages = await self.get_context(user_id)
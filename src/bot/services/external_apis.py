@@ -1,10 +1,30 @@
 import asyncio
+import gzip
+import hashlib
+import json
+import random
+import time
 import aiohttp
-from typing import Dict, Any, List, Optional
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from loguru import logger
 from enum import Enum
 
+from monitoring.metrics import (
+    rag_cache_requests_total, external_request_seconds, external_request_errors_total, external_request_retries_total
+)
+from monitoring.tracing import traced, tracer
+
 from ..config import settings
+from .batcher import BatchNotSupported, MicroBatcher
+from .circuit_breaker import CircuitBreaker, TTLCache, OPEN
+from .inline_cache import normalize_query
+from .service_registry import ServiceConfig, service_registry
+
+# Методы, повтор которых не меняет состояние сервиса
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset({502, 503, 504})
 
 
 class ServiceType(Enum):
@@ -18,24 +38,251 @@ class ExternalAPIError(Exception):
     pass
 
 
+class CircuitOpenError(ExternalAPIError):
+    """Сервис недоступен по circuit breaker, запрос не выполнялся"""
+    pass
+
+
 class ExternalAPIService:
     """Сервис для интеграции с внешними FastAPI проектами"""
     
     def __init__(self):
-        self.session: Optional[aiohttp.ClientSession] = None
+        self.registry = service_registry
+        # Сессия (и пул соединений) на каждый сервис реестра
+        self.sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.rag_cache: TTLCache[Dict[str, Any]] = TTLCache(settings.rag_cache_size, settings.rag_cache_ttl)
+        # Одновременные запросы к RAG объединяются в пакеты (если включено)
+        self.rag_batcher: Optional[MicroBatcher[Dict[str, Any], Dict[str, Any]]] = (
+            MicroBatcher(
+                ServiceType.RAG_SYSTEM.value,
+                send_batch=self._post_rag_batch,
+                send_one=self._post_rag_query,
+                window=settings.rag_batch_window,
+                max_size=settings.rag_batch_max_size
+            )
+            if settings.rag_batch_enabled else None
+        )
+        # Сбрасывается, если сервер не знает потоковую точку RAG
+        self.rag_stream_supported = True
     
-    async def get_session(self) -> aiohttp.ClientSession:
-        """Получение или создание HTTP сессии"""
-        if self.session is None or self.session.closed:
-            timeout = aiohttp.ClientTimeout(total=settings.external_services_timeout)
-            self.session = aiohttp.ClientSession(timeout=timeout)
-        return self.session
+    async def get_session(self, service: ServiceConfig) -> aiohttp.ClientSession:
+        """Получение или создание HTTP сессии сервиса"""
+        session = self.sessions.get(service.name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=service.limit,
+                limit_per_host=service.limit_per_host,
+                keepalive_timeout=service.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(total=service.timeout, sock_connect=service.connect_timeout)
+            session = self.sessions[service.name] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return session
     
     async def close(self):
-        """Закрытие HTTP сессии"""
-        if self.session and not self.session.closed:
-            await self.session.close()
+        """Закрытие HTTP сессий"""
+        sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+    
+    def get_breaker(self, service: str) -> CircuitBreaker:
+        """Circuit breaker сервиса (создается при первом обращении)"""
+        breaker = self.breakers.get(service)
+        if breaker is None:
+            breaker = self.breakers[service] = CircuitBreaker(service)
+        return breaker
+    
+    @staticmethod
+    def _headers(service: ServiceConfig, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Заголовки запроса к сервису"""
+        request_headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "Telegram-LLM-Bot/1.0"
+        }
+        
+        if headers:
+            request_headers.update(headers)
+        
+        # Добавляем API ключ если настроен
+        if service.api_key:
+            request_headers["Authorization"] = f"Bearer {service.api_key}"
+        return tracer.inject(request_headers)
+    
+    @staticmethod
+    def _encode_body(service: ServiceConfig, data: Any, headers: Dict[str, str]) -> bytes:
+        """JSON тело запроса; большое сжимается gzip"""
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        if service.compress_min_bytes and len(body) >= service.compress_min_bytes:
+            headers["Content-Encoding"] = "gzip"
+            body = gzip.compress(body, compresslevel=5)
+        return body
+    
+    @asynccontextmanager
+    async def _open(
+        self,
+        service: ServiceConfig,
+        method: str,
+        endpoint: str,
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: Optional[bool] = None,
+        stream: bool = False
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Открывает запрос к сервису с повторами и отдает успешный ответ
+        
+        Повторяются только идемпотентные запросы (по методу или явно через
+        idempotent) при ошибке соединения, таймауте и ответах 502/503/504 -
+        до получения ответа, тело читает вызывающий. Для потоковых ответов
+        (stream) таймаут ограничивает паузу между данными, а не весь ответ.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = service.retries + 1 if idempotent else 1
+        
+        session = await self.get_session(service)
+        url = service.url(endpoint)
+        request_headers = self._headers(service, headers)
+        body = self._encode_body(service, data, request_headers) if data is not None else None
+        timeout = (
+            aiohttp.ClientTimeout(total=None, sock_connect=service.connect_timeout, sock_read=service.timeout)
+            if stream else None
+        )
+        
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 == attempts
+            started = time.monotonic()
+            try:
+                response = await session.request(method, url, data=body, headers=request_headers, timeout=timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                reason = "timeout" if isinstance(e, asyncio.TimeoutError) else "connection"
+                external_request_errors_total.labels(service.name, reason).inc()
+                if last_attempt:
+                    raise
+            else:
+                external_request_seconds.labels(service.name).observe(time.monotonic() - started)
+                if response.status >= 400:
+                    external_request_errors_total.labels(service.name, str(response.status)).inc()
+                if response.status not in RETRY_STATUSES or last_attempt:
+                    try:
+                        response.raise_for_status()
+                        yield response
+                    finally:
+                        response.release()
+                    return
+                response.release()
+            
+            # Экспоненциальная задержка со случайным разбросом
+            external_request_retries_total.labels(service.name).inc()
+            delay = service.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.debug("Retrying {} {} in {:.2f}s (attempt {})", method, url, delay, attempt + 2)
+            await asyncio.sleep(delay)
+    
+    async def _request(
+        self,
+        service: ServiceConfig,
+        method: str,
+        endpoint: str,
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotent: Optional[bool] = None
+    ) -> Tuple[int, Any]:
+        """
+        Запрос к сервису с повторами
+        
+        :return: код ответа и разобранный JSON
+        """
+        async with self._open(service, method, endpoint, data, headers, idempotent) as response:
+            return response.status, await response.json()
+    
+    async def _iter_events(self, response: aiohttp.ClientResponse) -> AsyncIterator[Any]:
+        """
+        События потокового ответа: NDJSON (строка - JSON) или SSE (data: JSON)
+        
+        Ответ читается по частям, в памяти держится только незаконченная
+        строка или событие - не больше external_stream_max_line байт.
+        Обычный JSON ответ отдается одним событием.
+        """
+        content_type = response.content_type
+        if content_type not in ("application/x-ndjson", "application/jsonl", "text/event-stream"):
+            yield await response.json()
+            return
+        
+        sse = content_type == "text/event-stream"
+        limit = settings.external_stream_max_line
+        buffer = b""
+        data_lines: List[bytes] = []
+        
+        async for block in response.content.iter_any():
+            buffer += block
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            if len(buffer) > limit:
+                raise ExternalAPIError(f"Stream line exceeds {limit} bytes")
+            
+            for line in lines:
+                line = line.rstrip(b"\r")
+                if not sse:
+                    if line.strip():
+                        yield json.loads(line)
+                    continue
+                
+                # SSE: строки data: копятся до пустой строки, конец события
+                if line.startswith(b"data:"):
+                    data_lines.append(line[5:].lstrip())
+                    if sum(map(len, data_lines)) > limit:
+                        raise ExternalAPIError(f"Stream event exceeds {limit} bytes")
+                elif not line and data_lines:
+                    payload, data_lines = b"\n".join(data_lines), []
+                    if payload.strip() == b"[DONE]":
+                        return
+                    yield json.loads(payload)
+        
+        # Последняя строка NDJSON может быть без перевода строки
+        if not sse and buffer.strip():
+            yield json.loads(buffer)
+    
+    @staticmethod
+    def _rag_cache_key(query: str, context: Optional[Dict[str, Any]], user_id: Optional[int]) -> str:
+        """
+        Ключ кеша: нормализованный запрос и все, что получает RAG
+
+        user_id входит в ключ: RAG может отбирать документы по пользователю,
+        и ответ одного пользователя не должен достаться другому.
+        """
+        payload = json.dumps([normalize_query(query), context or {}, user_id], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    
+    def _rag_service(self) -> ServiceConfig:
+        service = self.registry.get(ServiceType.RAG_SYSTEM.value)
+        if service is None:
+            raise ExternalAPIError("RAG service URL not configured")
+        return service
+    
+    async def _post_rag_query(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Один запрос к RAG системе (поиск, повтор безопасен)"""
+        service = self._rag_service()
+        logger.debug("Calling RAG service: {}", service.base_url)
+        _, response_data = await self._request(service, "POST", "/query", request_data, idempotent=True)
+        return response_data
     
+    async def _post_rag_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Пакетный запрос к RAG системе: ответы в порядке запросов"""
+        logger.debug("Calling RAG service batch endpoint with {} queries", len(batch))
+        try:
+            _, response_data = await self._request(
+                self._rag_service(), "POST", settings.rag_batch_path, {"queries": batch}, idempotent=True
+            )
+        except aiohttp.ClientResponseError as e:
+            if e.status in (404, 405, 501):
+                raise BatchNotSupported(f"RAG batch endpoint returned {e.status}")
+            raise
+        return response_data["results"]
+    
+    @traced("rag.query")
     async def call_rag_service(
         self,
         query: str,
@@ -50,10 +297,20 @@ class ExternalAPIService:
         :param user_id: ID пользователя
         :return: ответ от RAG системы
         """
-        if not settings.rag_service_url:
+        if self.registry.get(ServiceType.RAG_SYSTEM.value) is None:
             raise ExternalAPIError("RAG service URL not configured")
         
-        session = await self.get_session()
+        cache_key = self._rag_cache_key(query, context, user_id)
+        cached = self.rag_cache.get(cache_key)
+        if cached is not None:
+            rag_cache_requests_total.labels("hit").inc()
+            return cached
+        rag_cache_requests_total.labels("miss").inc()
+        
+        # Пока сервис недоступен, не ждем таймаута на каждом запросе
+        breaker = self.get_breaker(ServiceType.RAG_SYSTEM.value)
+        if not breaker.allow_request():
+            raise CircuitOpenError("RAG service circuit is open")
         
         # Подготавливаем данные для запроса
         request_data = {
@@ -64,108 +321,276 @@ class ExternalAPIService:
         if context:
             request_data["context"] = context
         
-        # Подготавливаем заголовки
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Telegram-LLM-Bot/1.0"
-        }
-        
-        # Добавляем API ключ если настроен
-        if settings.rag_service_api_key:
-            headers["Authorization"] = f"Bearer {settings.rag_service_api_key.get_secret_value()}"
-        
+        started = time.monotonic()
         try:
-            logger.debug(f"Calling RAG service: {settings.rag_service_url}")
-            
-            async with session.post(
-                f"{settings.rag_service_url}/query",
-                json=request_data,
-                headers=headers
-            ) as response:
-                
-                response.raise_for_status()
-                response_data = await response.json()
-                
-                logger.debug("RAG service request completed successfully")
-                return {
-                    "success": True,
-                    "response": response_data.get("answer", ""),
-                    "sources": response_data.get("sources", []),
-                    "confidence": response_data.get("confidence", 0.0),
-                    "service": ServiceType.RAG_SYSTEM.value
-                }
+            if self.rag_batcher is not None:
+                response_data = await self.rag_batcher.submit(request_data)
+            else:
+                response_data = await self._post_rag_query(request_data)
                 
         except aiohttp.ClientError as e:
+            breaker.record(False, time.monotonic() - started)
             logger.error(f"RAG service request failed: {e}")
             raise ExternalAPIError(f"RAG service request failed: {e}")
         
         except Exception as e:
+            breaker.record(False, time.monotonic() - started)
             logger.error(f"Unexpected error in RAG service call: {e}")
             raise ExternalAPIError(f"Unexpected error: {e}")
+        
+        breaker.record(True, time.monotonic() - started)
+        logger.debug("RAG service request completed successfully")
+        result = self._rag_result(response_data.get("answer", ""), response_data)
+        self.rag_cache.set(cache_key, result)
+        return result
+    
+    @staticmethod
+    def _rag_result(answer: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Результат запроса к RAG системе"""
+        return {
+            "success": True,
+            "response": answer,
+            "sources": metadata.get("sources", []),
+            "confidence": metadata.get("confidence", 0.0),
+            "service": ServiceType.RAG_SYSTEM.value
+        }
+    
+    async def stream_rag_service(
+        self,
+        query: str,
+        context: Optional[Dict[str, Any]] = None,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковое обращение к RAG системе
+        
+        Отдает части ответа {"type": "chunk", "text": ...} по мере их получения
+        и последним - {"type": "final", ...} с полями результата call_rag_service
+        (полный ответ, sources, confidence). Сервер отвечает на rag_stream_path
+        потоком NDJSON или SSE: события с delta/text - части ответа, событие с
+        sources/confidence - метаданные. Если потоковый режим выключен или не
+        поддерживается сервером, ответ call_rag_service отдается одной частью.
+        
+        :param query: запрос пользователя
+        :param context: дополнительный контекст
+        :param user_id: ID пользователя
+        """
+        if not settings.rag_stream_enabled or not self.rag_stream_supported:
+            result = await self.call_rag_service(query, context, user_id)
+            yield {"type": "chunk", "text": result["response"]}
+            yield {"type": "final", **result}
+            return
+        
+        service = self._rag_service()
+        
+        cache_key = self._rag_cache_key(query, context, user_id)
+        cached = self.rag_cache.get(cache_key)
+        if cached is not None:
+            rag_cache_requests_total.labels("hit").inc()
+            yield {"type": "chunk", "text": cached["response"]}
+            yield {"type": "final", **cached}
+            return
+        rag_cache_requests_total.labels("miss").inc()
+        
+        breaker = self.get_breaker(ServiceType.RAG_SYSTEM.value)
+        if not breaker.allow_request():
+            raise CircuitOpenError("RAG service circuit is open")
+        
+        request_data = {
+            "query": query,
+            "user_id": user_id,
+            "stream": True
+        }
+        
+        if context:
+            request_data["context"] = context
+        
+        started = time.monotonic()
+        # Для circuit breaker важна задержка до первой части, а не длина потока
+        first_event_at: Optional[float] = None
+        parts: List[str] = []
+        metadata: Dict[str, Any] = {}
+        try:
+            async with self._open(
+                service,
+                "POST",
+                settings.rag_stream_path,
+                request_data,
+                {"Accept": "application/x-ndjson, text/event-stream"},
+                idempotent=True,
+                stream=True
+            ) as response:
+                async for event in self._iter_events(response):
+                    if first_event_at is None:
+                        first_event_at = time.monotonic()
+                    text = event.get("delta") or event.get("text")
+                    if text:
+                        parts.append(text)
+                        yield {"type": "chunk", "text": text}
+                    if "sources" in event or "confidence" in event or event.get("done"):
+                        metadata = event
+        
+        except aiohttp.ClientResponseError as e:
+            if e.status not in (404, 405, 501):
+                breaker.record(False, time.monotonic() - started)
+                logger.error(f"RAG service stream failed: {e}")
+                raise ExternalAPIError(f"RAG service stream failed: {e}")
+            
+            breaker.record(True, time.monotonic() - started)
+            logger.warning("RAG stream endpoint is not supported, falling back to single requests")
+            self.rag_stream_supported = False
+            async for frame in self.stream_rag_service(query, context, user_id):
+                yield frame
+            return
+        
+        except aiohttp.ClientError as e:
+            breaker.record(False, time.monotonic() - started)
+            logger.error(f"RAG service stream failed: {e}")
+            raise ExternalAPIError(f"RAG service stream failed: {e}")
+        
+        except ExternalAPIError:
+            breaker.record(False, time.monotonic() - started)
+            raise
+        
+        except Exception as e:
+            breaker.record(False, time.monotonic() - started)
+            logger.error(f"Unexpected error in RAG service stream: {e}")
+            raise ExternalAPIError(f"Unexpected error: {e}")
+        
+        breaker.record(True, (first_event_at or time.monotonic()) - started)
+        
+        # Сервер без потоковой генерации может прислать ответ целиком
+        answer = "".join(parts)
+        if not parts and metadata.get("answer"):
+            answer = metadata["answer"]
+            yield {"type": "chunk", "text": answer}
+        
+        result = self._rag_result(answer, metadata)
+        self.rag_cache.set(cache_key, result)
+        yield {"type": "final", **result}
     
     async def call_custom_service(
         self,
-        service_url: str,
+        service: str,
         endpoint: str,
-        data: Dict[str, Any],
+        data: Optional[Dict[str, Any]] = None,
         method: str = "POST",
         headers: Optional[Dict[str, str]] = None,
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        idempotent: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Универсальный метод для обращения к кастомным FastAPI сервисам
         
-        :param service_url: базовый URL сервиса
+        :param service: имя сервиса из реестра (EXTERNAL_SERVICES) или базовый URL
         :param endpoint: конечная точка API
         :param data: данные для отправки
         :param method: HTTP метод
         :param headers: дополнительные заголовки
-        :param api_key: API ключ для авторизации
+        :param api_key: API ключ для авторизации (для сервиса, заданного URL)
+        :param idempotent: можно ли повторять запрос (по умолчанию - по методу)
         :return: ответ от сервиса
         """
-        session = await self.get_session()
-        
-        # Подготавливаем заголовки
-        request_headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Telegram-LLM-Bot/1.0"
-        }
-        
-        if headers:
-            request_headers.update(headers)
-        
-        if api_key:
-            request_headers["Authorization"] = f"Bearer {api_key}"
+        try:
+            config = self.registry.resolve(service, api_key)
+        except KeyError as e:
+            raise ExternalAPIError(str(e))
         
-        url = f"{service_url.rstrip('/')}/{endpoint.lstrip('/')}"
+        breaker = self.get_breaker(config.name)
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit is open for {config.name}")
         
+        started = time.monotonic()
         try:
-            logger.debug(f"Calling custom service: {url}")
-            
-            async with session.request(
-                method,
-                url,
-                json=data,
-                headers=request_headers
-            ) as response:
-                
-                response.raise_for_status()
-                response_data = await response.json()
-                
-                logger.debug("Custom service request completed successfully")
-                return {
-                    "success": True,
-                    "data": response_data,
-                    "status_code": response.status
-                }
+            logger.debug("Calling custom service {}: {}", config.name, endpoint)
+            status, response_data = await self._request(config, method, endpoint, data, headers, idempotent)
                 
         except aiohttp.ClientError as e:
+            breaker.record(False, time.monotonic() - started)
             logger.error(f"Custom service request failed: {e}")
             raise ExternalAPIError(f"Custom service request failed: {e}")
         
         except Exception as e:
+            breaker.record(False, time.monotonic() - started)
             logger.error(f"Unexpected error in custom service call: {e}")
             raise ExternalAPIError(f"Unexpected error: {e}")
+        
+        breaker.record(True, time.monotonic() - started)
+        logger.debug("Custom service request completed successfully")
+        return {
+            "success": True,
+            "data": response_data,
+            "status_code": status
+        }
+    
+    async def check_service(self, service: str, endpoint: str):
+        """
+        Проверка доступности сервиса для проб готовности
+        
+        Без повторов и без учета в circuit breaker; открытый breaker
+        считается недоступностью. Ошибка - исключение.
+        """
+        config = self.registry.resolve(service)
+        breaker = self.breakers.get(config.name)
+        if breaker is not None and breaker.state == OPEN:
+            raise CircuitOpenError(f"Circuit is open for {config.name}")
+        async with self._open(config, "GET", endpoint, idempotent=False):
+            pass
+    
+    async def stream_custom_service(
+        self,
+        service: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        method: str = "POST",
+        headers: Optional[Dict[str, str]] = None,
+        api_key: Optional[str] = None,
+        idempotent: Optional[bool] = None
+    ) -> AsyncIterator[Any]:
+        """
+        Потоковое обращение к кастомному сервису: события NDJSON/SSE по мере получения
+        
+        Параметры - как у call_custom_service. Обычный JSON ответ отдается
+        одним событием.
+        """
+        try:
+            config = self.registry.resolve(service, api_key)
+        except KeyError as e:
+            raise ExternalAPIError(str(e))
+        
+        breaker = self.get_breaker(config.name)
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Circuit is open for {config.name}")
+        
+        request_headers = {"Accept": "application/x-ndjson, text/event-stream"}
+        if headers:
+            request_headers.update(headers)
+        
+        started = time.monotonic()
+        first_event_at: Optional[float] = None
+        try:
+            logger.debug("Streaming from custom service {}: {}", config.name, endpoint)
+            async with self._open(config, method, endpoint, data, request_headers, idempotent, stream=True) as response:
+                async for event in self._iter_events(response):
+                    if first_event_at is None:
+                        first_event_at = time.monotonic()
+                    yield event
+        
+        except aiohttp.ClientError as e:
+            breaker.record(False, time.monotonic() - started)
+            logger.error(f"Custom service stream failed: {e}")
+            raise ExternalAPIError(f"Custom service stream failed: {e}")
+        
+        except ExternalAPIError:
+            breaker.record(False, time.monotonic() - started)
+            raise
+        
+        except Exception as e:
+            breaker.record(False, time.monotonic() - started)
+            logger.error(f"Unexpected error in custom service stream: {e}")
+            raise ExternalAPIError(f"Unexpected error: {e}")
+        
+        breaker.record(True, (first_event_at or time.monotonic()) - started)
 
 
 # Глобальный экземпляр сервиса
@@ -0,0 +1,84 @@
+import aiohttp
+import redis.asyncio as redis
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from monitoring.health import HealthServer
+from monitoring.watchdog import BlockingCallDetector, LoopWatchdog
+
+from ..config import settings
+from ..lifecycle import lifecycle
+from .external_apis import external_api_service, ServiceType
+from .profiling import register_debug_routes
+
+
+class DependencyProbes:
+    """
+    Проверки зависимостей бота
+
+    Redis, Postgres и OpenRouter проверяются через собственные соединения,
+    отдельные от рабочих; RAG - через пул сервиса (check_service, без повторов).
+    """
+
+    def __init__(self):
+        self.redis = redis.from_url(settings.redis_url)
+        self.session = aiohttp.ClientSession()
+        # Одно соединение: при исчерпанном рабочем пуле проба не ждет его
+        # и не отнимает соединения у запросов пользователей
+        self.engine = create_async_engine(settings.database_url, pool_size=1, max_overflow=0, pool_recycle=300)
+
+    async def redis_ping(self):
+        await self.redis.ping()
+
+    async def postgres(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def openrouter(self):
+        # Информация о ключе: проверяет и доступность API, и сам ключ
+        async with self.session.get(
+            f"{settings.openrouter_base_url}/auth/key",
+            headers={"Authorization": f"Bearer {settings.openrouter_api_key.get_secret_value()}"}
+        ) as response:
+            response.raise_for_status()
+
+    async def rag(self):
+        await external_api_service.check_service(ServiceType.RAG_SYSTEM.value, settings.rag_health_path)
+
+    async def close(self):
+        await self.session.close()
+        await self.redis.aclose()
+        await self.engine.dispose()
+
+
+def create_health_server() -> HealthServer:
+    """
+    Сервер состояния с пробами зависимостей текущей роли
+
+    Redis и Postgres критичны для готовности; OpenRouter и RAG только
+    отображаются: их недоступность переживается фолбэками и не должна
+    выводить из балансировки все экземпляры сразу.
+    """
+    server = HealthServer(
+        probe_interval=settings.health_probe_interval,
+        probe_timeout=settings.health_probe_timeout,
+        max_loop_lag=settings.health_max_loop_lag,
+        draining=lambda: lifecycle.draining,
+        watchdog=LoopWatchdog(settings.loop_stall_threshold)
+    )
+    if settings.blocking_call_detection:
+        BlockingCallDetector(settings.blocking_json_min_bytes).install()
+    probes = DependencyProbes()
+    lifecycle.on_shutdown("health probes", probes.close)
+
+    server.add_probe("redis", probes.redis_ping)
+    # Ingress не обрабатывает обновления и не использует остальные зависимости
+    if settings.bot_role != "ingress":
+        server.add_probe("postgres", probes.postgres)
+        if settings.generation_mode == "local":
+            server.add_probe("openrouter", probes.openrouter, critical=False)
+            if external_api_service.registry.get(ServiceType.RAG_SYSTEM.value) is not None:
+                server.add_probe("rag", probes.rag, critical=False)
+
+    register_debug_routes(server)
+    return server
@@ -0,0 +1,157 @@
+from typing import List, Optional
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from loguru import logger
+from sqlalchemy import select, func, tuple_
+
+from ..config import settings
+from ..database.database import Dialog, get_session
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class HistoryCursor:
+    """Позиция в истории диалогов: (created_at, id) граничной записи"""
+    created_at: datetime
+    dialog_id: int
+
+    def encode(self) -> str:
+        """Компактное представление для callback_data (лимит Telegram - 64 байта)"""
+        delta = self.created_at.astimezone(timezone.utc) - EPOCH
+        micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+        return f"{micros}:{self.dialog_id}"
+
+    @classmethod
+    def decode(cls, value: str) -> "HistoryCursor":
+        micros, dialog_id = value.split(":", 1)
+        return cls(
+            created_at=EPOCH + timedelta(microseconds=int(micros)),
+            dialog_id=int(dialog_id)
+        )
+
+
+@dataclass
+class HistoryEntry:
+    """Запись истории диалога"""
+    dialog_id: int
+    created_at: datetime
+    user_message: str
+    bot_response: Optional[str]
+    model_used: Optional[str]
+
+    @property
+    def cursor(self) -> HistoryCursor:
+        return HistoryCursor(created_at=self.created_at, dialog_id=self.dialog_id)
+
+
+@dataclass
+class HistoryPage:
+    """Страница истории (записи от новых к старым)"""
+    entries: List[HistoryEntry]
+    has_newer: bool
+    has_older: bool
+
+    @property
+    def newer_cursor(self) -> Optional[HistoryCursor]:
+        return self.entries[0].cursor if self.entries else None
+
+    @property
+    def older_cursor(self) -> Optional[HistoryCursor]:
+        return self.entries[-1].cursor if self.entries else None
+
+
+class DialogHistoryService:
+    """Сервис постраничного просмотра истории диалогов (keyset-пагинация)"""
+
+    def __init__(
+        self,
+        page_size: Optional[int] = None,
+        preview_length: Optional[int] = None
+    ):
+        self.page_size = page_size or settings.history_page_size
+        self.preview_length = preview_length or settings.history_preview_length
+
+    def _build_query(
+        self,
+        telegram_id: int,
+        cursor: Optional[HistoryCursor],
+        older: bool
+    ):
+        """
+        Строит seek-запрос по индексу (telegram_id, created_at DESC, id DESC)
+
+        Вместо OFFSET используется сравнение кортежей с граничной записью,
+        поэтому стоимость запроса не зависит от глубины страницы.
+        """
+        position = tuple_(Dialog.created_at, Dialog.id)
+
+        query = select(
+            Dialog.id,
+            Dialog.created_at,
+            # Обрезаем тексты на стороне БД, чтобы не тянуть длинные ответы целиком
+            func.substr(Dialog.user_message, 1, self.preview_length),
+            func.substr(Dialog.bot_response, 1, self.preview_length),
+            Dialog.model_used
+        ).where(Dialog.telegram_id == telegram_id)
+
+        if older:
+            if cursor is not None:
+                query = query.where(position < tuple_(cursor.created_at, cursor.dialog_id))
+            query = query.order_by(Dialog.created_at.desc(), Dialog.id.desc())
+        else:
+            query = query.where(position > tuple_(cursor.created_at, cursor.dialog_id))
+            query = query.order_by(Dialog.created_at.asc(), Dialog.id.asc())
+
+        # Берем на одну запись больше, чтобы узнать есть ли следующая страница
+        return query.limit(self.page_size + 1)
+
+    async def get_page(
+        self,
+        telegram_id: int,
+        cursor: Optional[HistoryCursor] = None,
+        older: bool = True
+    ) -> HistoryPage:
+        """
+        Получает страницу истории пользователя
+
+        :param telegram_id: Telegram ID пользователя
+        :param cursor: граничная запись предыдущей страницы (None - самые свежие)
+        :param older: направление - к более старым (True) или к более новым записям
+        :return: страница истории
+        """
+        if not older and cursor is None:
+            raise ValueError("Cursor is required to page towards newer dialogs")
+
+        query = self._build_query(telegram_id, cursor, older)
+
+        async for session in get_session():
+            result = await session.execute(query)
+            rows = result.all()
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        entries = [
+            HistoryEntry(
+                dialog_id=row[0],
+                created_at=row[1],
+                user_message=row[2],
+                bot_response=row[3],
+                model_used=row[4]
+            )
+            for row in rows
+        ]
+
+        if older:
+            page = HistoryPage(entries=entries, has_newer=cursor is not None, has_older=has_more)
+        else:
+            entries.reverse()
+            page = HistoryPage(entries=entries, has_newer=has_more, has_older=True)
+
+        logger.debug("Loaded {} history entries for user {}", len(entries), telegram_id)
+        return page
+
+
+# Глобальный экземпляр сервиса
+history_service = DialogHistoryService()
@@ -0,0 +1,83 @@
+import hashlib
+import re
+from typing import Optional
+from loguru import logger
+import redis.asyncio as redis
+
+from ..config import settings
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:…]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует inline-запрос: регистр, пробелы, завершающая пунктуация"""
+    query = _WHITESPACE.sub(" ", query.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", query)
+
+
+class InlineAnswerCache:
+    """
+    Общий для реплик кеш ответов на inline-запросы
+
+    Ключ - нормализованный запрос; ответ выдается только на тот же запрос
+    (запрос короче - другой вопрос, и ответ на него чужой).
+    """
+
+    def __init__(self, key_prefix: str = "inline"):
+        self.redis_client: Optional[redis.Redis] = None
+        self.key_prefix = key_prefix
+        self.ttl = settings.inline_cache_ttl
+
+    async def initialize(self):
+        """Инициализация Redis соединения"""
+        try:
+            self.redis_client = redis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            await self.redis_client.ping()
+            logger.info("InlineAnswerCache initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize InlineAnswerCache: {e}")
+            raise
+
+    def _get_key(self, normalized: str) -> str:
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}:{digest}"
+
+    async def get(self, normalized: str) -> Optional[str]:
+        """
+        Ищет ответ в кеше
+
+        :param normalized: нормализованный запрос
+        :return: ответ или None
+        """
+        if self.redis_client is None:
+            return None
+
+        try:
+            return await self.redis_client.get(self._get_key(normalized))
+        except Exception as e:
+            logger.warning(f"Inline cache unavailable: {e}")
+            return None
+
+    async def set(self, normalized: str, answer: str):
+        """Сохраняет ответ в кеш"""
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.set(self._get_key(normalized), answer, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store inline answer: {e}")
+
+    async def close(self):
+        """Закрывает соединение с Redis"""
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("InlineAnswerCache connection closed")
+
+
+# Глобальный экземпляр (инициализируется в main.py)
+inline_cache = InlineAnswerCache()
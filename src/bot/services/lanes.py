@@ -0,0 +1,83 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+from aiogram.types import Update
+
+from monitoring.metrics import lane_queue_seconds, lane_in_flight, lane_waiting
+
+from ..config import settings
+
+FAST = "fast"
+SLOW = "slow"
+
+
+def classify_update(update: Update) -> str:
+    """
+    Полоса обновления
+
+    Медленная - то, что уходит в LLM (текстовые сообщения и inline-запросы),
+    быстрая - команды, нажатия кнопок и все остальное.
+    """
+    if update.message is not None:
+        text = update.message.text
+        return SLOW if text and not text.startswith("/") else FAST
+    if update.inline_query is not None:
+        return SLOW
+    return FAST
+
+
+class Lane:
+    """Полоса обработки: свой бюджет одновременных обновлений и своя очередь"""
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Занимает место в полосе; время ожидания попадает в метрики"""
+        queued_at = time.monotonic()
+        self.waiting += 1
+        lane_waiting.labels(self.name).inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            lane_waiting.labels(self.name).dec()
+        lane_queue_seconds.labels(self.name).observe(time.monotonic() - queued_at)
+
+        self.in_flight += 1
+        lane_in_flight.labels(self.name).inc()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            lane_in_flight.labels(self.name).dec()
+            self._semaphore.release()
+
+
+class LaneScheduler:
+    """
+    Разделение обновлений по полосам
+
+    Долгие ходы LLM ждут своей очереди в медленной полосе и не занимают
+    соединения с БД и Redis, нужные командам и кнопкам, поэтому быстрая
+    полоса отвечает без задержек даже при полной загрузке генерациями.
+    """
+
+    def __init__(self):
+        self.lanes: Dict[str, Lane] = {
+            FAST: Lane(FAST, settings.lane_fast_concurrency),
+            SLOW: Lane(SLOW, settings.lane_slow_concurrency),
+        }
+
+    def lane_for(self, update: Update) -> Lane:
+        return self.lanes[classify_update(update)]
+
+
+# Глобальный экземпляр (используется в LaneMiddleware)
+lane_scheduler = LaneScheduler()
@@ -1,19 +1,38 @@
-from typing import List, Dict, Optional
+import asyncio
+from typing import Callable, List, Dict, Optional
 from loguru import logger
 from sqlalchemy import select, insert
 
+from monitoring.metrics import rag_fallbacks_total, stage_timer, timed_stage
+from monitoring.tracing import traced
+
 from .openrouter import openrouter_generate_async, OpenRouterError
 from .context import ConversationManager
-from .external_apis import external_api_service, ExternalAPIError, ServiceType
+from .external_apis import external_api_service, ExternalAPIError, CircuitOpenError, ServiceType
+from .token_budget import token_budget, TokenBudgetExceeded, estimate_prompt_tokens
+from .preferences import preferences_service
 from ..config import settings
 from ..database.database import User, Dialog, get_session
 
+def _discard(task: asyncio.Task):
+    """Отменяет ненужную задачу, не оставляя необработанных исключений"""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _cancel(task: asyncio.Task):
+    """Отменяет задачу и дожидается ее завершения (включая возврат резерва)"""
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
 class LLMService:
     """Сервис для работы с LLM через OpenRouter"""
     
     def __init__(self, conversation_manager: ConversationManager):
         self.conversation_manager = conversation_manager
     
+    @timed_stage("user_lookup")
+    @traced("db.ensure_user")
     async def _ensure_user_exists(self, user_id: int, telegram_user) -> int:
         """Убеждается что пользователь существует в БД, возвращает внутренний ID"""
         try:
@@ -43,6 +62,8 @@ class LLMService:
             logger.error(f"Error ensuring user exists: {e}")
             return None
     
+    @timed_stage("db_persist")
+    @traced("db.save_dialog")
     async def _save_dialog(self, internal_user_id: int, telegram_id: int, 
                           user_message: str, bot_response: str, 
                           model_used: str, tokens_used: int):
@@ -58,7 +79,7 @@ class LLMService:
                     tokens_used=tokens_used
                 )
                 session.add(dialog)
-                logger.debug(f"Saved dialog for user {telegram_id}")
+                logger.debug("Saved dialog for user {}", telegram_id)
                 
         except Exception as e:
             logger.error(f"Error saving dialog: {e}")
@@ -68,9 +89,15 @@ class LLMService:
         user_id: int,
         user_message: str,
         messages: List[Dict[str, str]],
-        use_context: bool = True
+        use_context: bool = True,
+        on_partial: Optional[Callable[[str], None]] = None
     ) -> str:
-        """Генерирует ответ используя RAG систему"""
+        """
+        Генерирует ответ используя RAG систему
+        
+        При включенном rag_stream_enabled ответ читается потоком, и on_partial
+        получает накопленный текст после каждой части.
+        """
         try:
             # Подготавливаем контекст для RAG системы
             context = {}
@@ -80,11 +107,15 @@ class LLMService:
                 context["conversation_history"] = recent_messages
             
             # Обращаемся к RAG системе
-            rag_response = await external_api_service.call_rag_service(
-                query=user_message,
-                context=context,
-                user_id=user_id
-            )
+            with stage_timer("rag"):
+                if on_partial is not None and settings.rag_stream_enabled:
+                    rag_response = await self._stream_rag(user_id, user_message, context, on_partial)
+                else:
+                    rag_response = await external_api_service.call_rag_service(
+                        query=user_message,
+                        context=context,
+                        user_id=user_id
+                    )
             
             if rag_response["success"]:
                 response_text = rag_response["response"]
@@ -99,6 +130,7 @@ class LLMService:
                 return "Извините, RAG система временно недоступна. Попробуйте позже."
                 
         except ExternalAPIError as e:
+            rag_fallbacks_total.labels("rag", "circuit_open" if isinstance(e, CircuitOpenError) else "error").inc()
             logger.error(f"RAG system error for user {user_id}: {e}")
             return "Извините, произошла ошибка при обращении к базе знаний. Попробуйте позже."
         
@@ -106,6 +138,90 @@ class LLMService:
             logger.error(f"Unexpected error in RAG response generation: {e}")
             return "Произошла внутренняя ошибка в RAG системе."
     
+    @traced("rag.stream")
+    async def _stream_rag(
+        self,
+        user_id: int,
+        user_message: str,
+        context: Dict,
+        on_partial: Callable[[str], None]
+    ) -> Dict[str, any]:
+        """Читает ответ RAG потоком, сообщая накопленный текст; возвращает итоговый результат"""
+        text = ""
+        result = None
+        async for frame in external_api_service.stream_rag_service(
+            query=user_message,
+            context=context,
+            user_id=user_id
+        ):
+            if frame["type"] == "final":
+                result = frame
+            else:
+                text += frame["text"]
+                on_partial(text)
+        
+        if result is None:
+            raise ExternalAPIError("RAG stream ended without final frame")
+        return result
+    
+    async def _generate_llm(
+        self,
+        user_id: int,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None
+    ) -> Dict[str, any]:
+        """Запрос к OpenRouter с резервированием бюджета токенов"""
+        # Резервируем бюджет токенов до обращения к OpenRouter
+        reservation = await token_budget.reserve(
+            user_id, messages, settings.max_tokens, model or settings.default_model
+        )
+        
+        try:
+            response = await openrouter_generate_async(
+                prompt="",  # Не используется когда передаем messages
+                messages=messages,
+                model=reservation.model,
+                max_tokens=settings.max_tokens,
+                temperature=settings.temperature
+            )
+        except OpenRouterError:
+            token_budget.settle(reservation, None)
+            raise
+        except asyncio.CancelledError:
+            # Отмененный запрос мог успеть дойти до провайдера - списываем промпт.
+            # Возврат остального дожидаемся: следующий резерв (например, после
+            # отмены спекулятивной генерации) не должен его опередить
+            refund = token_budget.settle(reservation, {"total_tokens": estimate_prompt_tokens(messages)})
+            if refund is not None:
+                await asyncio.shield(refund)
+            raise
+        
+        token_budget.settle(reservation, response.get("usage", {}))
+        return response
+    
+    @timed_stage("rag")
+    async def _fetch_rag_info(self, user_id: int, user_message: str, rag_context: Dict) -> Optional[Dict]:
+        """Ответ RAG системы для гибридного режима (None - RAG недоступна)"""
+        try:
+            rag_response = await external_api_service.call_rag_service(
+                query=user_message,
+                context=rag_context,
+                user_id=user_id
+            )
+        except ExternalAPIError as e:
+            rag_fallbacks_total.labels("hybrid", "circuit_open" if isinstance(e, CircuitOpenError) else "error").inc()
+            logger.warning("RAG system not available for hybrid mode, using LLM only")
+            return None
+        
+        if not rag_response["success"]:
+            return None
+        
+        return {
+            "content": rag_response["response"],
+            "sources": rag_response.get("sources", []),
+            "confidence": rag_response.get("confidence", 0.0)
+        }
+    
     async def _generate_hybrid_response(
         self,
         user_id: int,
@@ -114,36 +230,57 @@ class LLMService:
         use_context: bool = True,
         model: Optional[str] = None
     ) -> str:
-        """Генерирует ответ используя гибридный подход (RAG + LLM)"""
+        """
+        Генерирует ответ используя гибридный подход (RAG + LLM)
+        
+        Запрос к RAG и чтение контекста идут параллельно. Если включен
+        hybrid_speculative, одновременно с RAG запускается генерация без RAG:
+        она отменяется, если RAG ответила уверенно, и используется как ответ,
+        если RAG не ответила за hybrid_rag_timeout или не уверена.
+        """
+        speculative = None
+        rag_task = None
         try:
-            # Сначала получаем информацию из RAG системы
             rag_context = {}
             if use_context and messages:
                 recent_messages = messages[-3:] if len(messages) > 3 else messages
                 rag_context["conversation_history"] = recent_messages
             
+            rag_task = asyncio.create_task(self._fetch_rag_info(user_id, user_message, rag_context))
+            
+            # Контекст диалога читается, пока RAG ищет ответ
+            dialog_messages = messages.copy()
+            if use_context:
+                dialog_messages.extend(await self.conversation_manager.get_context_for_llm(user_id))
+            else:
+                dialog_messages.append({"role": "user", "content": user_message})
+            
+            if settings.hybrid_speculative:
+                speculative = asyncio.create_task(self._generate_llm(user_id, dialog_messages, model))
+                await asyncio.wait({rag_task}, timeout=settings.hybrid_rag_timeout)
+            
             rag_info = None
-            try:
-                rag_response = await external_api_service.call_rag_service(
-                    query=user_message,
-                    context=rag_context,
-                    user_id=user_id
-                )
-                
-                if rag_response["success"]:
-                    rag_info = {
-                        "content": rag_response["response"],
-                        "sources": rag_response.get("sources", []),
-                        "confidence": rag_response.get("confidence", 0.0)
-                    }
-                    
-            except ExternalAPIError:
-                logger.warning("RAG system not available for hybrid mode, using LLM only")
+            if not rag_task.done() and speculative is not None:
+                logger.debug("RAG is slow for user {}, using LLM-only response", user_id)
+                rag_fallbacks_total.labels("hybrid", "slow").inc()
+            else:
+                rag_info = await rag_task
+            
+            confident = rag_info is not None and rag_info["confidence"] > settings.hybrid_confidence_threshold
+            
+            if speculative is not None and not confident:
+                response = await speculative
+                return response["content"]
+            
+            if speculative is not None:
+                # Резерв спекулятивного запроса возвращается до резерва основного,
+                # иначе у границы бюджета основной ответ урезается из-за ненужного
+                await _cancel(speculative)
             
             # Формируем промпт для LLM с учетом RAG данных
             enhanced_messages = messages.copy()
             
-            if rag_info and rag_info["confidence"] > 0.3:  # Используем RAG только если уверенность > 30%
+            if confident:
                 rag_context_prompt = f"""
 Используй следующую информацию из базы знаний для ответа:
 
@@ -155,30 +292,20 @@ class LLMService:
 """
                 enhanced_messages.append({"role": "system", "content": rag_context_prompt})
             
-            # Добавляем контекст диалога если нужно
-            if use_context:
-                context_messages = await self.conversation_manager.get_context_for_llm(user_id)
-                enhanced_messages.extend(context_messages)
-            else:
-                enhanced_messages.append({"role": "user", "content": user_message})
-            
-            # Генерируем ответ через OpenRouter
-            response = await openrouter_generate_async(
-                prompt="",
-                messages=enhanced_messages,
-                model=model or settings.default_model,
-                max_tokens=settings.max_tokens,
-                temperature=settings.temperature
-            )
+            enhanced_messages.extend(dialog_messages[len(messages):])
             
+            response = await self._generate_llm(user_id, enhanced_messages, model)
             bot_response = response["content"]
             
             # Добавляем информацию об источниках если использовался RAG
-            if rag_info and rag_info["sources"]:
+            if confident and rag_info["sources"]:
                 bot_response += f"\n\n🧠 <i>Ответ основан на базе знаний и AI модели</i>"
             
             return bot_response
             
+        except TokenBudgetExceeded:
+            raise
+        
         except OpenRouterError as e:
             logger.error(f"OpenRouter error in hybrid mode for user {user_id}: {e}")
             # Fallback на чистый RAG если LLM недоступен
@@ -187,6 +314,11 @@ class LLMService:
         except Exception as e:
             logger.error(f"Unexpected error in hybrid response generation: {e}")
             return "Произошла внутренняя ошибка в гибридном режиме."
+        
+        finally:
+            for task in (rag_task, speculative):
+                if task is not None and not task.done():
+                    _discard(task)
     
     async def generate_response(
         self,
@@ -196,7 +328,9 @@ class LLMService:
         model: Optional[str] = None,
         use_context: bool = True,
         system_prompt: Optional[str] = None,
-        chat_mode: str = "openrouter"
+        chat_mode: Optional[str] = None,
+        save_context: bool = True,
+        on_partial: Optional[Callable[[str], None]] = None
     ) -> Dict[str, any]:
         """
         Генерирует ответ с учетом выбранного режима общения
@@ -204,24 +338,33 @@ class LLMService:
         :param user_id: ID пользователя
         :param user_message: сообщение пользователя
         :param telegram_user: объект пользователя Telegram
-        :param model: модель для использования
+        :param model: модель для использования (None - из настроек пользователя)
         :param use_context: использовать контекст диалога
         :param system_prompt: системный промпт
-        :param chat_mode: режим общения (openrouter/rag/hybrid)
+        :param chat_mode: режим общения openrouter/rag/hybrid (None - из настроек пользователя)
+        :param save_context: сохранять сообщение и ответ в контекст диалога
+        :param on_partial: получает накопленный текст ответа по мере генерации (режим rag)
         :return: словарь с ответом и метаданными
         """
         try:
+            # Подставляем сохраненные настройки пользователя (обычно из локального кеша)
+            if model is None or chat_mode is None:
+                preferences = await preferences_service.get(user_id)
+                model = model or preferences.model
+                chat_mode = chat_mode or preferences.chat_mode
+            
             # Убеждаемся что пользователь существует в БД
             internal_user_id = None
             if telegram_user:
                 internal_user_id = await self._ensure_user_exists(user_id, telegram_user)
             
             # Добавляем сообщение пользователя в контекст
-            await self.conversation_manager.add_message(
-                user_id=user_id,
-                role="user",
-                content=user_message
-            )
+            if save_context:
+                await self.conversation_manager.add_message(
+                    user_id=user_id,
+                    role="user",
+                    content=user_message
+                )
             
             # Получаем контекст для LLM
             messages = []
@@ -230,13 +373,17 @@ class LLMService:
             if system_prompt:
                 messages.append({"role": "system", "content": system_prompt})
             
+            # Ответ OpenRouter (в режимах rag/hybrid usage не учитывается)
+            response = {}
+            
             # Выбираем метод генерации ответа в зависимости от режима
             if chat_mode == "rag":
                 bot_response = await self._generate_rag_response(
                     user_id=user_id,
                     user_message=user_message,
                     messages=messages,
-                    use_context=use_context
+                    use_context=use_context,
+                    on_partial=on_partial
                 )
                 model_used = "rag_system"
                 
@@ -260,28 +407,22 @@ class LLMService:
                     messages.append({"role": "user", "content": user_message})
                 
                 # Генерируем ответ
-                response = await openrouter_generate_async(
-                    prompt="",  # Не используется когда передаем messages
-                    messages=messages,
-                    model=model or settings.default_model,
-                    max_tokens=settings.max_tokens,
-                    temperature=settings.temperature
-                )
+                response = await self._generate_llm(user_id, messages, model)
                 
                 bot_response = response["content"]
                 model_used = response.get("model", "unknown")
             
             # Добавляем ответ бота в контекст
-            await self.conversation_manager.add_message(
-                user_id=user_id,
-                role="assistant",
-                content=bot_response
-            )
+            if save_context:
+                await self.conversation_manager.add_message(
+                    user_id=user_id,
+                    role="assistant",
+                    content=bot_response
+                )
             
-            logger.info(f"Generated response for user {user_id} using model {response.get('model', 'unknown')}")
+            logger.info(f"Generated response for user {user_id} using model {model_used}")
             
             # Сохраняем диалог в базу данных
-            tokens_used = response.get("usage", {}).get("total_tokens", 0)
             await self._save_dialog(
                 internal_user_id=internal_user_id,  # Может быть None
                 telegram_id=user_id,
@@ -299,6 +440,14 @@ class LLMService:
                 "chat_mode": chat_mode
             }
             
+        except TokenBudgetExceeded as e:
+            logger.warning(str(e))
+            return {
+                "response": "⚠️ Вы исчерпали лимит токенов. Попробуйте позже.",
+                "error": str(e),
+                "success": False
+            }
+        
         except OpenRouterError as e:
             logger.error(f"OpenRouter error for user {user_id}: {e}")
             return {
@@ -1,9 +1,13 @@
 import os
 import json
+import time
 import requests
 from typing import Dict, Any, List, Optional
 from loguru import logger
 
+from monitoring.metrics import api_request_duration, stage_seconds, stage_in_flight, upstream_errors_total
+from monitoring.tracing import traced, tracer
+
 from ..config import settings
 
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
@@ -26,6 +30,9 @@ def openrouter_generate(
     """
     Отправляет запрос в OpenRouter API и возвращает ответ.
     
+    Блокирующий вызов: из асинхронного кода используйте openrouter_generate_async
+    (вызовы из цикла событий отмечает BLOCKING_CALL_DETECTION).
+    
     :param prompt: текст запроса пользователя (используется если messages не указан)
     :param api_key: ключ OpenRouter (если None — берётся из настроек)
     :param model: ID модели (если None — берётся из настроек)
@@ -94,7 +101,7 @@ def openrouter_generate(
         request_data["structured_outputs"] = True
     
     try:
-        logger.debug(f"Sending request to OpenRouter: model={model}, max_tokens={max_tokens}")
+        logger.debug("Sending request to OpenRouter: model={}, max_tokens={}", model, max_tokens)
         
         response = requests.post(
             API_URL,
@@ -157,6 +164,7 @@ def openrouter_generate(
         logger.error(f"Unexpected error in openrouter_generate: {e}")
         raise OpenRouterError(f"Unexpected error: {e}")
 
+@traced("openrouter.generate")
 async def openrouter_generate_async(
     prompt: str,
     api_key: Optional[str] = None,
@@ -229,8 +237,17 @@ async def openrouter_generate_async(
         }
         request_data["structured_outputs"] = True
     
+    span = tracer.current_span()
+    if span is not None:
+        span.set_attribute("model", model)
+    
+    started = time.perf_counter()
+    # Итог для upstream_errors_total (None - успешный ответ)
+    status = None
+    in_flight = stage_in_flight.labels("llm")
+    in_flight.inc()
     try:
-        logger.debug(f"Sending async request to OpenRouter: model={model}, max_tokens={max_tokens}")
+        logger.debug("Sending async request to OpenRouter: model={}, max_tokens={}", model, max_tokens)
         
         import ssl
         
@@ -247,20 +264,24 @@ async def openrouter_generate_async(
         ) as session:
             async with session.post(
                 API_URL,
-                headers={
+                headers=tracer.inject({
                     "Authorization": f"Bearer {api_key}",
                     "Content-Type": "application/json",
                     "HTTP-Referer": "https://github.com/your-repo",
                     "X-Title": "Telegram LLM Bot"
-                },
+                }),
                 json=request_data
             ) as response:
-                
+                # Без потоковой генерации первый байт приходит вместе с заголовками
+                stage_seconds.labels("llm_ttft").observe(time.perf_counter() - started)
+                if response.status >= 400:
+                    status = str(response.status)
                 response.raise_for_status()
                 response_data = await response.json()
                 
                 # Проверяем наличие ошибок в ответе
                 if "error" in response_data:
+                    status = "api_error"
                     error_msg = response_data["error"].get("message", "Unknown error")
                     raise OpenRouterError(f"OpenRouter API error: {error_msg}")
                 
@@ -294,13 +315,24 @@ async def openrouter_generate_async(
                 }
                 
     except asyncio.TimeoutError:
+        status = "timeout"
         logger.error("OpenRouter async request timed out")
         raise OpenRouterError("Request timed out")
     
     except aiohttp.ClientError as e:
+        status = status or "connection"
         logger.error(f"OpenRouter async request failed: {e}")
         raise OpenRouterError(f"Request failed: {e}")
     
     except Exception as e:
+        status = status or "error"
         logger.error(f"Unexpected error in openrouter_generate_async: {e}")
-        raise OpenRouterError(f"Unexpected error: {e}")
\ No newline at end of file
+        raise OpenRouterError(f"Unexpected error: {e}")
+    
+    finally:
+        in_flight.dec()
+        duration = time.perf_counter() - started
+        stage_seconds.labels("llm").observe(duration)
+        api_request_duration.labels("openrouter", model).observe(duration)
+        if status is not None:
+            upstream_errors_total.labels("openrouter", model, status).inc()
\ No newline at end of file
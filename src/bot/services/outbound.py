@@ -0,0 +1,387 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple, Union
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from loguru import logger
+import redis.asyncio as redis
+
+from monitoring.metrics import stage_timer
+from monitoring.tracing import tracer
+
+from ..config import settings
+from ..lifecycle import lifecycle
+from .circuit_breaker import CircuitBreaker
+from .rate_limiter import GCRA_SCRIPT
+
+# Приоритеты отправки: меньше - раньше
+INTERACTIVE = 0
+BULK = 10
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+SCHEDULED_METHOD_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+# Не считаются сообщениями и не должны расходовать лимит чата
+UNSCHEDULED_METHODS = frozenset({"SendChatAction"})
+
+# Ключ общего для всех процессов глобального лимита
+GLOBAL_LIMIT_KEY = "outbound:global"
+
+ChatId = Union[int, str]
+
+_send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Задает приоритет для всех отправок внутри блока"""
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 - токен есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def time_to_full(self, now: float) -> float:
+        """Сколько ждать до полного восстановления бакета"""
+        self._refill(now)
+        return (self.burst - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+
+@dataclass
+class _Request:
+    """Запрос в очереди отправки"""
+    priority: int
+    seq: int
+    make_request: NextRequestMiddlewareType
+    bot: Bot
+    method: TelegramMethod
+    future: asyncio.Future
+    attempts: int = 0
+
+
+@dataclass
+class _ChatState:
+    """Очередь и лимит одного чата"""
+    bucket: TokenBucket
+    queue: Deque[_Request] = field(default_factory=deque)
+    busy: bool = False
+    blocked_until: float = 0.0
+
+
+def _queue_key(method: TelegramMethod) -> Optional[ChatId]:
+    """Очередь запроса: чат, а для inline-сообщений (без chat_id) - само сообщение"""
+    chat_id = getattr(method, "chat_id", None)
+    if chat_id is not None:
+        return chat_id
+    inline_message_id = getattr(method, "inline_message_id", None)
+    return f"inline:{inline_message_id}" if inline_message_id else None
+
+
+class OutboundScheduler:
+    """
+    Планировщик исходящих запросов к Telegram
+
+    Соблюдает глобальный лимит и лимит на чат (token bucket), обрабатывает
+    flood wait (retry_after) без блокировки обработчиков. Внутри чата порядок
+    отправки сохраняется, между чатами первыми уходят интерактивные ответы.
+    Глобальный лимит после initialize() общий для всех процессов бота
+    (GCRA в Redis); локальный бакет только ограничивает процесс сверху.
+    Первая же ошибка или медленный ответ Redis размыкает circuit breaker:
+    на время open_seconds остается только локальный бакет, и отправка не
+    ждет таймаута Redis перед каждым сообщением.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(settings.telegram_global_rate, settings.telegram_global_rate)
+        self.redis_client: Optional[redis.Redis] = None
+        self._global_script = None
+        self._global_emission_ms = max(1, int(1000 / settings.telegram_global_rate))
+        self._shared_breaker = CircuitBreaker(
+            "telegram_shared_limit",
+            slow_call_seconds=0.1,
+            slow_call_rate=0.5,
+            min_calls=1,
+            half_open_calls=1
+        )
+        self.chat_rate = settings.telegram_chat_rate
+        self.chat_burst = settings.telegram_chat_burst
+        self.max_retries = settings.telegram_send_max_retries
+        self._chats: Dict[ChatId, _ChatState] = {}
+        self._ready: List[Tuple[int, int, ChatId]] = []
+        self._delayed: List[Tuple[float, int, ChatId]] = []
+        self._global_blocked_until = 0.0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    async def initialize(self):
+        """Подключает общий глобальный лимит в Redis"""
+        self.redis_client = redis.from_url(settings.redis_url, socket_timeout=1.0)
+        self._global_script = self.redis_client.register_script(GCRA_SCRIPT)
+        await self.redis_client.ping()
+
+    async def _shared_delay(self) -> float:
+        """Сколько ждать токена общего лимита (токен берется, если ждать не нужно)"""
+        if not self._shared_breaker.allow_request():
+            return 0.0
+
+        started = time.monotonic()
+        try:
+            allowed, retry_after_ms, _ = await self._global_script(
+                keys=[GLOBAL_LIMIT_KEY, f"{GLOBAL_LIMIT_KEY}:warned"],
+                # Допуск - секунда лимита, как у локального бакета
+                args=[self._global_emission_ms, self._global_emission_ms * int(settings.telegram_global_rate), 1000]
+            )
+        except Exception as e:
+            # Fail-open: без Redis остается локальный лимит процесса
+            logger.warning(f"Shared Telegram rate limit unavailable, using the local one: {e}")
+            self._shared_breaker.record(False, time.monotonic() - started)
+            return 0.0
+
+        self._shared_breaker.record(True, time.monotonic() - started)
+        return 0.0 if allowed else int(retry_after_ms) / 1000
+
+    def submit(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+        priority: Optional[int] = None
+    ) -> asyncio.Future:
+        """Ставит запрос в очередь, не дожидаясь отправки"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._run())
+
+        request = _Request(
+            priority=_send_priority.get() if priority is None else priority,
+            seq=next(self._seq),
+            make_request=make_request,
+            bot=bot,
+            method=method,
+            future=asyncio.get_running_loop().create_future()
+        )
+
+        chat_id = _queue_key(method)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatState(bucket=TokenBucket(self.chat_rate, self.chat_burst))
+
+        chat.queue.append(request)
+        if len(chat.queue) == 1 and not chat.busy and chat.blocked_until <= time.monotonic():
+            heapq.heappush(self._ready, (request.priority, request.seq, chat_id))
+            self._wakeup.set()
+
+        return request.future
+
+    def _promote_delayed(self, now: float):
+        """Возвращает в очередь чаты, для которых истекла задержка"""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy:
+                continue
+            if chat.queue:
+                head = chat.queue[0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+            else:
+                self._release_if_idle(chat_id, chat, now)
+
+    async def _sleep(self, delay: Optional[float]):
+        """Ждет delay секунд или новой заявки"""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        """Цикл выдачи запросов с учетом лимитов"""
+        while True:
+            now = time.monotonic()
+            self._promote_delayed(now)
+
+            if not self._ready:
+                await self._sleep(self._delayed[0][0] - now if self._delayed else None)
+                continue
+
+            # Глобальный лимит (и глобальный flood wait) задерживает всех
+            global_delay = max(self._global_blocked_until - now, self.global_bucket.delay(now))
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy or not chat.queue:
+                # Устаревшая запись: чат уже обслуживается или пуст
+                continue
+
+            chat_delay = max(chat.blocked_until - now, chat.bucket.delay(now))
+            if chat_delay > 0:
+                heapq.heappush(self._delayed, (now + chat_delay, next(self._seq), chat_id))
+                continue
+
+            if self._global_script is not None:
+                shared_delay = await self._shared_delay()
+                if shared_delay > 0:
+                    head = chat.queue[0]
+                    heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+                    await asyncio.sleep(shared_delay)
+                    continue
+
+            self.global_bucket.take()
+            chat.bucket.take()
+            chat.busy = True
+
+            task = asyncio.create_task(self._execute(chat_id, chat, chat.queue.popleft()))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, chat_id: ChatId, chat: _ChatState, request: _Request):
+        """Выполняет запрос и обрабатывает retry_after"""
+        try:
+            with stage_timer("telegram_send"):
+                result = await request.make_request(request.bot, request.method)
+        except TelegramRetryAfter as e:
+            request.attempts += 1
+            if request.attempts > self.max_retries:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                blocked_until = time.monotonic() + e.retry_after
+                if chat_id is None:
+                    self._global_blocked_until = blocked_until
+                chat.blocked_until = blocked_until
+                # Повтор идет первым в очереди чата, чтобы не нарушить порядок
+                chat.queue.appendleft(request)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            chat.busy = False
+            self._reschedule(chat_id, chat)
+
+    def _reschedule(self, chat_id: ChatId, chat: _ChatState):
+        """Планирует следующий запрос чата или удаляет пустое состояние"""
+        now = time.monotonic()
+        if chat.queue:
+            delay = max(chat.blocked_until - now, chat.bucket.delay(now))
+            if delay > 0:
+                heapq.heappush(self._delayed, (now + delay, next(self._seq), chat_id))
+            else:
+                head = chat.queue[0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+            self._wakeup.set()
+        else:
+            self._release_if_idle(chat_id, chat, now)
+
+    def _release_if_idle(self, chat_id: ChatId, chat: _ChatState, now: float):
+        """
+        Удаляет состояние чата без очереди, когда бакет восстановится
+
+        Такой чат ничем не отличается от нового, поэтому память планировщика
+        ограничена числом недавно активных чатов.
+        """
+        wait = max(chat.blocked_until - now, chat.bucket.time_to_full(now))
+        if wait > 0:
+            heapq.heappush(self._delayed, (now + wait, next(self._seq), chat_id))
+        else:
+            del self._chats[chat_id]
+
+    @property
+    def pending(self) -> int:
+        return sum(len(chat.queue) for chat in self._chats.values()) + len(self._in_flight)
+
+    async def close(self, timeout: float = 10.0):
+        """Дожидается отправки очереди и останавливает планировщик"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        if self.redis_client:
+            await self.redis_client.close()
+
+
+class OutboundSchedulerMiddleware(BaseRequestMiddleware):
+    """Направляет отправку и редактирование сообщений через планировщик"""
+
+    def __init__(self, scheduler: OutboundScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        name = type(method).__name__
+        with tracer.span(f"telegram.{name}"):
+            if name in UNSCHEDULED_METHODS or not name.startswith(SCHEDULED_METHOD_PREFIXES):
+                return await make_request(bot, method)
+            return await self.scheduler.submit(make_request, bot, method)
+
+
+def send_nowait(bot: Bot, method: TelegramMethod, priority: Optional[int] = None) -> asyncio.Task:
+    """
+    Отправляет запрос без ожидания результата
+
+    Ошибки отправки логируются. Порядок вызовов внутри чата сохраняется.
+    """
+    async def _send():
+        if priority is None:
+            return await bot(method)
+        with send_priority(priority):
+            return await bot(method)
+
+    task = asyncio.create_task(_send())
+    task.add_done_callback(_log_send_error)
+    lifecycle.track(task)
+    return task
+
+
+def _log_send_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Failed to send message: {task.exception()}")
+
+
+# Глобальный экземпляр (подключается к сессии бота в main.py)
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+from loguru import logger
+import redis.asyncio as redis
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..config import settings
+from ..database.database import UserPreference, get_session
+
+INVALIDATE_CHANNEL = "prefs:invalidate"
+
+CHAT_MODES = ("openrouter", "rag", "hybrid")
+
+# Заполнение кеша после чтения из БД: только если ключа еще нет, чтобы не
+# затереть значение, записанное update() другой реплики за время чтения
+FILL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'model', ARGV[1], 'chat_mode', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+@dataclass(frozen=True)
+class UserPreferences:
+    """Настройки пользователя"""
+    model: Optional[str] = None
+    chat_mode: str = "openrouter"
+
+
+DEFAULT_PREFERENCES = UserPreferences()
+
+
+class PreferencesService:
+    """
+    Настройки пользователей (модель и режим общения)
+
+    Хранятся в Postgres, горячая копия - в Redis hash, а на каждой реплике -
+    в локальном LRU кеше. Чтение в обычном случае не требует обращений к сети,
+    изменения рассылаются репликам через Redis pub/sub.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[int] = None):
+        self.redis_client: Optional[redis.Redis] = None
+        self.max_entries = max_entries or settings.preferences_cache_size
+        self.ttl = ttl or settings.preferences_cache_ttl
+        self._cache: "OrderedDict[int, Tuple[UserPreferences, float]]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+        self._fill_script = None
+
+    async def initialize(self):
+        """Инициализация Redis соединения и подписки на инвалидацию"""
+        try:
+            self.redis_client = redis.from_url(
+                settings.redis_url,
+                encoding="utf-8",
+                decode_responses=True
+            )
+            self._fill_script = self.redis_client.register_script(FILL_SCRIPT)
+            await self.redis_client.ping()
+            self._listener = asyncio.create_task(self._listen())
+            logger.info("PreferencesService initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize PreferencesService: {e}")
+            raise
+
+    def _get_key(self, user_id: int) -> str:
+        return f"prefs:{user_id}"
+
+    def _remember(self, user_id: int, preferences: UserPreferences):
+        self._cache[user_id] = (preferences, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: int) -> UserPreferences:
+        """Получает настройки пользователя"""
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        preferences = await self._load(user_id)
+        self._remember(user_id, preferences)
+        return preferences
+
+    async def _load(self, user_id: int) -> UserPreferences:
+        """Читает настройки из Redis, при промахе - из Postgres"""
+        if self.redis_client is None:
+            return DEFAULT_PREFERENCES
+
+        try:
+            data = await self.redis_client.hgetall(self._get_key(user_id))
+            if data:
+                return self._from_hash(data)
+
+            async for session in get_session():
+                result = await session.execute(
+                    select(UserPreference.model, UserPreference.chat_mode)
+                    .where(UserPreference.telegram_id == user_id)
+                )
+                row = result.one_or_none()
+
+            preferences = (
+                UserPreferences(model=row[0], chat_mode=row[1] or DEFAULT_PREFERENCES.chat_mode)
+                if row else DEFAULT_PREFERENCES
+            )
+            # Кешируем в Redis и значения по умолчанию, чтобы не ходить в БД повторно
+            filled = await self._fill_script(
+                keys=[self._get_key(user_id)],
+                args=[preferences.model or "", preferences.chat_mode, settings.preferences_redis_ttl]
+            )
+            if not filled:
+                # Пока читали БД, настройки изменили: актуально значение в Redis
+                data = await self.redis_client.hgetall(self._get_key(user_id))
+                if data:
+                    return self._from_hash(data)
+            return preferences
+
+        except Exception as e:
+            logger.error(f"Error loading preferences for user {user_id}: {e}")
+            return DEFAULT_PREFERENCES
+
+    @staticmethod
+    def _from_hash(data) -> UserPreferences:
+        return UserPreferences(
+            model=data.get("model") or None,
+            chat_mode=data.get("chat_mode") or DEFAULT_PREFERENCES.chat_mode
+        )
+
+    async def _store_redis(self, user_id: int, preferences: UserPreferences):
+        key = self._get_key(user_id)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"model": preferences.model or "", "chat_mode": preferences.chat_mode})
+            pipe.expire(key, settings.preferences_redis_ttl)
+            await pipe.execute()
+
+    async def update(
+        self,
+        user_id: int,
+        model: Optional[str] = None,
+        chat_mode: Optional[str] = None
+    ) -> UserPreferences:
+        """
+        Сохраняет настройки пользователя
+
+        :param user_id: ID пользователя
+        :param model: выбранная модель (None - не менять)
+        :param chat_mode: режим общения (None - не менять)
+        :return: обновленные настройки
+        """
+        if chat_mode is not None and chat_mode not in CHAT_MODES:
+            raise ValueError(f"Unknown chat mode: {chat_mode}")
+
+        current = await self.get(user_id)
+        preferences = replace(
+            current,
+            model=model if model is not None else current.model,
+            chat_mode=chat_mode if chat_mode is not None else current.chat_mode
+        )
+
+        async for session in get_session():
+            values = {"telegram_id": user_id, "model": preferences.model, "chat_mode": preferences.chat_mode}
+            await session.execute(
+                pg_insert(UserPreference)
+                .values(**values)
+                .on_conflict_do_update(
+                    index_elements=[UserPreference.telegram_id],
+                    set_={"model": preferences.model, "chat_mode": preferences.chat_mode}
+                )
+            )
+
+        self._remember(user_id, preferences)
+        await self._store_redis(user_id, preferences)
+        await self.redis_client.publish(INVALIDATE_CHANNEL, str(user_id))
+        logger.info(f"Updated preferences for user {user_id}: {preferences}")
+        return preferences
+
+    async def _listen(self):
+        """Сбрасывает локальный кеш по сообщениям от других реплик"""
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Пока подписки не было, могли пропустить инвалидации
+                self._cache.clear()
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._cache.pop(int(message["data"]), None)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Preferences invalidation listener failed, reconnecting: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    async def close(self):
+        """Останавливает подписку и закрывает соединение с Redis"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("PreferencesService connection closed")
+
+
+# Глобальный экземпляр (инициализируется в main.py)
+preferences_service = PreferencesService()
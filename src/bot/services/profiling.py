@@ -0,0 +1,51 @@
+import hmac
+from aiohttp import web
+from loguru import logger
+
+from monitoring.health import HealthServer
+from monitoring.profiler import Profiler, ProfilerBusy, task_snapshot
+
+from ..config import settings
+
+# Общий для команды /profile и HTTP маршрутов: одновременно идет одно профилирование
+profiler = Profiler(settings.profile_max_seconds)
+
+
+def _authorized(request: web.Request) -> bool:
+    expected = f"Bearer {settings.profile_token.get_secret_value()}"
+    return hmac.compare_digest(request.headers.get("Authorization", ""), expected)
+
+
+async def handle_profile(request: web.Request) -> web.Response:
+    """GET /debug/profile?seconds=10 - collapsed stacks цикла событий"""
+    if not _authorized(request):
+        return web.Response(status=401)
+    try:
+        seconds = float(request.query.get("seconds", settings.profile_default_seconds))
+    except ValueError:
+        return web.Response(status=400, text="seconds must be a number")
+
+    try:
+        result = await profiler.profile(seconds, settings.profile_interval)
+    except ProfilerBusy as e:
+        return web.Response(status=409, text=str(e))
+    except RuntimeError as e:
+        return web.Response(status=501, text=str(e))
+
+    logger.info(f"Profile taken via HTTP: {result.samples} samples in {result.duration:.1f}s")
+    return web.Response(text=result.collapsed)
+
+
+async def handle_tasks(request: web.Request) -> web.Response:
+    """GET /debug/tasks - задачи asyncio по месту ожидания"""
+    if not _authorized(request):
+        return web.Response(status=401)
+    return web.Response(text=task_snapshot())
+
+
+def register_debug_routes(server: HealthServer):
+    """Маршруты профилирования (только при заданном PROFILE_TOKEN)"""
+    if settings.profile_token is None:
+        return
+    server.add_route("GET", "/debug/profile", handle_profile)
+    server.add_route("GET", "/debug/tasks", handle_tasks)
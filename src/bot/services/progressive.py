@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import List, Optional
+from aiogram import Bot
+from aiogram.methods import EditMessageText, SendMessage
+from loguru import logger
+
+from ..config import settings
+from ..lifecycle import lifecycle
+from .outbound import send_nowait
+
+
+class ProgressiveReply:
+    """
+    Ответ, который показывается по мере получения
+
+    Первая часть отправляется сообщением, дальше оно правится не чаще
+    interval секунд; части, пришедшие между правками, только запоминаются,
+    поэтому поток ответа не ждет Telegram. Промежуточный текст отправляется
+    без разметки (теги могут быть еще не закрыты), окончательный - как обычно.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        interval: Optional[float] = None,
+        message_thread_id: Optional[int] = None
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        # Тема форума, в которой задан вопрос (как у message.answer)
+        self.message_thread_id = message_thread_id
+        self.interval = interval if interval is not None else settings.stream_edit_interval
+        self.message_id: Optional[int] = None
+        self._shown = ""
+        self._pending = ""
+        self._shown_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._sending = False
+
+    @property
+    def started(self) -> bool:
+        return self.message_id is not None
+
+    def update(self, text: str):
+        """Новый текст ответа целиком (показывается при следующей правке)"""
+        self._pending = text[:4096]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+            lifecycle.track(self._task)
+
+    async def _flush(self):
+        delay = self._shown_at + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        text = self._pending
+        if not text.strip() or text == self._shown:
+            return
+        self._sending = True
+        try:
+            if self.message_id is None:
+                message = await self.bot(SendMessage(
+                    chat_id=self.chat_id, text=text, parse_mode=None, message_thread_id=self.message_thread_id
+                ))
+                self.message_id = message.message_id
+            else:
+                await self.bot(EditMessageText(
+                    chat_id=self.chat_id, message_id=self.message_id, text=text, parse_mode=None
+                ))
+            self._shown = text
+        except Exception as e:
+            logger.debug("Failed to show partial reply in chat {}: {}", self.chat_id, e)
+        finally:
+            self._sending = False
+        self._shown_at = time.monotonic()
+
+    async def finish(self, text: str, wait: bool = False):
+        """
+        Показывает окончательный ответ
+
+        Длинный ответ разбивается на части: первая заменяет промежуточное
+        сообщение, остальные отправляются следом.
+
+        :param wait: дождаться отправки (иначе темп задает планировщик отправки)
+        """
+        if self._task is not None and not self._task.done():
+            if self._sending:
+                # Первое сообщение может быть в пути - без его id ответ задвоится
+                await asyncio.wait({self._task})
+            else:
+                # Правка еще ждет своей очереди (или задача даже не начиналась)
+                self._task.cancel()
+
+        parts = [text] if len(text) <= 4096 else [text[i:i + 4000] for i in range(0, len(text), 4000)]
+        tasks: List[asyncio.Task] = []
+        for index, part in enumerate(parts):
+            if index == 0 and self.message_id is not None:
+                # Тот же текст без разметки уже показан: Telegram ответил бы
+                # "message is not modified"
+                if part == self._shown and "<" not in part and "&" not in part:
+                    continue
+                tasks.append(send_nowait(
+                    self.bot, EditMessageText(chat_id=self.chat_id, message_id=self.message_id, text=part)
+                ))
+            else:
+                tasks.append(send_nowait(
+                    self.bot, SendMessage(chat_id=self.chat_id, text=part, message_thread_id=self.message_thread_id)
+                ))
+
+        if wait:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,198 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from loguru import logger
+import redis.asyncio as redis
+
+from ..config import settings
+
+# GCRA (generic cell rate algorithm): в Redis хранится одно число на пользователя -
+# теоретическое время прихода следующего запроса (TAT). Проверка и обновление
+# выполняются атомарно за один вызов скрипта, время берется с сервера Redis,
+# поэтому расхождение часов между репликами не влияет на лимит.
+GCRA_SCRIPT = """
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local warn_interval = tonumber(ARGV[3])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission
+local allow_at = new_tat - tolerance
+if allow_at > now then
+    local warn = redis.call('SET', KEYS[2], 1, 'PX', warn_interval, 'NX')
+    return {0, allow_at - now, warn and 1 or 0}
+end
+
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, 0, 0}
+"""
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Лимит: messages запросов за window секунд"""
+    messages: int
+    window: int
+
+    @property
+    def emission_ms(self) -> int:
+        return max(1, int(self.window * 1000 / self.messages))
+
+    @property
+    def tolerance_ms(self) -> int:
+        return self.emission_ms * self.messages
+
+
+@dataclass
+class RateLimitResult:
+    """Результат проверки лимита"""
+    allowed: bool
+    retry_after: float = 0.0
+    should_warn: bool = False
+
+
+class LocalTokenBucket:
+    """
+    Локальный token bucket перед Redis
+
+    Поглощает флуд без обращений к Redis. Каждая реплика видит только часть
+    запросов пользователя, поэтому фильтр никогда не строже общего лимита.
+    Хранит не более max_entries пользователей (LRU).
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def consume(self, key: str, limit: RateLimit, now: float) -> bool:
+        rate = limit.messages / limit.window
+        tokens, updated = self._buckets.pop(key, (float(limit.messages), now))
+        tokens = min(float(limit.messages), tokens + (now - updated) * rate)
+
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+
+        return allowed
+
+
+class RateLimiter:
+    """Распределенный rate limiter на Redis (GCRA), общий для всех реплик"""
+
+    def __init__(self, key_prefix: str = "ratelimit", warn_interval: int = 60):
+        self.redis_client: Optional[redis.Redis] = None
+        self.key_prefix = key_prefix
+        self.warn_interval_ms = warn_interval * 1000
+        self.default_limit = RateLimit(settings.rate_limit_messages, settings.rate_limit_window)
+        self.tier_limits: Dict[str, RateLimit] = {
+            name: RateLimit(messages, window)
+            for name, (messages, window) in settings.rate_limit_tiers.items()
+        }
+        self.user_tiers: Dict[int, str] = settings.rate_limit_user_tiers
+        self.local_filter = LocalTokenBucket() if settings.rate_limit_local_prefilter else None
+        # Когда предупреждать снова при отказе локального фильтра: ключ -> время (LRU)
+        self._warned: "OrderedDict[str, float]" = OrderedDict()
+        self.max_warned_entries = 10000
+        self._script = None
+
+    async def initialize(self):
+        """Инициализация Redis соединения и регистрация скрипта"""
+        try:
+            self.redis_client = redis.from_url(settings.redis_url)
+            self._script = self.redis_client.register_script(GCRA_SCRIPT)
+            await self.redis_client.ping()
+            logger.info("RateLimiter initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize RateLimiter: {e}")
+            raise
+
+    def get_limit(self, user_id: int) -> Optional[RateLimit]:
+        """Возвращает лимит для тарифа пользователя (None - без ограничений)"""
+        tier = self.user_tiers.get(user_id)
+        limit = self.tier_limits.get(tier, self.default_limit) if tier is not None else self.default_limit
+        return limit if limit.messages > 0 else None
+
+    def _should_warn_locally(self, key: str, now: float) -> bool:
+        """
+        Предупреждение при отказе локального фильтра
+
+        Не чаще раза в warn_interval на реплику; отметка общая с
+        предупреждениями по результату Redis (_remember_warning).
+        """
+        if self._warned.get(key, 0.0) > now:
+            return False
+        self._remember_warning(key, now)
+        return True
+
+    def _remember_warning(self, key: str, now: float):
+        self._warned[key] = now + self.warn_interval_ms / 1000
+        self._warned.move_to_end(key)
+        if len(self._warned) > self.max_warned_entries:
+            self._warned.popitem(last=False)
+
+    async def check(self, user_id: int, scope: str = "message") -> RateLimitResult:
+        """
+        Проверяет и учитывает запрос пользователя
+
+        :param user_id: ID пользователя
+        :param scope: пространство лимита (message/callback)
+        :return: результат проверки
+        """
+        limit = self.get_limit(user_id)
+        if limit is None:
+            return RateLimitResult(allowed=True)
+
+        key = f"{self.key_prefix}:{scope}:{user_id}"
+        now = time.monotonic()
+
+        if self.local_filter and not self.local_filter.consume(key, limit, now):
+            return RateLimitResult(
+                allowed=False,
+                retry_after=limit.emission_ms / 1000,
+                should_warn=self._should_warn_locally(key, now)
+            )
+
+        if self._script is None:
+            # Redis не настроен - работаем только на локальном фильтре
+            return RateLimitResult(allowed=True)
+
+        try:
+            allowed, retry_after_ms, warn = await self._script(
+                keys=[key, f"{key}:warned"],
+                args=[limit.emission_ms, limit.tolerance_ms, self.warn_interval_ms]
+            )
+        except Exception as e:
+            # Fail-open: недоступность Redis не должна блокировать бота
+            logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+            return RateLimitResult(allowed=True)
+
+        if warn:
+            # Следующие отказы локального фильтра не предупреждают повторно
+            self._remember_warning(key, now)
+        return RateLimitResult(
+            allowed=bool(allowed),
+            retry_after=int(retry_after_ms) / 1000,
+            should_warn=bool(warn)
+        )
+
+    async def close(self):
+        """Закрывает соединение с Redis"""
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("RateLimiter connection closed")
+
+
+# Глобальный экземпляр (инициализируется в main.py)
+rate_limiter = RateLimiter()
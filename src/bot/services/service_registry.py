@@ -0,0 +1,118 @@
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from ..config import settings
+
+
+@dataclass(frozen=True)
+class ServiceConfig:
+    """
+    Описание внешнего сервиса
+
+    У каждого сервиса свой пул соединений (limit, limit_per_host, keep-alive)
+    и свои таймауты. Идемпотентные запросы повторяются retries раз с
+    экспоненциальной задержкой от backoff. Тело запроса от compress_min_bytes
+    байт отправляется сжатым gzip (0 - не сжимать).
+    """
+    name: str
+    base_url: str
+    api_key: Optional[str]
+    timeout: float
+    connect_timeout: float
+    limit: int
+    limit_per_host: int
+    keepalive_timeout: float
+    retries: int
+    backoff: float
+    compress_min_bytes: int
+
+    def url(self, endpoint: str) -> str:
+        return f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
+
+
+def service_config(name: str, base_url: str, api_key: Optional[str] = None, **overrides: Any) -> ServiceConfig:
+    """Описание сервиса с параметрами по умолчанию из настроек"""
+    config = ServiceConfig(
+        name=name,
+        base_url=base_url,
+        api_key=api_key,
+        timeout=settings.external_services_timeout,
+        connect_timeout=settings.external_connect_timeout,
+        limit=settings.external_pool_limit,
+        limit_per_host=settings.external_pool_limit_per_host,
+        keepalive_timeout=settings.external_keepalive_timeout,
+        retries=settings.external_retries,
+        backoff=settings.external_retry_backoff,
+        compress_min_bytes=settings.external_compress_min_bytes,
+    )
+    return replace(config, **overrides) if overrides else config
+
+
+class ServiceRegistry:
+    """
+    Реестр внешних сервисов
+
+    Заполняется из настроек: RAG система (rag_service_url) и сервисы из
+    EXTERNAL_SERVICES. Параметры RAG можно переопределить в EXTERNAL_SERVICES
+    под именем rag_system.
+    """
+
+    def __init__(self):
+        self._services: Dict[str, ServiceConfig] = {}
+
+    def register(self, config: ServiceConfig) -> ServiceConfig:
+        self._services[config.name] = config
+        return config
+
+    def get(self, name: str) -> Optional[ServiceConfig]:
+        return self._services.get(name)
+
+    def resolve(self, service: str, api_key: Optional[str] = None) -> ServiceConfig:
+        """
+        Сервис по имени или базовому URL
+
+        Незарегистрированный URL регистрируется с параметрами по умолчанию
+        под именем хоста, чтобы запросы к нему шли через один пул.
+        """
+        config = self._services.get(service)
+        if config is not None:
+            return config
+
+        netloc = urlsplit(service).netloc
+        if not netloc:
+            raise KeyError(f"Unknown external service: {service}")
+        config = self._services.get(netloc)
+        if config is None or config.base_url != service or config.api_key != api_key:
+            config = self.register(service_config(netloc, service, api_key))
+        return config
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._services)
+
+    @classmethod
+    def from_settings(cls) -> "ServiceRegistry":
+        registry = cls()
+        overrides = dict(settings.external_services)
+
+        rag_overrides = dict(overrides.pop("rag_system", {}))
+        rag_url = rag_overrides.pop("base_url", settings.rag_service_url)
+        if rag_url:
+            api_key = settings.rag_service_api_key.get_secret_value() if settings.rag_service_api_key else None
+            registry.register(service_config(
+                "rag_system",
+                rag_url,
+                rag_overrides.pop("api_key", api_key),
+                **rag_overrides
+            ))
+
+        for name, params in overrides.items():
+            params = dict(params)
+            registry.register(service_config(name, params.pop("base_url"), params.pop("api_key", None), **params))
+
+        return registry
+
+
+# Глобальный реестр (используется в ExternalAPIService)
+service_registry = ServiceRegistry.from_settings()
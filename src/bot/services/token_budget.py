@@ -0,0 +1,227 @@
+import asyncio
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from loguru import logger
+import redis.asyncio as redis
+
+from ..config import settings
+
+# Проверка и резервирование сразу по дневному и месячному бюджету за один вызов.
+# Возвращает 1 - зарезервировано, 0 - бюджет исчерпан.
+RESERVE_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local daily = tonumber(ARGV[2])
+local monthly = tonumber(ARGV[3])
+
+local used_daily = tonumber(redis.call('GET', KEYS[1]) or '0')
+local used_monthly = tonumber(redis.call('GET', KEYS[2]) or '0')
+
+if (daily > 0 and used_daily + amount > daily) or (monthly > 0 and used_monthly + amount > monthly) then
+    return {0, used_daily, used_monthly}
+end
+
+redis.call('INCRBY', KEYS[1], amount)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('INCRBY', KEYS[2], amount)
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return {1, used_daily + amount, used_monthly + amount}
+"""
+
+DAY_TTL = 2 * 24 * 3600
+MONTH_TTL = 32 * 24 * 3600
+
+# Служебные токены на каждое сообщение в chat-формате
+TOKENS_PER_MESSAGE = 4
+
+
+class TokenBudgetExceeded(Exception):
+    """Исключение при исчерпании бюджета токенов пользователя"""
+    pass
+
+
+@dataclass
+class TokenReservation:
+    """Зарезервированные под запрос токены"""
+    user_id: int
+    amount: int
+    model: str
+    day_key: Optional[str] = None
+    month_key: Optional[str] = None
+    downgraded: bool = False
+    # Вес токена модели в бюджете (amount уже взвешен)
+    weight: float = 1.0
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """Грубая оценка числа токенов промпта без токенизатора"""
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return int(chars / settings.token_estimate_chars_per_token) + TOKENS_PER_MESSAGE * len(messages)
+
+
+class TokenBudgetLimiter:
+    """
+    Дневные и месячные бюджеты токенов LLM для пользователей
+
+    Перед запросом к OpenRouter резервируется оценка промпта плюс max_tokens
+    (один вызов Redis), после ответа резерв корректируется до фактического
+    usage.total_tokens в фоне, не задерживая ответ пользователю.
+
+    Сверх бюджета запросы обслуживает дешевая модель (если настроена): ее
+    токены с весом downgrade_weight списываются из отдельного бюджета того же
+    размера, исчерпав который пользователь получает отказ.
+    """
+
+    def __init__(self, key_prefix: str = "budget"):
+        self.redis_client: Optional[redis.Redis] = None
+        self.key_prefix = key_prefix
+        self.daily_budget = settings.token_budget_daily
+        self.monthly_budget = settings.token_budget_monthly
+        self.downgrade_model = settings.token_budget_downgrade_model
+        self.downgrade_weight = settings.token_budget_downgrade_weight
+        self._script = None
+        self._pending: set = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self._script is not None and (self.daily_budget > 0 or self.monthly_budget > 0)
+
+    async def initialize(self):
+        """Инициализация Redis соединения"""
+        try:
+            self.redis_client = redis.from_url(settings.redis_url)
+            self._script = self.redis_client.register_script(RESERVE_SCRIPT)
+            await self.redis_client.ping()
+            logger.info("TokenBudgetLimiter initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize TokenBudgetLimiter: {e}")
+            raise
+
+    def _keys(self, user_id: int, downgraded: bool = False):
+        now = datetime.now(timezone.utc)
+        # Бюджет дешевой модели ведется отдельно: :dd / :dm
+        prefix = "d" if downgraded else ""
+        return (
+            f"{self.key_prefix}:{user_id}:{prefix}d:{now:%Y%m%d}",
+            f"{self.key_prefix}:{user_id}:{prefix}m:{now:%Y%m}",
+        )
+
+    async def _reserve(self, user_id: int, amount: int, downgraded: bool):
+        """Резервирует amount в бюджете; None - бюджет исчерпан"""
+        day_key, month_key = self._keys(user_id, downgraded)
+        reserved, used_daily, used_monthly = await self._script(
+            keys=[day_key, month_key],
+            args=[amount, self.daily_budget, self.monthly_budget, DAY_TTL, MONTH_TTL]
+        )
+        if not reserved:
+            logger.warning(
+                f"Token budget{' of the downgrade model' if downgraded else ''} exceeded for user {user_id}: "
+                f"daily {used_daily}/{self.daily_budget}, monthly {used_monthly}/{self.monthly_budget}"
+            )
+            return None
+        return day_key, month_key
+
+    async def reserve(
+        self,
+        user_id: int,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        model: str
+    ) -> TokenReservation:
+        """
+        Резервирует токены под запрос
+
+        :param user_id: ID пользователя
+        :param messages: сообщения, которые будут отправлены в LLM
+        :param max_tokens: лимит генерируемых токенов
+        :param model: запрошенная модель
+        :return: резерв; при исчерпании бюджета - с понижением до дешевой модели
+        :raises TokenBudgetExceeded: бюджет исчерпан, а понижение не настроено
+            или бюджет дешевой модели тоже исчерпан
+        """
+        if not self.enabled:
+            return TokenReservation(user_id=user_id, amount=0, model=model)
+
+        tokens = estimate_prompt_tokens(messages) + max_tokens
+
+        try:
+            keys = await self._reserve(user_id, tokens, downgraded=False)
+            if keys is not None:
+                return TokenReservation(
+                    user_id=user_id, amount=tokens, model=model, day_key=keys[0], month_key=keys[1]
+                )
+
+            if not self.downgrade_model:
+                raise TokenBudgetExceeded(f"Token budget exceeded for user {user_id}")
+
+            # Запросы сверх бюджета обслуживаются дешевой моделью по ее цене
+            amount = math.ceil(tokens * self.downgrade_weight)
+            keys = await self._reserve(user_id, amount, downgraded=True)
+        except TokenBudgetExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Token budget check unavailable, allowing request: {e}")
+            return TokenReservation(user_id=user_id, amount=0, model=model)
+
+        if keys is None:
+            raise TokenBudgetExceeded(f"Token budget of the downgrade model exceeded for user {user_id}")
+        return TokenReservation(
+            user_id=user_id,
+            amount=amount,
+            model=self.downgrade_model,
+            day_key=keys[0],
+            month_key=keys[1],
+            downgraded=True,
+            weight=self.downgrade_weight
+        )
+
+    def settle(self, reservation: TokenReservation, usage: Optional[Dict[str, int]]) -> Optional[asyncio.Task]:
+        """
+        Корректирует резерв до фактического расхода (в фоне)
+
+        :param reservation: резерв, полученный из reserve()
+        :param usage: usage из ответа OpenRouter (None - запрос не выполнен)
+        :return: задача корректировки (None - корректировать нечего), ее можно
+            дождаться, если следующий резерв должен увидеть возврат
+        """
+        if not reservation.amount:
+            return None
+
+        if usage is None:
+            actual = 0
+        elif "total_tokens" in usage:
+            actual = math.ceil(usage["total_tokens"] * reservation.weight)
+        else:
+            # Провайдер не вернул usage - оставляем резерв как есть
+            return None
+
+        delta = actual - reservation.amount
+        if delta == 0:
+            return None
+
+        task = asyncio.create_task(self._apply_delta(reservation, delta))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def _apply_delta(self, reservation: TokenReservation, delta: int):
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.incrby(reservation.day_key, delta)
+                pipe.incrby(reservation.month_key, delta)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to settle token reservation for user {reservation.user_id}: {e}")
+
+    async def close(self):
+        """Дожидается корректировок и закрывает соединение с Redis"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("TokenBudgetLimiter connection closed")
+
+
+# Глобальный экземпляр (инициализируется в main.py)
+token_budget = TokenBudgetLimiter()
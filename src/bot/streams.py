@@ -0,0 +1,435 @@
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import time
+import zlib
+from typing import Any, Dict, Optional, Set
+from aiogram import Bot, Dispatcher
+from loguru import logger
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from .config import settings
+from .lifecycle import lifecycle
+from .webhook import run_webhook
+
+GROUP = "workers"
+
+# Отметка update_id и запись в stream выполняются атомарно: повторная доставка
+# того же обновления (ретрай webhook, повтор getUpdates) отбрасывается
+PUBLISH_SCRIPT = """
+if not redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[1]) then
+    return 0
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'update', ARGV[3])
+return 1
+"""
+
+# Аренду партиции продлевает и снимает только ее владелец
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """ID пользователя (или чата, если пользователя нет), от которого пришло обновление"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+def partition_for(update: Dict[str, Any], partitions: int) -> int:
+    """Партиция обновления: все обновления пользователя попадают в одну"""
+    return zlib.crc32(str(update_user_id(update)).encode()) % partitions
+
+
+def _stream_key(partition: int) -> str:
+    return f"{settings.update_stream_prefix}:{partition}"
+
+
+class UpdateStreamProducer:
+    """
+    Ingress: принимает обновления Telegram и кладет их в Redis Streams
+
+    Обновления раскладываются по партициям по хешу ID пользователя и
+    дедуплицируются по update_id.
+    """
+
+    def __init__(self):
+        self.redis_client: Optional[redis.Redis] = None
+        self.partitions = settings.update_stream_partitions
+        self._script = None
+
+    async def initialize(self):
+        """Инициализация Redis соединения"""
+        try:
+            self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+            self._script = self.redis_client.register_script(PUBLISH_SCRIPT)
+            await self.redis_client.ping()
+            logger.info("UpdateStreamProducer initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize UpdateStreamProducer: {e}")
+            raise
+
+    async def publish(self, update: Dict[str, Any]) -> bool:
+        """
+        Публикует обновление в партицию пользователя
+
+        :param update: обновление в формате Bot API
+        :return: False, если обновление уже было опубликовано
+        """
+        partition = partition_for(update, self.partitions)
+        added = await self._script(
+            keys=[f"{settings.update_stream_prefix}:seen:{update['update_id']}", _stream_key(partition)],
+            args=[settings.update_dedupe_ttl, settings.update_stream_maxlen, json.dumps(update, ensure_ascii=False)]
+        )
+        if not added:
+            logger.debug("Duplicate update {} skipped", update["update_id"])
+        return bool(added)
+
+    async def run_polling(self, bot: Bot, dp: Dispatcher):
+        """Получает обновления через getUpdates и публикует их"""
+        allowed_updates = dp.resolve_used_update_types()
+        timeout = settings.update_polling_timeout
+        offset = None
+        logger.info("Ingress polling started")
+
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=timeout,
+                    allowed_updates=allowed_updates,
+                    request_timeout=int(bot.session.timeout + timeout)
+                )
+                for update in updates:
+                    await self.publish(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+                    # Telegram считает обновления доставленными только при следующем
+                    # запросе с большим offset - до записи в Redis они не теряются
+                    offset = update.update_id + 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingress polling failed: {e}")
+                await asyncio.sleep(5)
+
+    async def close(self):
+        """Закрывает соединение с Redis"""
+        if self.redis_client:
+            await self.redis_client.close()
+            logger.info("UpdateStreamProducer connection closed")
+
+
+class UpdateStreamWorker:
+    """
+    Worker: обрабатывает обновления из партиций, которыми владеет
+
+    Партиция в каждый момент принадлежит одному worker (аренда в Redis),
+    поэтому обновления пользователя приходят в один процесс в порядке
+    поступления - как при обычном polling, и логика диспетчера не меняется.
+    Партиции делятся поровну между живыми worker. Остановившийся worker
+    отдает партиции, дождавшись их обновлений; у упавшего аренда истекает,
+    и новый владелец забирает неподтвержденные записи (XAUTOCLAIM).
+
+    Прежний владелец, потерявший аренду (например, из-за паузы процесса), мог
+    еще не закончить обработку. Поэтому перехватываются только записи,
+    неподтвержденные дольше update_processing_timeout (плюс срок аренды), а
+    обработка обновления этим временем ограничена: запись не обрабатывается
+    дважды одновременно. Брошенные записи перехватываются и позже, при каждом
+    продлении аренды.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, max_in_flight: Optional[int] = None):
+        self.bot = bot
+        self.dp = dp
+        self.partitions = settings.update_stream_partitions
+        self.lease_ms = settings.update_partition_lease * 1000
+        self.processing_timeout = settings.update_processing_timeout
+        # Запись, неподтвержденная дольше, брошена: ее обработка уже прервана по таймауту
+        self.claim_idle_ms = self.processing_timeout * 1000 + self.lease_ms
+        self.max_in_flight = max_in_flight or settings.update_worker_max_in_flight
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.redis_client: Optional[redis.Redis] = None
+        self._renew = None
+        self._release = None
+        self._owned: Set[int] = set()
+        # Отдаваемые партиции: не читаются, аренда держится до завершения их обновлений
+        self._releasing: Set[int] = set()
+        self._tasks: Dict[int, Set[asyncio.Task]] = {}
+        # Записи в обработке в этом процессе (XAUTOCLAIM возвращает и свои)
+        self._entries: Set[str] = set()
+        self._slot_free = asyncio.Event()
+        self._loops: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(len(tasks) for tasks in self._tasks.values())
+
+    def _lease_key(self, partition: int) -> str:
+        return f"{settings.update_stream_prefix}:lease:{partition}"
+
+    def _done_key(self, update_id: int) -> str:
+        return f"{settings.update_stream_prefix}:done:{update_id}"
+
+    async def initialize(self):
+        """Инициализация Redis соединения"""
+        try:
+            self.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+            self._renew = self.redis_client.register_script(RENEW_SCRIPT)
+            self._release = self.redis_client.register_script(RELEASE_SCRIPT)
+            await self.redis_client.ping()
+            logger.info(f"UpdateStreamWorker {self.consumer} initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize UpdateStreamWorker: {e}")
+            raise
+
+    def start(self):
+        """Запускает распределение партиций и чтение"""
+        self._loops = {
+            asyncio.create_task(self._rebalance_loop()),
+            asyncio.create_task(self._read_loop())
+        }
+
+    async def stop(self):
+        """Прекращает чтение новых записей (начатые обновления дожидается lifecycle)"""
+        for task in self._loops:
+            task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = set()
+
+    async def _rebalance_loop(self):
+        while True:
+            try:
+                await self._rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Partition rebalance failed: {e}")
+            await asyncio.sleep(self.lease_ms / 3000)
+
+    async def _rebalance(self):
+        """Продлевает аренды, отдает лишние партиции и забирает свободные"""
+        now_ms = int(time.time() * 1000)
+        workers_key = f"{settings.update_stream_prefix}:workers"
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(workers_key, {self.consumer: now_ms})
+            pipe.zremrangebyscore(workers_key, "-inf", now_ms - self.lease_ms)
+            pipe.zcard(workers_key)
+            _, _, workers = await pipe.execute()
+        quota = math.ceil(self.partitions / max(1, workers))
+
+        for partition in list(self._owned | self._releasing):
+            if not await self._renew(keys=[self._lease_key(partition)], args=[self.consumer, self.lease_ms]):
+                # Аренда истекла (например, из-за паузы процесса) - партиция уже у другого
+                logger.warning(f"Lost lease on partition {partition}")
+                self._owned.discard(partition)
+                self._releasing.discard(partition)
+
+        # Записи прежнего владельца, ставшие брошенными после перехода партиции
+        for partition in list(self._owned):
+            await self._reclaim(partition)
+
+        excess = len(self._owned) - quota
+        if excess > 0:
+            for partition in sorted(self._owned)[-excess:]:
+                self._owned.discard(partition)
+                self._releasing.add(partition)
+
+        for partition in list(self._releasing):
+            if not self._tasks.get(partition):
+                await self._release(keys=[self._lease_key(partition)], args=[self.consumer])
+                self._releasing.discard(partition)
+                logger.info(f"Released partition {partition}")
+
+        # Случайное начало обхода снижает конкуренцию за одни и те же партиции
+        start = random.randrange(self.partitions)
+        for offset in range(self.partitions):
+            if len(self._owned) + len(self._releasing) >= quota:
+                break
+            partition = (start + offset) % self.partitions
+            if partition in self._owned or partition in self._releasing:
+                continue
+            if await self.redis_client.set(self._lease_key(partition), self.consumer, nx=True, px=self.lease_ms):
+                await self._take(partition)
+
+    async def _take(self, partition: int):
+        """Начинает обслуживать партицию: сначала записи, брошенные прошлым владельцем"""
+        stream = _stream_key(partition)
+        try:
+            await self.redis_client.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        reclaimed = await self._reclaim(partition)
+        self._owned.add(partition)
+        logger.info(f"Took partition {partition}" + (f", reclaimed {reclaimed} entries" if reclaimed else ""))
+
+    async def _reclaim(self, partition: int) -> int:
+        """
+        Забирает записи партиции, неподтвержденные дольше claim_idle_ms
+
+        Записи моложе могут еще обрабатываться прежним владельцем; если он
+        упал, они будут перехвачены при одном из следующих вызовов.
+        """
+        stream = _stream_key(partition)
+        reclaimed = 0
+        start_id = "0-0"
+        while True:
+            result = await self.redis_client.xautoclaim(
+                stream, GROUP, self.consumer, min_idle_time=self.claim_idle_ms, start_id=start_id, count=100
+            )
+            start_id, entries = result[0], result[1]
+            for entry_id, fields in entries:
+                if fields and entry_id not in self._entries:
+                    self._dispatch(partition, entry_id, fields, reclaimed=True)
+                    reclaimed += 1
+            if start_id == "0-0":
+                break
+        return reclaimed
+
+    async def _read_loop(self):
+        while True:
+            try:
+                if not self._owned:
+                    await asyncio.sleep(0.5)
+                    continue
+
+                while self.in_flight >= self.max_in_flight:
+                    self._slot_free.clear()
+                    await self._slot_free.wait()
+
+                result = await self.redis_client.xreadgroup(
+                    GROUP,
+                    self.consumer,
+                    {_stream_key(partition): ">" for partition in sorted(self._owned)},
+                    count=self.max_in_flight - self.in_flight,
+                    block=1000
+                )
+                for stream, entries in result or []:
+                    partition = int(stream.rsplit(":", 1)[1])
+                    if partition not in self._owned and partition not in self._releasing:
+                        # Аренда потеряна во время чтения - записи заберет новый владелец
+                        continue
+                    for entry_id, fields in entries:
+                        self._dispatch(partition, entry_id, fields)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to read update streams: {e}")
+                await asyncio.sleep(1)
+
+    def _dispatch(self, partition: int, entry_id: str, fields: Dict[str, str], reclaimed: bool = False):
+        """Запускает обработку записи, как polling запускает обработку обновления"""
+        task = asyncio.create_task(self._process(partition, entry_id, json.loads(fields["update"]), reclaimed))
+        tasks = self._tasks.setdefault(partition, set())
+        tasks.add(task)
+        self._entries.add(entry_id)
+        task.add_done_callback(lambda t: self._on_done(partition, entry_id, t))
+        lifecycle.track(task)
+
+    def _on_done(self, partition: int, entry_id: str, task: asyncio.Task):
+        self._entries.discard(entry_id)
+        tasks = self._tasks.get(partition)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[partition]
+        self._slot_free.set()
+
+    async def _process(self, partition: int, entry_id: str, update: Dict[str, Any], reclaimed: bool):
+        stream = _stream_key(partition)
+        done_key = self._done_key(update["update_id"])
+
+        # Прежний владелец мог обработать запись, но не успеть ее подтвердить
+        if reclaimed and await self.redis_client.exists(done_key):
+            await self.redis_client.xack(stream, GROUP, entry_id)
+            return
+
+        try:
+            # После таймаута запись может перехватить другой worker (claim_idle_ms)
+            await asyncio.wait_for(self.dp.feed_raw_update(self.bot, update), timeout=self.processing_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Update {update.get('update_id')} timed out after {self.processing_timeout}s")
+        except Exception as e:
+            logger.error(f"Failed to process update {update.get('update_id')}: {e}")
+
+        # Отмененная обработка (остановка по таймауту) не подтверждается
+        # и достанется следующему владельцу партиции
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xack(stream, GROUP, entry_id)
+                pipe.set(done_key, 1, ex=settings.update_dedupe_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to acknowledge update {update.get('update_id')}: {e}")
+
+    async def close(self):
+        """Отдает партиции и закрывает соединение с Redis"""
+        if self.redis_client is None:
+            return
+        try:
+            for partition in self._owned | self._releasing:
+                await self._release(keys=[self._lease_key(partition)], args=[self.consumer])
+            await self.redis_client.zrem(f"{settings.update_stream_prefix}:workers", self.consumer)
+        except Exception as e:
+            logger.warning(f"Failed to release partitions: {e}")
+        await self.redis_client.close()
+        logger.info("UpdateStreamWorker connection closed")
+
+
+async def run_ingress(bot: Bot, dp: Dispatcher):
+    """Запуск ingress: прием обновлений (polling или webhook) и публикация в Redis Streams"""
+    producer = UpdateStreamProducer()
+    await producer.initialize()
+    lifecycle.on_shutdown("update producer", producer.close)
+
+    if settings.bot_mode == "webhook":
+        await run_webhook(bot, dp, producer=producer)
+        return
+
+    stop_event = lifecycle.install_signal_handlers()
+    poller = asyncio.create_task(producer.run_polling(bot, dp))
+    try:
+        await stop_event.wait()
+    finally:
+        # Неопубликованные обновления Telegram отдаст повторно: offset не сдвинут
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+
+
+async def run_worker(bot: Bot, dp: Dispatcher):
+    """Запуск worker: обработка обновлений из Redis Streams"""
+    worker = UpdateStreamWorker(bot, dp)
+    await worker.initialize()
+    lifecycle.on_shutdown("update worker", worker.close)
+
+    stop_event = lifecycle.install_signal_handlers()
+    await dp.emit_startup(bot=bot)
+    worker.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await worker.stop()
+        await dp.emit_shutdown(bot=bot)
@@ -0,0 +1,254 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+from aiogram import Bot
+from aiogram.types import Message, User
+from celery.signals import worker_process_init, worker_process_shutdown
+from loguru import logger
+import redis.asyncio as redis
+
+from monitoring.metrics import generation_jobs_total, generation_queue_seconds, generation_duration_seconds
+from monitoring.tracing import tracer
+
+from .celery_app import celery_app, GENERATION_QUEUES
+from .config import settings
+from .lifecycle import lifecycle
+from .services import llm as llm_module
+from .services.preferences import preferences_service
+from .services.progressive import ProgressiveReply
+
+# Порядок ходов пользователя: ведущий хода выдает номер из SEQUENCE_KEY_PREFIX,
+# worker отмечает выполненный в TURN_KEY_PREFIX. Ход начинается, только когда
+# выполнен предыдущий, или по истечении generation_order_timeout
+SEQUENCE_KEY_PREFIX = "generation:seq"
+TURN_KEY_PREFIX = "generation:turn"
+SEQUENCE_TTL = 86400
+# Через сколько секунд задача проверяет очередь хода снова
+ORDER_RETRY_DELAY = 1.0
+
+# Отмечает ход выполненным, не откатывая отметку более позднего хода
+# (после истечения ожидания ходы могут завершаться не по порядку)
+MARK_TURN_SCRIPT = """
+local done = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > done then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return 1
+"""
+
+# Цикл событий процесса worker работает в отдельном потоке постоянно, а не
+# только внутри задачи: подписки pub/sub, планировщик отправки, фоновые
+# корректировки бюджетов и экспорт трасс не замирают между задачами.
+# Создаются после fork в worker_process_init
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_bot: Optional[Bot] = None
+# Redis для очереди ходов (в процессе бота и в worker - свой)
+_redis: Optional[redis.Redis] = None
+
+
+def _order_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.redis_url)
+        lifecycle.on_shutdown("generation order", _redis.aclose)
+    return _redis
+
+
+async def _turn_ready(user_id: int, sequence: int, enqueued_at: float) -> bool:
+    """Выполнен ли предыдущий ход пользователя (или ждать его больше не нужно)"""
+    if time.time() - enqueued_at >= settings.generation_order_timeout:
+        logger.warning(f"Turn {sequence} of user {user_id} stopped waiting for the previous one")
+        return True
+    try:
+        done = await _order_redis().get(f"{TURN_KEY_PREFIX}:{user_id}")
+    except Exception as e:
+        # Без Redis порядок не проверить - выполняем ход сразу
+        logger.error(f"Failed to check turn order of user {user_id}: {e}")
+        return True
+    return int(done or 0) >= sequence - 1
+
+
+async def _mark_turn(user_id: int, sequence: int):
+    try:
+        await _order_redis().eval(
+            MARK_TURN_SCRIPT, 1, f"{TURN_KEY_PREFIX}:{user_id}", sequence, SEQUENCE_TTL
+        )
+    except Exception as e:
+        logger.error(f"Failed to mark turn {sequence} of user {user_id} as done: {e}")
+
+
+def _run(coro):
+    """Выполняет корутину в цикле событий процесса и ждет результата"""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+async def _start_worker_process() -> Bot:
+    """Инициализирует те же сервисы, что и процесс бота"""
+    from .main import create_bot, init_services
+    from .services.outbound import outbound_scheduler
+    from .utils.tracing import setup_tracing
+
+    setup_tracing()
+    await init_services()
+    bot = await create_bot()
+    lifecycle.on_shutdown("bot session", bot.session.close)
+    lifecycle.on_shutdown("outbound scheduler", outbound_scheduler.close)
+    return bot
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    global _loop, _bot
+    from .utils.logging import setup_logging
+
+    global _loop_thread
+    setup_logging()
+    _loop = asyncio.new_event_loop()
+    _loop_thread = threading.Thread(target=_loop.run_forever, name="event-loop", daemon=True)
+    _loop_thread.start()
+    _bot = _run(_start_worker_process())
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    if _loop is not None:
+        _run(lifecycle.shutdown())
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop_thread.join()
+        _loop.close()
+
+
+async def _generate_reply(
+    chat_id: int, user: Dict[str, Any], text: str, chat_mode: str, message_thread_id: Optional[int] = None
+) -> Dict[str, Any]:
+    telegram_user = User.model_validate(user)
+    reply = ProgressiveReply(_bot, chat_id, message_thread_id=message_thread_id)
+    try:
+        result = await llm_module.llm_service.generate_response(
+            user_id=telegram_user.id,
+            user_message=text,
+            telegram_user=telegram_user,
+            chat_mode=chat_mode,
+            on_partial=reply.update
+        )
+
+        if not result["success"]:
+            logger.error(f"Failed to generate response: {result.get('error')}")
+            await reply.finish(
+                result.get("response") or "Извините, произошла ошибка при обработке вашего сообщения.",
+                wait=True
+            )
+            return {"success": False, "error": result.get("error")}
+
+        # Задача завершается после отправки: ведущий хода ждет именно ее
+        await reply.finish(result["response"], wait=True)
+        return {"success": True, "model": result.get("model"), "usage": result.get("usage", {})}
+
+    except Exception as e:
+        # Не повторяем: генерация могла быть уже оплачена
+        logger.error(f"Error processing message from user {telegram_user.id}: {e}")
+        await _bot.send_message(
+            chat_id,
+            "❌ Произошла ошибка при обработке вашего сообщения. "
+            "Попробуйте еще раз или обратитесь к администратору.",
+            message_thread_id=message_thread_id
+        )
+        return {"success": False, "error": str(e)}
+
+
+async def _traced_reply(
+    chat_id: int,
+    user: Dict[str, Any],
+    text: str,
+    chat_mode: str,
+    sequence: Optional[int],
+    traceparent: Optional[str],
+    message_thread_id: Optional[int]
+) -> Dict[str, Any]:
+    """Продолжает трассу обновления, поставившего задачу, и отмечает ход выполненным"""
+    try:
+        with tracer.start_trace("generate_reply", traceparent=traceparent, chat_mode=chat_mode):
+            return await _generate_reply(chat_id, user, text, chat_mode, message_thread_id)
+    finally:
+        if sequence is not None:
+            await _mark_turn(user["id"], sequence)
+        # Трасса завершается отложенно (call_soon) - даем ей завершиться и
+        # выгружаем сразу, не дожидаясь пакетного экспорта
+        await asyncio.sleep(0)
+        await tracer.flush()
+
+
+@celery_app.task(name="bot.generate_reply", bind=True, max_retries=None)
+def generate_reply(
+    self,
+    chat_id: int,
+    user: Dict[str, Any],
+    text: str,
+    chat_mode: str,
+    enqueued_at: float,
+    traceparent: Optional[str] = None,
+    message_thread_id: Optional[int] = None,
+    sequence: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Генерирует ответ пользователю и отправляет его через Bot API
+
+    Пока предыдущий ход пользователя не выполнен, задача не занимает worker,
+    а возвращается в очередь с задержкой ORDER_RETRY_DELAY.
+    """
+    if sequence is not None and not _run(_turn_ready(user["id"], sequence, enqueued_at)):
+        raise self.retry(countdown=ORDER_RETRY_DELAY)
+
+    queue = GENERATION_QUEUES.get(chat_mode, GENERATION_QUEUES["openrouter"])
+    generation_queue_seconds.labels(queue).observe(max(0.0, time.time() - enqueued_at))
+
+    started = time.monotonic()
+    try:
+        result = _run(_traced_reply(
+            chat_id, user, text, chat_mode, sequence, traceparent, message_thread_id
+        ))
+    except Exception:
+        generation_jobs_total.labels(queue, "error").inc()
+        raise
+    finally:
+        generation_duration_seconds.labels(queue).observe(time.monotonic() - started)
+
+    generation_jobs_total.labels(queue, "success" if result["success"] else "failed").inc()
+    return result
+
+
+async def enqueue_generation(message: Message, text: str):
+    """
+    Ставит генерацию ответа в очередь Celery
+
+    Обработчик не ждет генерации. Ходы пользователя получают номера по
+    порядку, и worker начинает ход только после предыдущего: ходы одного
+    пользователя не идут параллельно на разных worker.
+
+    :param message: последнее сообщение хода (чат и автор)
+    :param text: текст хода
+    """
+    user_id = message.from_user.id
+    preferences = await preferences_service.get(user_id)
+    sequence_key = f"{SEQUENCE_KEY_PREFIX}:{user_id}"
+    async with _order_redis().pipeline(transaction=True) as pipe:
+        pipe.incr(sequence_key)
+        pipe.expire(sequence_key, SEQUENCE_TTL)
+        sequence, _ = await pipe.execute()
+
+    # Публикация в брокер синхронная - выполняем ее вне цикла событий
+    await asyncio.to_thread(
+        generate_reply.apply_async,
+        kwargs={
+            "chat_id": message.chat.id,
+            "user": message.from_user.model_dump(mode="json", exclude_none=True),
+            "text": text,
+            "chat_mode": preferences.chat_mode,
+            "enqueued_at": time.time(),
+            "traceparent": tracer.traceparent(),
+            "message_thread_id": message.message_thread_id if message.is_topic_message else None,
+            "sequence": sequence,
+        }
+    )
@@ -0,0 +1,48 @@
+import random
+import sys
+from typing import Dict
+from loguru import logger
+
+from ..config import settings
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<magenta>{extra[request_id]}</magenta> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+
+def setup_logging():
+    """
+    Настройка логирования
+
+    Запись в stdout выполняется фоновым потоком (enqueue=True), поэтому
+    медленный stdout не блокирует event loop. При LOG_JSON=true каждая
+    запись сериализуется в JSON вместе с request_id.
+    """
+    logger.remove()
+    logger.configure(extra={"request_id": "-"})
+    logger.add(
+        sys.stdout,
+        format="{message}" if settings.log_json else TEXT_FORMAT,
+        serialize=settings.log_json,
+        level=settings.log_level,
+        enqueue=True,
+        backtrace=False,
+        diagnose=settings.debug
+    )
+
+
+class LogSampler:
+    """Сэмплирование высокочастотных событий с настраиваемой долей"""
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+
+    def should_log(self, event: str) -> bool:
+        rate = self.rates.get(event, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+# Глобальный сэмплер (доли из LOG_SAMPLE_RATES)
+log_sampler = LogSampler(settings.log_sample_rates)
@@ -0,0 +1,21 @@
+from loguru import logger
+
+from monitoring.tracing import JsonlExporter, OtlpExporter, tracer
+
+from ..config import settings
+from ..lifecycle import lifecycle
+
+
+def setup_tracing():
+    """Подключает экспорт трасс по настройкам (TRACING_EXPORTER пустой - выключено)"""
+    if not settings.tracing_exporter:
+        return
+
+    if settings.tracing_exporter == "otlp":
+        exporter = OtlpExporter(settings.tracing_otlp_endpoint, settings.tracing_service_name)
+    else:
+        exporter = JsonlExporter(settings.tracing_jsonl_path)
+
+    tracer.configure(exporter, settings.tracing_sample_rate, settings.tracing_slow_threshold)
+    lifecycle.on_shutdown("tracer", tracer.close)
+    logger.info(f"Tracing enabled ({settings.tracing_exporter}, sample rate {settings.tracing_sample_rate})")
@@ -0,0 +1,144 @@
+import asyncio
+import secrets
+from typing import Any, Dict, Optional, Set
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from loguru import logger
+
+from .config import settings
+from .lifecycle import lifecycle
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram через webhook на aiohttp
+
+    Telegram получает ответ сразу после проверки секрета, обновление
+    обрабатывается в фоне. Число одновременно обрабатываемых обновлений
+    ограничено: при переполнении отвечаем 503 и Telegram повторит доставку позже.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        max_in_flight: Optional[int] = None,
+        producer: Optional[Any] = None
+    ):
+        self.bot = bot
+        self.dp = dp
+        # Ingress: обновления публикуются в Redis Streams вместо обработки на месте
+        self.producer = producer
+        self.secret_token = settings.telegram_webhook_secret
+        self.max_in_flight = max_in_flight or settings.webhook_max_in_flight
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(settings.webhook_path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Принимает обновление от Telegram"""
+        # compare_digest принимает str только из ASCII - сравниваем байты
+        received = request.headers.get(SECRET_HEADER, "").encode("utf-8", "surrogateescape")
+        if not secrets.compare_digest(received, self.secret_token.encode("utf-8")):
+            logger.warning(f"Rejected webhook request with invalid secret from {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            update = None
+        if not isinstance(update, dict):
+            logger.warning(f"Rejected malformed webhook body from {request.remote}")
+            return web.Response(status=400)
+
+        if self.producer is not None:
+            return await self._publish(update)
+
+        if self.in_flight >= self.max_in_flight:
+            logger.warning(f"Webhook in-flight limit reached ({self.max_in_flight}), asking Telegram to retry")
+            return web.Response(status=503)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        lifecycle.track(task)
+
+        return web.Response()
+
+    async def _publish(self, update: Dict[str, Any]) -> web.Response:
+        """Публикует обновление; при недоступности Redis Telegram повторит доставку"""
+        try:
+            await self.producer.publish(update)
+        except Exception as e:
+            logger.error(f"Failed to publish update {update.get('update_id')}: {e}")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Failed to process update {update.get('update_id')}: {e}")
+
+    async def start(self):
+        """Запускает HTTP сервер и регистрирует webhook в Telegram"""
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        # reuse_port позволяет запускать несколько воркеров на одном порту за nginx
+        site = web.TCPSite(
+            self._runner,
+            host=settings.webhook_host,
+            port=settings.webhook_port,
+            reuse_port=True
+        )
+        await site.start()
+
+        await self.dp.emit_startup(bot=self.bot)
+
+        # Повторная регистрация с теми же параметрами идемпотентна, поэтому
+        # каждая реплика может вызывать ее при старте
+        await self.bot.set_webhook(
+            url=settings.telegram_webhook_url,
+            secret_token=self.secret_token,
+            allowed_updates=self.dp.resolve_used_update_types(),
+            max_connections=min(100, self.max_in_flight)
+        )
+        logger.info(
+            f"Webhook server listening on {settings.webhook_host}:{settings.webhook_port}"
+            f"{settings.webhook_path}"
+        )
+
+    async def stop(self):
+        """
+        Останавливает прием обновлений
+
+        Принятые обновления дожидается LifecycleManager: новые запросы получат
+        отказ в соединении, и Telegram доставит их другой реплике.
+        """
+        if self._runner:
+            await self._runner.cleanup()
+        await self.dp.emit_shutdown(bot=self.bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, producer: Optional[Any] = None):
+    """Запуск бота в режиме webhook"""
+    if not settings.telegram_webhook_url:
+        raise RuntimeError("TELEGRAM_WEBHOOK_URL is required for webhook mode")
+
+    stop_event = lifecycle.install_signal_handlers()
+    server = WebhookServer(bot, dp, producer=producer)
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
@@ -1,32 +1,164 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+import asyncio
 import time
-import psutil
-import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from loguru import logger
+
+from .watchdog import LoopWatchdog
 
-app = FastAPI()
 start_time = time.time()
 
-@app.get("/health")
-async def health_check():
-    """Проверка здоровья приложения"""
-    checks = {
-        "status": "healthy",
-        "timestamp": time.time(),
-        "uptime": time.time() - start_time,
-        "version": "1.0.0"
-    }
-    
-    return JSONResponse(content=checks, status_code=200)
-
-@app.get("/metrics")
-async def metrics():
-    """Простые метрики"""
-    process = psutil.Process(os.getpid())
-    memory_info = process.memory_info()
-    
-    return {
-        "bot_uptime_seconds": time.time() - start_time,
-        "bot_memory_usage_bytes": memory_info.rss,
-        "bot_cpu_percent": process.cpu_percent(),
-    }
\ No newline at end of file
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+@dataclass
+class ProbeResult:
+    ok: bool
+    latency: float
+    checked_at: float
+    error: Optional[str] = None
+
+
+@dataclass
+class _Probe:
+    name: str
+    check: Callable[[], Awaitable[Any]]
+    critical: bool
+    result: Optional[ProbeResult] = None
+
+
+class HealthServer:
+    """
+    Сервер состояния процесса: /health, /ready и /metrics
+
+    Зависимости проверяются фоновыми пробами раз в probe_interval секунд,
+    запросы оркестратора читают последний результат и не нагружают
+    зависимости. /health (liveness) - цикл событий отвечает и задержка его
+    планирования меньше max_loop_lag. /ready (readiness) - процесс не
+    останавливается и все критичные пробы успешны и не устарели;
+    некритичные пробы только отображаются.
+    """
+
+    def __init__(
+        self,
+        probe_interval: float,
+        probe_timeout: float,
+        max_loop_lag: float,
+        draining: Optional[Callable[[], bool]] = None,
+        watchdog: Optional[LoopWatchdog] = None
+    ):
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.max_loop_lag = max_loop_lag
+        self.draining = draining or (lambda: False)
+        self.watchdog = watchdog or LoopWatchdog(max_loop_lag)
+        self._probes: List[_Probe] = []
+        self._routes: List[Tuple[str, str, Handler]] = []
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_route(self, method: str, path: str, handler: Handler):
+        """Дополнительный маршрут (добавляется до start)"""
+        self._routes.append((method, path, handler))
+
+    def add_probe(self, name: str, check: Callable[[], Awaitable[Any]], critical: bool = True):
+        """Добавляет пробу: check завершается без исключения, если зависимость доступна"""
+        self._probes.append(_Probe(name, check, critical))
+
+    async def _run_probe(self, probe: _Probe):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(probe.check(), self.probe_timeout)
+        except Exception as e:
+            probe.result = ProbeResult(False, time.monotonic() - started, time.time(), str(e) or type(e).__name__)
+            logger.warning(f"Health probe {probe.name} failed: {probe.result.error}")
+        else:
+            probe.result = ProbeResult(True, time.monotonic() - started, time.time())
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.gather(*(self._run_probe(probe) for probe in self._probes))
+            await asyncio.sleep(self.probe_interval)
+
+    @property
+    def loop_lag(self) -> float:
+        """Последняя задержка планирования цикла событий"""
+        return self.watchdog.lag
+
+    def _probe_status(self, probe: _Probe, now: float) -> Dict[str, Any]:
+        result = probe.result
+        if result is None:
+            return {"ok": False, "critical": probe.critical, "error": "not checked yet"}
+        # Зависшая проверка не должна оставлять старый успешный результат
+        stale = now - result.checked_at > self.probe_interval * 3 + self.probe_timeout
+        status = {
+            "ok": result.ok and not stale,
+            "critical": probe.critical,
+            "latency": round(result.latency, 4),
+            "age": round(now - result.checked_at, 1),
+        }
+        if result.error:
+            status["error"] = result.error
+        elif stale:
+            status["error"] = "stale"
+        return status
+
+    async def _health(self, request: web.Request) -> web.Response:
+        alive = self.loop_lag < self.max_loop_lag
+        return web.json_response(
+            {
+                "status": "healthy" if alive else "unhealthy",
+                "timestamp": time.time(),
+                "uptime": time.time() - start_time,
+                "loop_lag": round(self.loop_lag, 4),
+            },
+            status=200 if alive else 503
+        )
+
+    async def _ready(self, request: web.Request) -> web.Response:
+        now = time.time()
+        probes = {probe.name: self._probe_status(probe, now) for probe in self._probes}
+        draining = self.draining()
+        ready = not draining and all(status["ok"] for status in probes.values() if status["critical"])
+        degraded = any(not status["ok"] for status in probes.values())
+        return web.json_response(
+            {
+                "status": "draining" if draining else ("ready" if ready else "not_ready"),
+                "degraded": degraded,
+                "loop_lag": round(self.loop_lag, 4),
+                "probes": probes,
+            },
+            status=200 if ready else 503
+        )
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        response = web.Response(body=generate_latest())
+        response.headers["Content-Type"] = CONTENT_TYPE_LATEST
+        return response
+
+    async def start(self, host: str, port: int):
+        app = web.Application()
+        app.router.add_get("/health", self._health)
+        app.router.add_get("/ready", self._ready)
+        app.router.add_get("/metrics", self._metrics)
+        for method, path, handler in self._routes:
+            app.router.add_route(method, path, handler)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._tasks = [asyncio.create_task(self._probe_loop())]
+        self.watchdog.start()
+        logger.info(f"Health and metrics server started on port {port}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.watchdog.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,13 +1,126 @@
-from prometheus_client import Counter, Histogram, Gauge, start_http_server
-from loguru import logger
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Tuple, TypeVar
+from prometheus_client import Counter, Histogram, Gauge
 
-# Метрики бота
-messages_total = Counter('bot_messages_total', 'Total messages processed', ['user_id', 'message_type'])
-api_request_duration = Histogram('bot_api_request_duration_seconds', 'API request duration', ['provider', 'model'])
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# Метрики бота. Метки только с ограниченным набором значений: тип обновления,
+# этап, модель из списка доступных - не пользователь и не текст
+messages_total = Counter('bot_messages_total', 'Total updates processed', ['message_type'])
+api_request_duration = Histogram(
+    'bot_api_request_duration_seconds', 'API request duration', ['provider', 'model'],
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
 active_users = Gauge('bot_active_users', 'Number of active users')
 errors_total = Counter('bot_errors_total', 'Total errors', ['error_type'])
 
-async def start_metrics_server(port: int = 8000):
-    """Запустить сервер метрик"""
-    start_http_server(port)
-    logger.info(f"Metrics server started on port {port}")
\ No newline at end of file
+# Этапы обработки хода: middleware, user_lookup, context_read, context_write,
+# rag, llm_ttft, llm, db_persist, telegram_send
+stage_seconds = Histogram(
+    'bot_stage_seconds', 'Duration of a processing stage', ['stage'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+stage_in_flight = Gauge('bot_stage_in_flight', 'Stages being executed', ['stage'])
+update_seconds = Histogram(
+    'bot_update_seconds', 'Update handling time', ['message_type'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+updates_in_flight = Gauge('bot_updates_in_flight', 'Updates being handled', ['message_type'])
+# Ошибки провайдеров LLM: статус - HTTP код, timeout, connection или api_error
+upstream_errors_total = Counter('bot_upstream_errors_total', 'LLM provider errors', ['provider', 'model', 'status'])
+
+# Генерация в пуле Celery (метки - очередь и итог задачи)
+generation_jobs_total = Counter('bot_generation_jobs_total', 'Generation jobs by result', ['queue', 'status'])
+generation_queue_seconds = Histogram(
+    'bot_generation_queue_seconds', 'Time a generation job waited in the queue', ['queue'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+generation_duration_seconds = Histogram(
+    'bot_generation_duration_seconds', 'Generation job run time', ['queue'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+
+# Полосы обработки обновлений (метка - fast или slow)
+lane_queue_seconds = Histogram(
+    'bot_lane_queue_seconds', 'Time an update waited for a slot in its lane', ['lane'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+lane_in_flight = Gauge('bot_lane_in_flight', 'Updates being processed in a lane', ['lane'])
+lane_waiting = Gauge('bot_lane_waiting', 'Updates waiting for a slot in a lane', ['lane'])
+
+# Внешние сервисы: состояние circuit breaker (0 - closed, 1 - half_open, 2 - open),
+# кеш ответов RAG и переходы на ответ без RAG
+circuit_breaker_state = Gauge('bot_circuit_breaker_state', 'Circuit breaker state', ['service'])
+rag_cache_requests_total = Counter('bot_rag_cache_requests_total', 'RAG answer cache lookups', ['result'])
+rag_fallbacks_total = Counter('bot_rag_fallbacks_total', 'Responses produced without RAG', ['mode', 'reason'])
+
+# Пакетные запросы к внешним сервисам: размер пакета и добавленная ожиданием задержка
+batch_size = Histogram('bot_batch_size', 'Queries per batch request', ['service'], buckets=(1, 2, 4, 8, 16, 32, 64))
+batch_queue_seconds = Histogram(
+    'bot_batch_queue_seconds', 'Delay added by waiting for a batch', ['service'],
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+
+# Запросы к внешним сервисам (метка - имя сервиса из реестра): время до ответа
+# на каждую попытку и ошибки по причине (timeout, connection, код ответа)
+external_request_seconds = Histogram(
+    'bot_external_request_seconds', 'External service response time (until headers)', ['service'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+external_request_errors_total = Counter(
+    'bot_external_request_errors_total', 'Failed external service request attempts', ['service', 'reason']
+)
+external_request_retries_total = Counter(
+    'bot_external_request_retries_total', 'Retried external service requests', ['service']
+)
+
+# Трассы по итогу tail sampling: error, slow, sampled - экспортированы;
+# dropped - не попали в выборку; overflow, export_failed - потеряны
+traces_total = Counter('bot_traces_total', 'Finished traces by sampling outcome', ['result'])
+
+# Цикл событий: задержка планирования, зависания дольше порога сторожа и
+# вызовы блокирующих API из потока цикла (в отладочном режиме)
+loop_lag_seconds = Histogram(
+    'bot_event_loop_lag_seconds', 'Event loop scheduling lag',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+loop_stalls_total = Counter('bot_event_loop_stalls_total', 'Event loop stalls longer than the watchdog threshold')
+blocking_calls_total = Counter(
+    'bot_blocking_calls_total', 'Known blocking APIs called on the event loop thread', ['api']
+)
+
+# Дочерние метрики этапов: labels() на каждом вызове заметно дороже словаря
+_stage_metrics: Dict[str, Tuple[Any, Any]] = {}
+
+
+def _stage(stage: str) -> Tuple[Any, Any]:
+    metrics = _stage_metrics.get(stage)
+    if metrics is None:
+        metrics = _stage_metrics[stage] = (stage_seconds.labels(stage), stage_in_flight.labels(stage))
+    return metrics
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Время этапа и число одновременно выполняющихся этапов"""
+    duration, in_flight = _stage(stage)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration.observe(time.perf_counter() - started)
+        in_flight.dec()
+
+
+def timed_stage(stage: str) -> Callable[[F], F]:
+    """Декоратор stage_timer для корутин"""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+# Ограничения: разных стеков в профиле, глубина стека и цепочки await
+MAX_STACKS = 10000
+MAX_DEPTH = 128
+
+
+class ProfilerBusy(Exception):
+    """Профилирование уже выполняется"""
+    pass
+
+
+@dataclass
+class ProfileResult:
+    collapsed: str
+    samples: int
+    duration: float
+    interval: float
+
+
+def _location(code, lineno: Optional[int] = None) -> str:
+    filename = code.co_filename
+    # Путь от site-packages или корня проекта короче и не раскрывает окружение
+    for marker in ("site-packages" + os.sep, os.sep + "src" + os.sep):
+        index = filename.rfind(marker)
+        if index != -1:
+            filename = filename[index + len(marker):]
+            break
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({filename}:{lineno if lineno is not None else code.co_firstlineno})"
+
+
+def _collapse(frame: Optional[FrameType]) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_location(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_chain(coro: Any) -> List[str]:
+    """Где стоит корутина: кадры цепочки await и то, чего ждет последняя"""
+    chain = []
+    while coro is not None and len(chain) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            chain.append(_location(frame.f_code, frame.f_lineno))
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+        if awaited is None:
+            break
+        if not hasattr(awaited, "cr_frame") and not hasattr(awaited, "gi_frame") and not hasattr(awaited, "ag_frame"):
+            chain.append(f"awaiting {type(awaited).__name__}")
+            break
+        coro = awaited
+    return chain
+
+
+class Profiler:
+    """
+    Семплирующий профилировщик цикла событий
+
+    Таймер (ITIMER_REAL) раз в interval прерывает основной поток, обработчик
+    сигнала снимает прерванный стек и помечает выборку корутиной текущей
+    задачи asyncio. Сэмплер в отдельном потоке видел бы цикл в основном в
+    select: GIL достается ему при освобождении основным потоком.
+
+    Обработчик сигнала выполняется только между байткодами, а сигналы,
+    пришедшие за это время, сливаются в один: долгий вызов C, не отпускающий
+    GIL (например, json.loads большого тела), дает одну выборку, причем уже
+    в вызвавшей его функции. Поэтому вес выборки - время с предыдущей в
+    единицах interval: блокировка учитывается полностью и приписывается
+    вызывающему коду, но не самой функции C.
+
+    Результат - collapsed stacks (flamegraph.pl, speedscope). Одновременно
+    выполняется только одно профилирование, длительность и частота выборок
+    ограничены.
+    """
+
+    def __init__(self, max_seconds: float, min_interval: float = 0.001):
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._running = False
+
+    async def profile(self, seconds: float, interval: float = 0.01) -> ProfileResult:
+        """Профиль цикла событий за seconds секунд (цикл должен работать в основном потоке)"""
+        if self._running:
+            raise ProfilerBusy("Profiling is already running")
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("Profiling requires the event loop in the main thread")
+        seconds = max(0.1, min(seconds, self.max_seconds))
+        interval = max(interval, self.min_interval)
+
+        loop = asyncio.get_running_loop()
+        counts: Dict[str, int] = Counter()
+        last_sample = time.monotonic()
+
+        def on_sample(signum: int, frame: Optional[FrameType]):
+            nonlocal last_sample
+            now = time.monotonic()
+            weight = max(1, round((now - last_sample) / interval))
+            last_sample = now
+            stack = _collapse(frame)
+            task = asyncio.current_task(loop)
+            if task is not None:
+                stack.insert(0, f"task:{getattr(task.get_coro(), '__qualname__', task.get_name())}")
+            key = ";".join(stack)
+            if key in counts or len(counts) < MAX_STACKS:
+                counts[key] += weight
+            else:
+                counts["(truncated)"] += weight
+
+        self._running = True
+        previous = signal.signal(signal.SIGALRM, on_sample)
+        started = last_sample = time.monotonic()
+        try:
+            signal.setitimer(signal.ITIMER_REAL, interval, interval)
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+            self._running = False
+
+        collapsed = "\n".join(
+            f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])
+        )
+        return ProfileResult(collapsed, sum(counts.values()), time.monotonic() - started, interval)
+
+
+def task_snapshot(limit: int = 50) -> str:
+    """
+    Снимок задач asyncio, сгруппированных по месту ожидания
+
+    Вызывается из цикла событий. Показываются limit самых частых групп.
+    """
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for task in asyncio.all_tasks():
+        chain = _await_chain(task.get_coro())
+        groups["\n".join(f"    {line}" for line in chain) or "    (no frame)"].append(task.get_name())
+
+    lines = [f"{sum(map(len, groups.values()))} tasks, {len(groups)} distinct stacks"]
+    for chain, names in sorted(groups.items(), key=lambda item: -len(item[1]))[:limit]:
+        sample = ", ".join(names[:3]) + (", ..." if len(names) > 3 else "")
+        lines.append(f"\n{len(names)} x ({sample})\n{chain}")
+    return "\n".join(lines)
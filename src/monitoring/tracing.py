@@ -0,0 +1,337 @@
+import asyncio
+import functools
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+import aiohttp
+from loguru import logger
+
+from .metrics import traces_total
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# Ограничения памяти: спанов в трассе и трасс, ожидающих экспорта
+MAX_SPANS_PER_TRACE = 256
+MAX_PENDING_TRACES = 1000
+
+
+@dataclass
+class Span:
+    trace: "Trace"
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+@dataclass
+class Trace:
+    """
+    Трасса одного обновления
+
+    Спаны пишутся всегда, решение об экспорте принимается по завершении:
+    трасса попала в head-выборку, была медленной или с ошибкой. Трасса
+    завершается, когда закончены корневой спан и все спаны фоновых задач
+    (например, отправка ответа после выхода из обработчика).
+    """
+    trace_id: str
+    sampled: bool
+    spans: List[Span] = field(default_factory=list)
+    open_spans: int = 0
+    dropped_spans: int = 0
+    root: Optional[Span] = None
+    failed: bool = False
+    finished: bool = False
+
+
+class Exporter:
+    """Получатель завершенных трасс (спаны одной трассы - одним вызовом)"""
+
+    async def export(self, spans: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class JsonlExporter(Exporter):
+    """Спаны построчно в локальный JSONL файл (запись вне цикла событий)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _write(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def export(self, spans: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in spans)
+        await asyncio.to_thread(self._write, lines)
+
+
+class OtlpExporter(Exporter):
+    """Спаны в OTLP коллектор (OTLP/HTTP, JSON кодирование)"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.url = f"{endpoint.rstrip('/')}/v1/traces"
+        self.service_name = service_name
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    @staticmethod
+    def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        result = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                encoded = {"boolValue": value}
+            elif isinstance(value, int):
+                encoded = {"intValue": str(value)}
+            elif isinstance(value, float):
+                encoded = {"doubleValue": value}
+            else:
+                encoded = {"stringValue": str(value)}
+            result.append({"key": key, "value": encoded})
+        return result
+
+    def _span(self, span: Dict[str, Any]) -> Dict[str, Any]:
+        encoded = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": self._attributes(span["attributes"]),
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+        if span["parent_id"]:
+            encoded["parentSpanId"] = span["parent_id"]
+        return encoded
+
+    async def export(self, spans: List[Dict[str, Any]]):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "bot"}, "spans": [self._span(span) for span in spans]}],
+            }]
+        }
+        async with self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class Tracer:
+    """
+    Легковесная трассировка обновлений
+
+    Пока exporter не задан, трассы не создаются и span() ничего не делает.
+    Экспорт идет пакетами из фоновой задачи, очередь ограничена.
+    """
+
+    def __init__(self):
+        self.exporter: Optional[Exporter] = None
+        self.sample_rate = 0.0
+        self.slow_threshold = float("inf")
+        self._pending: List[List[Dict[str, Any]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def configure(self, exporter: Exporter, sample_rate: float, slow_threshold: float):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+        """
+        Корневой спан новой трассы
+
+        :param traceparent: W3C traceparent - продолжить трассу другого процесса
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent_id = None
+        trace = None
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) == 4:
+                trace = Trace(parts[1], sampled=parts[3] == "01")
+                parent_id = parts[2]
+        if trace is None:
+            trace = Trace(_new_id(16), sampled=random.random() < self.sample_rate)
+
+        with self._span(trace, parent_id, name, attributes) as root:
+            trace.root = root
+            yield root
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Дочерний спан текущего (вне трассы ничего не делает)"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        with self._span(parent.trace, parent.span_id, name, attributes) as span:
+            yield span
+
+    @contextmanager
+    def _span(self, trace: Trace, parent_id: Optional[str], name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        span = Span(trace, _new_id(8), parent_id, name, time.time_ns(), attributes=attributes)
+        trace.open_spans += 1
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            # Отмена (например, ненужной спекулятивной генерации) - не сбой хода
+            if not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+                trace.failed = True
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            trace.open_spans -= 1
+            # Спаны фоновых задач, начатых после экспорта трассы, не учитываются
+            if not trace.finished:
+                if len(trace.spans) < MAX_SPANS_PER_TRACE:
+                    trace.spans.append(span)
+                else:
+                    trace.dropped_spans += 1
+                if trace.open_spans == 0 and trace.root is not None and trace.root.end_ns:
+                    # Задачи, запущенные в конце хода, успевают открыть свои спаны
+                    asyncio.get_running_loop().call_soon(self._maybe_finish, trace)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def traceparent(self) -> Optional[str]:
+        """W3C traceparent текущего спана для исходящих запросов"""
+        span = _current_span.get()
+        if span is None:
+            return None
+        return f"00-{span.trace.trace_id}-{span.span_id}-{'01' if span.trace.sampled else '00'}"
+
+    def inject(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """Добавляет traceparent в заголовки запроса"""
+        traceparent = self.traceparent()
+        if traceparent is not None:
+            headers["traceparent"] = traceparent
+        return headers
+
+    def _maybe_finish(self, trace: Trace):
+        if trace.open_spans == 0 and not trace.finished:
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        trace.finished = True
+        root = trace.root
+        # Длительность хода - до конца последнего спана, включая фоновую отправку
+        duration = (max(span.end_ns for span in trace.spans) - root.start_ns) / 1e9
+        # Tail sampling: медленные и неудачные трассы сохраняются всегда
+        if trace.failed:
+            reason = "error"
+        elif duration >= self.slow_threshold:
+            reason = "slow"
+        elif trace.sampled:
+            reason = "sampled"
+        else:
+            traces_total.labels("dropped").inc()
+            return
+
+        if len(self._pending) >= MAX_PENDING_TRACES:
+            traces_total.labels("overflow").inc()
+            return
+        traces_total.labels(reason).inc()
+        if trace.dropped_spans:
+            root.attributes["dropped_spans"] = trace.dropped_spans
+        self._pending.append([span.to_dict() for span in trace.spans])
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_loop())
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self.flush()
+            # Пакетируем экспорт: не чаще раза в секунду
+            await asyncio.sleep(1.0)
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending or self.exporter is None:
+            return
+        try:
+            await self.exporter.export([span for spans in pending for span in spans])
+        except Exception as e:
+            traces_total.labels("export_failed").inc(len(pending))
+            logger.warning(f"Failed to export {len(pending)} traces: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        if self.exporter is not None:
+            await self.exporter.close()
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Декоратор: корутина выполняется в дочернем спане name"""
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Глобальный трассировщик (настраивается в setup_tracing при запуске)
+tracer = Tracer()
@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import json
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, List, Optional, Set, Tuple
+from loguru import logger
+
+from .metrics import blocking_calls_total, loop_lag_seconds, loop_stalls_total
+
+# Кадров стека в предупреждении
+MAX_STACK_FRAMES = 30
+
+
+class LoopWatchdog:
+    """
+    Сторож цикла событий
+
+    Задача в цикле раз в interval засыпает и отмечает, насколько позже срока
+    проснулась (гистограмма bot_event_loop_lag_seconds). Отдельный поток
+    следит за отметками: если цикл не отвечает дольше threshold, снимается
+    стек потока цикла - это и есть блокирующий код - и пишется в лог один раз
+    за зависание. Код на C, не отпускающий GIL (например, json.loads большого
+    тела), поток увидит только после возврата из него.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - started - self.interval)
+            loop_lag_seconds.observe(self.lag)
+            if self.lag >= self.threshold:
+                logger.warning(f"Event loop was blocked for {self.lag:.2f}s")
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            loop_stalls_total.inc()
+            stack = "".join(traceback.format_stack(frame, limit=MAX_STACK_FRAMES))
+            logger.warning(f"Event loop blocked for {stalled:.2f}s, loop thread stack:\n{stack}")
+
+    def start(self):
+        """Запускается из цикла событий, за которым нужно следить"""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+
+def _on_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class BlockingCallDetector:
+    """
+    Отладочный режим: известные блокирующие API, вызванные из потока цикла событий
+
+    Подменяет time.sleep, socket.getaddrinfo, requests и json.loads больших
+    тел (от json_min_bytes) обертками, которые при вызове из работающего цикла
+    считают вызов в bot_blocking_calls_total и пишут стек в лог (один раз на
+    место вызова). Вызовы из потоков (asyncio.to_thread) не отмечаются.
+    Импортированные через from ... import функции не подменяются.
+    """
+
+    def __init__(self, json_min_bytes: int):
+        self.json_min_bytes = json_min_bytes
+        self._seen: Set[Tuple[str, str]] = set()
+        self._patched: List[Tuple[Any, str, Any]] = []
+
+    def _report(self, api: str):
+        blocking_calls_total.labels(api).inc()
+        # Кадр, вызвавший обертку
+        stack = traceback.extract_stack(sys._getframe(2), limit=MAX_STACK_FRAMES)
+        site = f"{stack[-1].filename}:{stack[-1].lineno}"
+        if (api, site) in self._seen:
+            return
+        self._seen.add((api, site))
+        logger.warning(
+            f"Blocking call {api} on the event loop thread at {site}:\n{''.join(traceback.format_list(stack))}"
+        )
+
+    def _wrap(self, owner: Any, attr: str, api: str, condition: Optional[Callable[..., bool]] = None):
+        original = getattr(owner, attr)
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if (condition is None or condition(*args, **kwargs)) and _on_loop_thread():
+                self._report(api)
+            return original(*args, **kwargs)
+
+        setattr(owner, attr, wrapper)
+        self._patched.append((owner, attr, original))
+
+    def install(self):
+        if self._patched:
+            return
+        self._wrap(time, "sleep", "time.sleep")
+        self._wrap(socket, "getaddrinfo", "socket.getaddrinfo")
+        self._wrap(json, "loads", "json.loads", lambda s, *args, **kwargs: len(s) >= self.json_min_bytes)
+        try:
+            import requests
+        except ImportError:
+            pass
+        else:
+            # requests.get/post и т.п. проходят через Session.request
+            self._wrap(requests.Session, "request", "requests")
+        logger.warning("Blocking call detection is enabled (debug mode)")
+
+    def uninstall(self):
+        for owner, attr, original in reversed(self._patched):
+            setattr(owner, attr, original)
+        self._patched = []